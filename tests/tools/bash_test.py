@@ -1,11 +1,24 @@
+from pathlib import Path
+from unittest.mock import MagicMock
+
 import pytest
+import pytest_asyncio
 
-from computer_use_demo.tools.bash import BashTool, ToolError
+from computer_use_demo.tools.bash import (
+    BashTool,
+    OutputChunk,
+    ToolError,
+    _BashSession,
+    _OutputCapture,
+)
+from computer_use_demo.tools.cache import CommandCache
 
 
-@pytest.fixture
-def bash_tool():
-    return BashTool()
+@pytest_asyncio.fixture
+async def bash_tool():
+    tool = BashTool()
+    yield tool
+    await tool.close()
 
 
 @pytest.mark.asyncio
@@ -60,12 +73,224 @@ async def test_bash_tool_non_zero_exit(bash_tool):
     assert result.output.strip() == ""
 
 
+@pytest.mark.asyncio
+async def test_bash_tool_named_sessions(bash_tool):
+    result = await bash_tool(command="echo 'in build'", session="build")
+    assert "in build" in result.output
+    await bash_tool(command="echo 'in default'")
+
+    assert bash_tool._sessions["build"] is not bash_tool._session
+
+
+@pytest.mark.asyncio
+async def test_bash_tool_warm_pool(bash_tool):
+    await bash_tool.warm_up()
+    warm = bash_tool._pool._ready[0]
+
+    await bash_tool(command="echo 'warm'")
+    assert bash_tool._session is warm
+
+    # the pool refills in the background, so a restart is handed a warm shell too
+    await bash_tool.warm_up()
+    assert len(bash_tool._pool._ready) == bash_tool._pool.size
+
+
+@pytest.mark.asyncio
+async def test_bash_tool_streams_output(bash_tool):
+    chunks: list[OutputChunk] = []
+    result = await bash_tool(command="echo 'streamed'", on_output=chunks.append)
+    assert "streamed" in "".join(c.text for c in chunks if c.stream == "stdout")
+    assert "streamed" in result.output
+
+
+@pytest.mark.asyncio
+async def test_bash_tool_stream_stop_early(bash_tool):
+    result = await bash_tool(
+        command="echo 'first' && ping -n 3 127.0.0.1 > nul && echo 'last'",
+        on_output=lambda chunk: "first" in chunk.text,
+    )
+    assert "first" in result.output
+    assert "still running" in result.system
+
+    # the abandoned command's output does not leak into the next one
+    result = await bash_tool(command="echo 'next'")
+    assert result.output.strip() == "next"
+
+
 @pytest.mark.asyncio
 async def test_bash_tool_timeout(bash_tool):
     await bash_tool(command="echo 'Hello, World!'")
     bash_tool._session._timeout = 0.1  # Set a very short timeout for testing
-    with pytest.raises(
-        ToolError,
-        match="timed out: bash has not returned in 0.1 seconds and must be restarted",
-    ):
-        await bash_tool(command="sleep 1")
+    result = await bash_tool(command="echo 'before' && ping -n 3 127.0.0.1")
+    assert "before" in result.output
+    assert result.system.startswith("timed out")
+
+    # only the command was interrupted; the session keeps working
+    result = await bash_tool(command="echo 'Hello again'")
+    assert result.output.strip() == "Hello again"
+
+
+@pytest.mark.asyncio
+async def test_bash_tool_per_command_timeout(bash_tool):
+    result = await bash_tool(command="ping -n 3 127.0.0.1", timeout=0.1)
+    assert "0.1 seconds" in result.system
+    assert bash_tool._session._timeout == 120.0
+
+
+@pytest.mark.asyncio
+async def test_bash_tool_reports_the_timeout_that_expired(bash_tool, monkeypatch):
+    await bash_tool(command="echo 'ready'")
+
+    async def stuck():
+        return False
+
+    monkeypatch.setattr(bash_tool._session, "_interrupt", stuck)
+    with pytest.raises(ToolError, match="0.1 seconds"):
+        await bash_tool(command="ping -n 3 127.0.0.1", timeout=0.1)
+    # the session stays unusable, and says after which timeout
+    with pytest.raises(ToolError, match="0.1 seconds"):
+        await bash_tool(command="echo 'again'")
+
+
+@pytest.mark.asyncio
+async def test_bash_session_zero_timeout_is_not_the_default(monkeypatch):
+    session = _BashSession()
+    timeouts = []
+
+    async def run(command, on_output, timeout):
+        timeouts.append(timeout)
+
+    monkeypatch.setattr(session, "_run", run)
+    await session.run("dir", timeout=0)
+    await session.run("dir")
+    assert timeouts == [0, session._timeout]
+    with pytest.raises(ToolError, match="must not be negative"):
+        await session.run("dir", timeout=-1)
+
+
+@pytest.mark.asyncio
+async def test_bash_session_interrupt_spares_earlier_processes(monkeypatch):
+    session = _BashSession()
+    session._shell_pids = {1}
+    session._command_started = 1000.0
+    shell = MagicMock(pid=1, create_time=MagicMock(return_value=1000.5))
+    background = MagicMock(pid=2, create_time=MagicMock(return_value=900.0))
+    command = MagicMock(pid=3, create_time=MagicMock(return_value=1000.5))
+    monkeypatch.setattr(session, "_children", lambda: [shell, background, command])
+
+    async def prompt():
+        return True
+
+    monkeypatch.setattr(session, "_wait_for_sentinel", prompt)
+    assert await session._interrupt()
+    command.kill.assert_called_once()
+    shell.kill.assert_not_called()
+    background.kill.assert_not_called()
+
+
+def test_bash_session_sentinel_split_across_reads():
+    session = _BashSession()
+    session._feed_stdout(b"hello\nEND_OF")
+    assert not session._sentinel_seen
+    session._feed_stdout(b"_COMMAND\n")
+    assert session._sentinel_seen
+    assert session._take_output() == ("hello", "")
+
+
+def test_bash_session_output_without_trailing_newline():
+    # `echo.` puts the sentinel on a line of its own; that line break is not output
+    session = _BashSession()
+    session._feed_stdout(b"C:\\>set /p =abc <nul && echo.&& echo END_OF_COMMAND\r\n")
+    session._feed_stdout(b"abc\r")
+    assert not session._sentinel_seen
+    session._feed_stdout(b"\nEND_OF_COMMAND\r\n")
+    assert session._sentinel_seen
+    output, _ = session._take_output()
+    assert output.endswith("abc")
+
+    # a trailing newline of the command's own is kept
+    session._feed_stdout(b"abc\r\n\r\nEND_OF_COMMAND\r\n")
+    assert session._sentinel_seen
+    assert session._take_output() == ("abc\r\n", "")
+
+
+def test_bash_session_reports_its_directory_with_the_sentinel():
+    session = _BashSession()
+    session._feed_stdout(b"C:\\>cd /d C:\\work & echo.& call echo END_OF_COMMAND %^CD%\r\n")
+    session._feed_stdout(b"\r\nEND_OF_COMMAND C:\\wo")
+    # the sentinel only counts once its line, with the directory, is complete
+    assert not session._sentinel_seen
+    session._feed_stdout(b"rk\r\n")
+    assert session._sentinel_seen
+    assert session.cwd() == "C:\\work"
+
+    # a directory that was not reported is not guessed at
+    session._take_output()
+    session._feed_stdout(b"\r\nEND_OF_COMMAND %CD%\r\n")
+    assert session._sentinel_seen
+    assert session.cwd() is None
+
+
+@pytest.mark.asyncio
+async def test_bash_tool_cache_follows_cd(tmp_path):
+    (tmp_path / "one").mkdir()
+    (tmp_path / "two").mkdir()
+    (tmp_path / "one" / "a.txt").write_text("from one")
+    (tmp_path / "two" / "a.txt").write_text("from two")
+    bash_tool = BashTool(cache=CommandCache())
+    try:
+        await bash_tool(command=f'cd /d "{tmp_path / "one"}"')
+        assert bash_tool._session.cwd() == str(tmp_path / "one")
+        assert "from one" in (await bash_tool(command="type a.txt")).output
+        await bash_tool(command=f'cd /d "{tmp_path / "two"}"')
+        assert "from two" in (await bash_tool(command="type a.txt")).output
+    finally:
+        await bash_tool.close()
+
+
+def test_bash_session_ignores_echoed_sentinel():
+    session = _BashSession()
+    session._feed_stdout(b"C:\\>echo hi && echo END_OF_COMMAND\r\n")
+    assert not session._sentinel_seen
+    session._feed_stdout(b"hi\r\nEND_OF_COMMAND\r\n")
+    assert session._sentinel_seen
+
+
+def test_output_capture_keeps_head_and_tail_in_memory():
+    # a budget of 4 tokens is 16 characters: 8 for the head and 8 for the tail
+    capture = _OutputCapture("stdout", max_tokens=4)
+    capture.write(b"start\n")
+    assert capture.spill_path is None
+    for i in range(100):
+        capture.write(f"line {i}\n".encode())
+    capture.close()
+
+    text = capture.getvalue()
+    assert text.startswith("start\n<response clipped>")
+    assert text.endswith("\nline 99\n")
+    assert capture.spill_path in text
+    assert Path(capture.spill_path).read_text() == "start\n" + "".join(
+        f"line {i}\n" for i in range(100)
+    )
+    capture.discard()
+    assert not Path(capture.spill_path).exists()
+
+
+def test_bash_session_keeps_only_recent_full_logs(monkeypatch):
+    monkeypatch.setattr(_BashSession, "_max_output_tokens", 4)
+    monkeypatch.setattr(_BashSession, "_max_spill_files", 2)
+    session = _BashSession()
+    paths = []
+    for i in range(3):
+        session._feed_stdout(f"{i}".encode() * 100 + b"\nEND_OF_COMMAND\n")
+        output, _ = session._take_output()
+        paths.append(session._spills[-1][0])
+        assert paths[-1] in output
+    # only the latest logs stay on disk
+    assert [Path(path).exists() for path in paths] == [False, True, True]
+
+    # stopping the session removes the rest
+    session._started = True
+    session._process = MagicMock(returncode=0)
+    session.stop()
+    assert not any(Path(path).exists() for path in paths)
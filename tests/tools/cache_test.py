@@ -0,0 +1,67 @@
+import os
+
+from computer_use_demo.tools.cache import CommandCache, command_kind, invalidate_paths
+
+
+def test_command_kind():
+    assert command_kind("dir /b") == "read"
+    assert command_kind('type "notes.txt"') == "read"
+    assert command_kind("git status") == "read"
+    assert command_kind("cd src") == "neutral"
+    assert command_kind("git commit -m wip") == "write"
+    assert command_kind("git diff --output=changes.diff") == "write"
+    assert command_kind("git log --output changes.log") == "write"
+    assert command_kind("git diff -o changes.diff") == "write"
+    assert command_kind("git diff --output-indicator-new=+") == "read"
+    assert command_kind("find . -delete") == "write"
+    assert command_kind("dir > listing.txt") == "write"
+    assert command_kind("python script.py") == "write"
+
+
+def test_cache_hit_and_miss(tmp_path):
+    (tmp_path / "a.txt").write_text("a")
+    cache = CommandCache()
+    cache.put("type a.txt", str(tmp_path), "a")
+    assert cache.get("type a.txt", str(tmp_path)) == "a"
+    assert cache.get("type a.txt", str(tmp_path / "other")) is None
+    assert cache.stats == {"entries": 1, "hits": 1, "misses": 1, "invalidations": 0}
+
+
+def test_cache_notices_changed_files(tmp_path):
+    path = tmp_path / "a.txt"
+    path.write_text("a")
+    cache = CommandCache()
+    cache.put("type a.txt", str(tmp_path), "a")
+    path.write_text("changed")
+    os.utime(path, ns=(0, 0))
+    assert cache.get("type a.txt", str(tmp_path)) is None
+
+
+def test_cache_invalidation(tmp_path):
+    (tmp_path / "a.txt").write_text("a")
+    cache = CommandCache()
+    cache.put("dir", str(tmp_path), "listing")
+    cache.put("type a.txt", str(tmp_path), "a")
+
+    # a write somewhere below the listed directory invalidates the listing
+    invalidate_paths(tmp_path / "sub" / "b.txt")
+    assert cache.get("dir", str(tmp_path)) is None
+    assert len(cache) == 0
+
+    cache.put("type a.txt", str(tmp_path), "a")
+    cache.put("echo done > out.txt", str(tmp_path), "")
+    assert len(cache) == 0
+
+    cache.put("type a.txt", str(tmp_path), "a")
+    cache.put("git diff --output=changes.diff", str(tmp_path), "")
+    assert len(cache) == 0
+
+
+def test_cache_evicts_least_recently_used(tmp_path):
+    cache = CommandCache(max_entries=2)
+    cache.put("dir a", str(tmp_path), 1)
+    cache.put("dir b", str(tmp_path), 2)
+    assert cache.get("dir a", str(tmp_path)) == 1
+    cache.put("dir c", str(tmp_path), 3)
+    assert cache.get("dir b", str(tmp_path)) is None
+    assert cache.get("dir a", str(tmp_path)) == 1
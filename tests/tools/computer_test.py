@@ -1,13 +1,25 @@
-from unittest.mock import AsyncMock, patch
+import asyncio
+import base64
+import io
+import os
+import re
+import threading
+import time
+from unittest.mock import AsyncMock, MagicMock, patch
 
 import pytest
+from PIL import Image
 
 from computer_use_demo.tools.computer import (
     ComputerTool,
     ScalingSource,
     ToolError,
+    InputExecutor,
     ToolResult,
+    encode_image,
 )
+from computer_use_demo.tools.screen import ImageGrabBackend
+from computer_use_demo.tools.store import ScreenshotStore
 
 
 @pytest.fixture
@@ -54,6 +66,279 @@ async def test_computer_tool_screenshot(computer_tool):
         assert result.base64_image == "base64_screenshot"
 
 
+@pytest.mark.asyncio
+async def test_computer_tool_screenshot_is_scaled_in_memory(monkeypatch, tmp_path):
+    monkeypatch.setenv("WIDTH", "1920")
+    monkeypatch.setenv("HEIGHT", "1080")
+    monkeypatch.setattr("computer_use_demo.tools.computer.OUTPUT_DIR", str(tmp_path))
+    computer_tool = ComputerTool(capture=ImageGrabBackend())
+    with patch(
+        "computer_use_demo.tools.screen.ImageGrab.grab",
+        return_value=Image.new("RGB", (1920, 1080)),
+    ):
+        result = await computer_tool.screenshot()
+
+    image = Image.open(io.BytesIO(base64.b64decode(result.base64_image)))
+    assert image.format == "PNG"
+    assert image.size == (1366, 768)
+    assert not any(tmp_path.iterdir())
+
+
+@pytest.mark.asyncio
+async def test_computer_tool_screenshot_is_stored_by_hash(tmp_path):
+    capture = MagicMock()
+    capture.grab.return_value = Image.new("RGB", (1024, 768), "white")
+    store = ScreenshotStore(tmp_path)
+    computer_tool = ComputerTool(capture=capture, store=store)
+    result = await computer_tool.screenshot()
+    assert store.get(result.image_hash) == base64.b64decode(result.base64_image)
+
+
+@pytest.mark.asyncio
+async def test_computer_tool_screenshot_skips_unchanged_frames(monkeypatch):
+    monkeypatch.setenv("WIDTH", "1024")
+    monkeypatch.setenv("HEIGHT", "768")
+    computer_tool = ComputerTool(capture=ImageGrabBackend())
+    frame = Image.new("RGB", (1024, 768), "white")
+    with patch(
+        "computer_use_demo.tools.screen.ImageGrab.grab",
+        side_effect=lambda **kwargs: frame.copy(),
+    ):
+        assert (await computer_tool.screenshot()).base64_image
+        result = await computer_tool.screenshot()
+        assert result.base64_image is None
+        assert result.output == "screen unchanged since last screenshot"
+        assert (await computer_tool.screenshot(force=True)).base64_image
+
+        # a single typed character is a change
+        frame.paste("black", (500, 400, 508, 414))
+        assert (await computer_tool.screenshot()).base64_image
+
+
+@pytest.mark.asyncio
+async def test_computer_tool_screenshot_region_mode(monkeypatch):
+    monkeypatch.setenv("WIDTH", "1024")
+    monkeypatch.setenv("HEIGHT", "768")
+    computer_tool = ComputerTool(capture=ImageGrabBackend())
+    frame = Image.new("RGB", (1024, 768), "white")
+    with patch(
+        "computer_use_demo.tools.screen.ImageGrab.grab",
+        side_effect=lambda **kwargs: frame.copy(),
+    ):
+        assert (await computer_tool.screenshot(region=True)).output is None
+
+        frame.paste("black", (100, 200, 150, 220))
+        result = await computer_tool.screenshot(region=True)
+        image = Image.open(io.BytesIO(base64.b64decode(result.base64_image)))
+        assert image.size == (66, 36)
+        assert "spans (92, 192) to (158, 228)" in result.output
+
+        # a large change sends the full frame
+        frame.paste("red", (0, 0, 1024, 600))
+        result = await computer_tool.screenshot(region=True)
+        image = Image.open(io.BytesIO(base64.b64decode(result.base64_image)))
+        assert image.size == (1024, 768)
+        assert result.output is None
+
+
+def test_encode_image_picks_format_by_content():
+    text_like = Image.new("RGB", (640, 480), "white")
+    text_like.paste("black", (10, 10, 300, 20))
+    data, encoding = encode_image(text_like, byte_budget=100_000)
+    assert encoding.format == "PNG"
+    assert encoding.media_type == "image/png"
+    assert encoding.size == len(data)
+
+    noise = Image.frombytes("RGB", (640, 480), os.urandom(640 * 480 * 3))
+    data, encoding = encode_image(noise, byte_budget=200_000)
+    assert encoding.format in ("JPEG", "WEBP")
+    assert encoding.quality is not None
+    assert len(data) <= 200_000
+    assert Image.open(io.BytesIO(data)).format == encoding.format
+
+
+@pytest.mark.asyncio
+async def test_computer_tool_batch(computer_tool):
+    computer_tool.width = 1920
+    computer_tool.height = 1080
+    with (
+        patch("computer_use_demo.tools.computer.pyautogui") as mock_pyautogui,
+        patch.object(
+            computer_tool, "screenshot", new_callable=AsyncMock
+        ) as mock_screenshot,
+    ):
+        mock_screenshot.return_value = ToolResult(base64_image="base64_screenshot")
+        result = await computer_tool.batch(
+            [
+                {"action": "mouse_move", "coordinate": (683, 384)},
+                {"action": "left_click", "wait": 0.01},
+                {"action": "type", "text": "hello"},
+            ]
+        )
+        mock_pyautogui.moveTo.assert_called_once_with(960, 540)
+        mock_pyautogui.click.assert_called_once()
+        mock_screenshot.assert_called_once()
+        moved, clicked, typed = result.output.split("\n")
+        assert (moved, clicked) == ("Mouse moved to 960, 540", "left_click performed")
+        assert re.fullmatch(r"Typed \(typed, \d+\.\d\ds\): hello", typed)
+        assert result.error is None
+        assert result.base64_image == "base64_screenshot"
+
+        # a failing action stops the batch, but the screenshot is still taken
+        mock_pyautogui.click.side_effect = RuntimeError("fail-safe triggered")
+        result = await computer_tool.batch(
+            [{"action": "left_click"}, {"action": "type", "text": "never typed"}]
+        )
+        assert result.error == "action 1 (left_click) failed: fail-safe triggered"
+        assert result.output is None
+        assert mock_screenshot.call_count == 2
+
+
+@pytest.mark.asyncio
+async def test_computer_tool_batch_is_validated_up_front(computer_tool):
+    with patch("computer_use_demo.tools.computer.pyautogui") as mock_pyautogui:
+        with pytest.raises(ToolError, match=r"action 2 \(type\): text is required"):
+            await computer_tool.batch([{"action": "left_click"}, {"action": "type"}])
+        with pytest.raises(ToolError, match=r"action 2 \(key\): wait must be a non-negative"):
+            await computer_tool.batch(
+                [{"action": "left_click"}, {"action": "key", "text": "a", "wait": "1s"}]
+            )
+        with pytest.raises(ToolError, match="wait must be a non-negative"):
+            await computer_tool.batch([{"action": "left_click", "wait": -1}])
+        mock_pyautogui.click.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_computer_tool_batch_action(computer_tool):
+    with (
+        patch("computer_use_demo.tools.computer.pyautogui") as mock_pyautogui,
+        patch.object(
+            computer_tool, "screenshot", new_callable=AsyncMock
+        ) as mock_screenshot,
+    ):
+        mock_screenshot.return_value = ToolResult(base64_image="base64_screenshot")
+        result = await computer_tool(
+            action="batch",
+            actions=[{"action": "left_click"}, {"action": "key", "text": "Return"}],
+        )
+        mock_pyautogui.click.assert_called_once()
+        mock_pyautogui.press.assert_called_once_with("Return")
+        assert result.output == "left_click performed\nTyped: Return"
+        assert result.base64_image == "base64_screenshot"
+
+        with pytest.raises(ToolError, match="actions is required for batch"):
+            await computer_tool(action="batch")
+        with pytest.raises(ToolError, match="actions is not accepted for left_click"):
+            await computer_tool(action="left_click", actions=[{"action": "left_click"}])
+        with pytest.raises(ToolError, match="cannot contain another batch"):
+            await computer_tool(action="batch", actions=[{"action": "batch"}])
+
+
+@pytest.mark.asyncio
+async def test_computer_tool_type_pastes_long_text(computer_tool):
+    text = "x" * 500
+    clipboard = ["previous"]
+    with (
+        patch("computer_use_demo.tools.computer.pyautogui") as mock_pyautogui,
+        patch(
+            "computer_use_demo.tools.computer.read_clipboard",
+            side_effect=lambda display: clipboard[-1],
+        ),
+        patch(
+            "computer_use_demo.tools.computer.write_clipboard",
+            side_effect=lambda text, display: clipboard.append(text) or True,
+        ),
+    ):
+        computer_tool._paste_settle = 0
+        result = await computer_tool(action="type", text=text)
+        mock_pyautogui.hotkey.assert_called_once()
+        mock_pyautogui.typewrite.assert_not_called()
+    # the result says how the text was entered
+    assert re.fullmatch(rf"Typed \(pasted, \d+\.\d\ds\): {text}", result.output)
+    assert computer_tool.last_text_entry.method == "pasted"
+    # the clipboard is restored afterwards
+    assert clipboard == ["previous", text, "previous"]
+
+
+@pytest.mark.asyncio
+async def test_computer_tool_type_falls_back_to_typing(computer_tool):
+    with (
+        patch("computer_use_demo.tools.computer.pyautogui") as mock_pyautogui,
+        patch("computer_use_demo.tools.computer.read_clipboard", return_value=None),
+        patch("computer_use_demo.tools.computer.write_clipboard", return_value=False),
+    ):
+        result = await computer_tool(action="type", text="y" * 120)
+        mock_pyautogui.hotkey.assert_not_called()
+        # typed a character at a time, with a pause between characters
+        assert [call.args for call in mock_pyautogui.typewrite.call_args_list] == [
+            ("y" * 50, 0.012),
+            ("y" * 50, 0.012),
+            ("y" * 20, 0.012),
+        ]
+    assert result.output.startswith("Typed (typed, ")
+    assert computer_tool.last_text_entry.method == "typed"
+    assert computer_tool.last_text_entry.chars == 120
+
+
+@pytest.mark.asyncio
+async def test_computer_tool_screenshot_waits_for_the_screen_to_settle(monkeypatch):
+    monkeypatch.setenv("WIDTH", "1024")
+    monkeypatch.setenv("HEIGHT", "768")
+    # a page that keeps changing for three frames, then stays put
+    frames = [Image.new("RGB", (1024, 768), color) for color in ("red", "green", "blue")]
+    frames += [Image.new("RGB", (1024, 768), "white")] * 10
+    capture = MagicMock()
+    capture.grab.side_effect = frames
+    computer_tool = ComputerTool(capture=capture)
+    computer_tool._settle_interval = 0
+
+    with patch("computer_use_demo.tools.computer.pyautogui"):
+        await computer_tool(action="left_click")
+    result = await computer_tool.screenshot()
+    # three changing frames, three matching ones, then the screenshot itself
+    assert capture.grab.call_count == 7
+    assert computer_tool.last_settle_time is not None
+    assert result.base64_image
+
+    # without an action in between, there is nothing to wait for
+    await computer_tool.screenshot(force=True)
+    assert capture.grab.call_count == 8
+
+
+@pytest.mark.asyncio
+async def test_input_executor_keeps_order_off_the_event_loop():
+    executor = InputExecutor()
+    calls = []
+
+    def slow_input(name):
+        time.sleep(0.05)
+        calls.append((name, threading.current_thread().name))
+
+    ticks = 0
+
+    async def ticker():
+        nonlocal ticks
+        while True:
+            ticks += 1
+            await asyncio.sleep(0.005)
+
+    tick_task = asyncio.create_task(ticker())
+    await asyncio.gather(*(executor.run(slow_input, name) for name in "abc"))
+    tick_task.cancel()
+
+    assert [name for name, _ in calls] == ["a", "b", "c"]
+    assert len({thread for _, thread in calls}) == 1
+    assert calls[0][1] != threading.current_thread().name
+    # the event loop kept running while the input was being sent
+    assert ticks > 5
+    stats = executor.stats
+    assert stats["calls"] == 3
+    assert stats["max_queue_depth"] == 3
+    assert stats["queue_depth"] == 0
+    assert stats["mean_run_ms"] >= 50
+    executor.shutdown()
+
+
 @pytest.mark.asyncio
 async def test_computer_tool_scaling(computer_tool):
     computer_tool._scaling_enabled = True
@@ -137,3 +422,144 @@ async def test_computer_tool_missing_coordinate(computer_tool):
 async def test_computer_tool_missing_text(computer_tool):
     with pytest.raises(ToolError, match="text is required for type"):
         await computer_tool(action="type")
+
+
+@pytest.mark.asyncio
+async def test_computer_tool_locate(tmp_path):
+    pytest.importorskip("numpy")
+    from PIL import ImageDraw
+
+    frame = Image.new("RGB", (1024, 768), (240, 240, 240))
+    draw = ImageDraw.Draw(frame)
+    draw.rectangle((600, 400, 640, 420), fill=(200, 30, 30), outline=(0, 0, 0))
+    draw.line((610, 405, 630, 415), fill=(255, 255, 255), width=3)
+    capture = MagicMock()
+    capture.grab.side_effect = lambda **kwargs: frame.copy()
+    computer_tool = ComputerTool(capture=capture)
+
+    with pytest.raises(ToolError, match="Take a screenshot"):
+        computer_tool.remember_template("dialog-close", (600, 400, 641, 421))
+    await computer_tool.screenshot()
+    computer_tool.remember_template("dialog-close", (598, 398, 643, 423))
+
+    result = await computer_tool.locate("dialog-close")
+    assert result.output.startswith("Match at 620, 410")
+    assert computer_tool.last_matches[0].confidence > 0.99
+
+    with pytest.raises(ToolError, match="Unknown template"):
+        await computer_tool.locate("no-such-template")
+
+    # both are actions of the tool too
+    result = await computer_tool(
+        action="remember_template", template="close", region=[598, 398, 643, 423]
+    )
+    assert result.output == "Stored template close"
+    result = await computer_tool(action="locate", template="close", threshold=0.9)
+    assert result.output.startswith("Match at 620, 410")
+    with pytest.raises(ToolError, match="template is required for locate"):
+        await computer_tool(action="locate")
+    with pytest.raises(ToolError, match="threshold must be between 0 and 1"):
+        await computer_tool(action="locate", template="close", threshold=80)
+    with pytest.raises(ToolError, match="region is required for remember_template"):
+        await computer_tool(action="remember_template", template="close")
+    with pytest.raises(ToolError, match="template is not accepted for left_click"):
+        await computer_tool(action="left_click", template="close")
+
+
+def _changing_capture(frames: list[Image.Image]) -> MagicMock:
+    """A capture backend returning each frame in turn, then the last one for good."""
+    polls = iter(frames)
+    current = frames[0]
+
+    def grab(bbox=None):
+        nonlocal current
+        current = next(polls, current)
+        return current.crop(bbox) if bbox else current.copy()
+
+    capture = MagicMock()
+    capture.grab.side_effect = grab
+    return capture
+
+
+@pytest.mark.asyncio
+async def test_computer_tool_wait_for_pixel_and_region():
+    grey = Image.new("RGB", (1024, 768), (128, 128, 128))
+    loaded = grey.copy()
+    loaded.paste((20, 200, 20), (100, 100, 200, 120))
+    capture = _changing_capture([grey, grey, grey, loaded])
+    computer_tool = ComputerTool(capture=capture)
+
+    result = await computer_tool.wait_for(
+        {"condition": "pixel_color", "coordinate": (150, 110), "color": (20, 200, 20)},
+        timeout=5,
+        interval=0.02,
+    )
+    assert result.output.startswith("pixel_color after")
+    assert result.error is None and result.base64_image
+    # polling grabbed one pixel at a time
+    assert capture.grab.call_args_list[0].args == ((150, 110, 151, 111),)
+
+    capture = _changing_capture([grey, grey, loaded])
+    computer_tool = ComputerTool(capture=capture)
+    result = await computer_tool.wait_for(
+        {"condition": "region_changed", "region": (90, 90, 210, 130)}, interval=0.02
+    )
+    assert result.output.startswith("region_changed after")
+
+    result = await computer_tool.wait_for(
+        {"condition": "region_stable", "region": (90, 90, 210, 130), "stable_for": 0.1},
+        interval=0.02,
+    )
+    assert result.output.startswith("region_stable after")
+
+
+@pytest.mark.asyncio
+async def test_computer_tool_wait_for_times_out():
+    pytest.importorskip("numpy")
+    frame = Image.new("RGB", (1024, 768), (240, 240, 240))
+    frame.paste((0, 0, 0), (300, 300, 340, 320))
+    frame.paste((255, 255, 255), (310, 305, 330, 315))
+    computer_tool = ComputerTool(capture=_changing_capture([frame]))
+    await computer_tool.screenshot()
+    computer_tool.remember_template("spinner", (295, 295, 345, 325))
+
+    start = time.perf_counter()
+    result = await computer_tool.wait_for(
+        {"condition": "template_gone", "template": "spinner"}, timeout=0.2, interval=0.05
+    )
+    assert time.perf_counter() - start < 2
+    assert result.error.startswith("Timed out after")
+    assert result.base64_image
+
+    with pytest.raises(ToolError, match="Invalid wait condition"):
+        await computer_tool.wait_for({"condition": "page_loaded"})
+    with pytest.raises(ToolError, match="not inside the screen"):
+        await computer_tool.wait_for({"condition": "region_changed", "region": (0, 0, 2000, 10)})
+    with pytest.raises(ToolError, match="template is required"):
+        await computer_tool.wait_for({"condition": "template_appeared"})
+
+
+@pytest.mark.asyncio
+async def test_computer_tool_wait_for_action():
+    grey = Image.new("RGB", (1024, 768), (128, 128, 128))
+    loaded = grey.copy()
+    loaded.paste((20, 200, 20), (100, 100, 200, 120))
+    computer_tool = ComputerTool(capture=_changing_capture([grey, grey, loaded]))
+
+    result = await computer_tool(
+        action="wait_for",
+        condition={"condition": "region_changed", "region": [90, 90, 210, 130]},
+        timeout=5,
+        interval=0.02,
+    )
+    assert result.output.startswith("region_changed after")
+    assert result.base64_image
+
+    with pytest.raises(ToolError, match="condition is required for wait_for"):
+        await computer_tool(action="wait_for")
+    with pytest.raises(ToolError, match="interval must be positive"):
+        await computer_tool(
+            action="wait_for", condition={"condition": "region_stable"}, interval=0
+        )
+    with pytest.raises(ToolError, match="timeout is not accepted for left_click"):
+        await computer_tool(action="left_click", timeout=5)
@@ -0,0 +1,119 @@
+import asyncio
+import socket
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from computer_use_demo.tools.computer import ComputerTool
+from computer_use_demo.tools.display import Display, DisplayPool, XdotoolInput
+
+
+class _FakeDisplay(Display):
+    alive = True
+
+    def healthy(self) -> bool:
+        return self.alive
+
+
+class _FakePool(DisplayPool):
+    """A pool that hands out fake displays instead of starting X servers."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.launched: list[int] = []
+        self.stopped: list[int] = []
+
+    async def start(self):
+        for number in self._numbers:
+            self._ready.put_nowait(await self._launch(number))
+
+    async def _launch(self, number: int) -> Display:
+        self.launched.append(number)
+        return _FakeDisplay(number, self.width, self.height)
+
+    async def _stop(self, display: Display):
+        self.stopped.append(display.number)
+
+
+@pytest.mark.asyncio
+async def test_display_pool_leases_and_recycles():
+    pool = _FakePool(2, first_display=20)
+    await pool.start()
+    async with pool.lease() as first, pool.lease() as second:
+        assert {first.number, second.number} == {20, 21}
+        assert pool.stats["leased"] == 2
+        assert pool.stats["ready"] == 0
+
+    await asyncio.sleep(0)  # let the recycling tasks run
+    await asyncio.gather(*pool._refills)
+    assert sorted(pool.stopped) == [20, 21]
+    assert pool.stats["ready"] == 2
+    assert pool.stats["leases"] == 2
+    assert 0 < pool.stats["utilisation"] <= 1
+
+
+@pytest.mark.asyncio
+async def test_display_pool_waits_for_a_free_display():
+    pool = _FakePool(1, recycle=False)
+    await pool.start()
+    display = await pool.acquire()
+    waiter = asyncio.create_task(pool.acquire())
+    await asyncio.sleep(0.05)
+    assert not waiter.done()
+    pool.release(display)
+    assert (await waiter).number == display.number
+    assert pool.stats["max_wait_s"] >= 0.05
+    assert pool.stopped == []
+
+
+@pytest.mark.asyncio
+async def test_display_pool_replaces_unhealthy_displays():
+    pool = _FakePool(1, recycle=False)
+    await pool.start()
+    display = await pool.acquire()
+    display.alive = False
+    pool.release(display)
+    fresh = await pool.acquire()
+    assert fresh is not display
+    assert pool.stopped == [display.number]
+
+
+def test_display_health_probes_the_server(tmp_path, monkeypatch):
+    monkeypatch.setattr("computer_use_demo.tools.display.X11_SOCKET_DIR", str(tmp_path))
+    display = Display(7, 800, 600)
+    assert not display.healthy()
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as server:
+        server.bind(str(tmp_path / "X7"))
+        server.listen()
+        assert display.healthy()
+    # the socket file a killed server leaves behind accepts no connections
+    assert (tmp_path / "X7").exists()
+    assert not display.healthy()
+
+
+def test_xdotool_input_targets_its_display():
+    mouse = XdotoolInput(":7")
+    with patch("subprocess.run") as run:
+        run.return_value = MagicMock(stdout=b"X=10\nY=20\nSCREEN=0\nWINDOW=1\n")
+        assert mouse.position() == (10, 20)
+        mouse.hotkey("ctrl", "v")
+        mouse.typewrite("hi", 0.02)
+
+    assert run.call_args_list[0].args[0] == ["xdotool", "getmouselocation", "--shell"]
+    assert run.call_args_list[1].args[0] == ["xdotool", "key", "--", "ctrl+v"]
+    assert run.call_args_list[2].args[0] == ["xdotool", "type", "--delay", "20", "--", "hi"]
+    assert all(call.kwargs["env"]["DISPLAY"] == ":7" for call in run.call_args_list)
+
+
+@pytest.mark.asyncio
+async def test_computer_tool_uses_display_handle():
+    display = Display(7, 800, 600)
+    computer_tool = ComputerTool(capture=MagicMock(), display=display)
+    assert (computer_tool.width, computer_tool.height) == (800, 600)
+    assert computer_tool.options["display_number"] == 7
+
+    with patch("subprocess.run") as run:
+        await computer_tool(action="left_click")
+    assert run.call_args.args[0] == ["xdotool", "click", "1"]
+    assert run.call_args.kwargs["env"]["DISPLAY"] == ":7"
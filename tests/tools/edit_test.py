@@ -8,7 +8,7 @@ from computer_use_demo.tools.edit import EditTool
 
 
 @pytest.mark.asyncio
-async def test_view_command():
+async def test_view_command(tmp_path):
     edit_tool = EditTool()
 
     # Test viewing a file that exists
@@ -22,15 +22,13 @@ async def test_view_command():
         assert "File content" in result.output
 
     # Test viewing a directory
-    with patch("pathlib.Path.exists", return_value=True), patch(
-        "pathlib.Path.is_dir", return_value=True
-    ), patch("computer_use_demo.tools.edit.run") as mock_run:
-        mock_run.return_value = (None, "file1.txt\nfile2.txt", None)
-        result = await edit_tool(command="view", path="/test/dir")
-        assert isinstance(result, CLIResult)
-        assert result.output
-        assert "file1.txt" in result.output
-        assert "file2.txt" in result.output
+    (tmp_path / "file1.txt").write_text("")
+    (tmp_path / "file2.txt").write_text("")
+    result = await edit_tool(command="view", path=str(tmp_path))
+    assert isinstance(result, CLIResult)
+    assert result.output
+    assert "file1.txt" in result.output
+    assert "file2.txt" in result.output
 
     # Test viewing a file with a specific range
     with patch("pathlib.Path.exists", return_value=True), patch(
@@ -328,3 +326,56 @@ async def test_validate_path():
         "pathlib.Path.is_dir", return_value=True
     ):
         edit_tool.validate_path("view", Path("/directory/path"))
+
+
+@pytest.mark.asyncio
+async def test_batch_command(tmp_path):
+    edit_tool = EditTool()
+    path = tmp_path / "module.py"
+    original = "".join(f"line {i}\n" for i in range(1, 31))
+    path.write_text(original)
+
+    result = await edit_tool(
+        command="batch",
+        path=str(path),
+        edits=[
+            {"command": "str_replace", "old_str": "line 3\n", "new_str": "line three\n"},
+            {"command": "insert", "insert_line": 0, "new_str": "# header"},
+            {"command": "str_replace", "old_str": "line 25", "new_str": "line 25\nextra"},
+        ],
+    )
+    assert "has been edited with 3 edits" in result.output
+    # the first two edits share a block; the third has its own, with real line numbers
+    assert "     1\t# header\n" in result.output
+    assert "     4\tline three\n" in result.output
+    assert "   ...\n" in result.output
+    assert "    26\tline 25\n    27\textra\n" in result.output
+    lines = path.read_text().split("\n")
+    assert lines[:4] == ["# header", "line 1", "line 2", "line three"]
+    assert lines[26] == "extra"
+    assert not [p for p in tmp_path.iterdir() if p.name != "module.py"]
+
+    # one undo reverts the whole batch
+    await edit_tool(command="undo_edit", path=str(path))
+    assert path.read_text() == original
+
+    # a failing edit leaves the file untouched
+    with pytest.raises(ToolError, match=r"No edits were made. Edit 2 \(str_replace\) failed"):
+        await edit_tool(
+            command="batch",
+            path=str(path),
+            edits=[
+                {"command": "str_replace", "old_str": "line 1\n", "new_str": "first\n"},
+                {"command": "str_replace", "old_str": "line 2", "new_str": "second"},
+            ],
+        )
+    assert path.read_text() == original
+
+
+@pytest.mark.asyncio
+async def test_str_replace_reports_lines_of_every_occurrence(tmp_path):
+    edit_tool = EditTool()
+    path = tmp_path / "file.txt"
+    path.write_text("a = 1\nb = 2\na = 1\n")
+    with pytest.raises(ToolError, match=r"in lines \[1, 3\]"):
+        await edit_tool(command="str_replace", path=str(path), old_str="a = 1", new_str="c")
@@ -0,0 +1,91 @@
+import random
+from pathlib import Path
+
+from computer_use_demo.tools.history import EditHistory
+
+PATH = Path("/test/file.txt")
+
+
+def _versions(count: int, size: int, seed: int = 0) -> list[str]:
+    """Successive versions of a text, each a small local edit of the one before."""
+    rng = random.Random(seed)
+    text = "".join(rng.choice("abc \n\ré中") for _ in range(size))
+    versions = [text]
+    for _ in range(count - 1):
+        start = rng.randrange(len(text))
+        end = min(len(text), start + rng.randrange(0, 20))
+        inserted = "".join(rng.choice("xyz\r\n") for _ in range(rng.randrange(0, 20)))
+        text = text[:start] + inserted + text[end:]
+        versions.append(text)
+    return versions
+
+
+def test_history_restores_every_version_exactly():
+    history = EditHistory()
+    versions = _versions(50, 2000) + ["", "whole new text", "whole new text"]
+    for version in versions:
+        history.push(PATH, version)
+    assert history[PATH] == versions
+    for version in reversed(versions):
+        assert history.pop(PATH) == version
+    assert history.pop(PATH) is None
+    assert PATH not in history
+
+
+def test_history_stores_deltas():
+    history = EditHistory()
+    versions = _versions(100, 1024 * 1024)
+    for version in versions:
+        history.push(PATH, version)
+    # one whole copy plus small deltas, instead of a hundred copies
+    assert history.stats["bytes"] < 3 * 1024 * 1024
+    assert history.stats["versions"] == 100
+    assert history.pop(PATH) == versions[-1]
+    assert history.pop(PATH) == versions[-2]
+
+
+def test_history_forgets_oldest_versions_beyond_caps():
+    history = EditHistory(max_bytes_per_file=10_000)
+    versions = [str(i) * 3000 for i in range(5)]
+    for version in versions:
+        history.push(PATH, version)
+    # versions share nothing, so each takes ~3000 bytes and three fit
+    assert history[PATH] == versions[2:]
+    assert history.stats["bytes"] <= 10_000
+    assert history.evictions > 0
+
+    history = EditHistory(max_bytes_per_file=10, max_bytes=10_000)
+    assert history.pop(PATH) is None
+    history.push(PATH, versions[0])
+    history.push(PATH, versions[1])
+    # even past the cap, what the next undo restores is kept
+    assert history[PATH] == [versions[1]]
+
+    history = EditHistory(max_bytes=10_000)
+    for i, version in enumerate(versions):
+        history.push(Path(f"/test/{i}.txt"), version)
+        history.push(Path(f"/test/{i}.txt"), version + "!")
+    assert history.stats["bytes"] <= 10_000
+    assert history[Path("/test/4.txt")] == [versions[4], versions[4] + "!"]
+    # the files edited longest ago lost their history first
+    assert history[Path("/test/0.txt")] == []
+    assert len(history) < 5
+
+
+def test_history_spills_to_disk(tmp_path):
+    history = EditHistory(max_bytes_per_file=10_000, spill_dir=tmp_path)
+    versions = _versions(20, 20_000)
+    for version in versions:
+        history.push(PATH, version)
+    assert history.stats["bytes"] <= 10_000
+    assert history.stats["spills"] > 0
+    assert history.stats["spilled_bytes"] > 0
+    assert history.evictions == 0
+    assert history[PATH] == versions
+    for version in reversed(versions):
+        assert history.pop(PATH) == version
+
+    history.push(PATH, versions[0])
+    history.clear()
+    assert len(history) == 0
+    assert not any(tmp_path.iterdir())
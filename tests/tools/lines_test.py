@@ -0,0 +1,94 @@
+import os
+import random
+import threading
+
+import pytest
+
+from computer_use_demo.tools import lines
+from computer_use_demo.tools.base import ToolError
+from computer_use_demo.tools.edit import EditTool
+from computer_use_demo.tools.lines import forget_index, line_index, read_lines
+
+
+@pytest.fixture(autouse=True)
+def small_chunks(monkeypatch):
+    # exercise chunk boundaries with small files
+    monkeypatch.setattr(lines, "CHUNK_SIZE", 16)
+    monkeypatch.setattr(lines, "READ_SIZE", 48)
+
+
+def _text(seed: int, newline: str = "\n") -> str:
+    rng = random.Random(seed)
+    text = newline.join(
+        "".join(rng.choice("ab é") for _ in range(rng.randrange(0, 30)))
+        for _ in range(rng.randrange(1, 60))
+    )
+    return text + newline if seed % 2 else text
+
+
+@pytest.mark.parametrize("newline", ["\n", "\r\n"])
+def test_read_lines_matches_split(tmp_path, newline):
+    path = tmp_path / "file.txt"
+    for seed in range(20):
+        path.write_bytes(_text(seed, newline).encode())
+        expected = path.read_text().split("\n")
+        index = line_index(path)
+        assert index is not None
+        assert index.line_count == len(expected)
+        for first in range(1, len(expected) + 1, 3):
+            for last in (first, min(len(expected), first + 4), -1):
+                stop = None if last == -1 else last
+                assert read_lines(index, first, last) == "\n".join(expected[first - 1 : stop])
+        forget_index(path)
+
+
+def test_line_index_is_cached_until_the_file_changes(tmp_path):
+    path = tmp_path / "file.txt"
+    path.write_text("one\ntwo\n")
+    index = line_index(path)
+    assert line_index(path) is index
+    assert line_index(path, min_size=100) is None
+
+    path.write_text("one\ntwo\nthree\n")
+    os.utime(path, ns=(1, 1))
+    assert line_index(path).line_count == 4
+
+    # lone carriage returns are line breaks to read_text; leave those files to it
+    path.write_bytes(b"one\rtwo\r\n")
+    assert line_index(path) is None
+    assert line_index(tmp_path / "missing.txt") is None
+
+
+@pytest.mark.asyncio
+async def test_view_range_reads_only_the_range(tmp_path, monkeypatch):
+    path = tmp_path / "big.log"
+    path.write_text("".join(f"line {i}\r\n" for i in range(1, 10_001)))
+    edit_tool = EditTool()
+    monkeypatch.setattr(edit_tool, "_index_threshold", 1)
+    monkeypatch.setattr(edit_tool, "read_file", None)  # must not read the whole file
+
+    result = await edit_tool(command="view", path=str(path), view_range=[100, 102])
+    assert "\n   100\tline 100\n   101\tline 101\n   102\tline 102\n" in result.output
+    result = await edit_tool(command="view", path=str(path), view_range=[10_000, -1])
+    assert result.output.endswith("\n 10000\tline 10000\n 10001\t\n")
+    with pytest.raises(ToolError, match="Invalid `view_range`"):
+        await edit_tool(command="view", path=str(path), view_range=[1, 10_002])
+
+
+@pytest.mark.asyncio
+async def test_view_range_builds_the_index_off_the_event_loop(tmp_path, monkeypatch):
+    path = tmp_path / "big.log"
+    path.write_text("".join(f"line {i}\n" for i in range(1, 1001)))
+    edit_tool = EditTool()
+    monkeypatch.setattr(edit_tool, "_index_threshold", 1)
+    threads = []
+    build = lines._build
+
+    def recording_build(*args):
+        threads.append(threading.get_ident())
+        return build(*args)
+
+    monkeypatch.setattr(lines, "_build", recording_build)
+    result = await edit_tool(command="view", path=str(path), view_range=[5, 5])
+    assert "\n     5\tline 5\n" in result.output
+    assert threads and threads[0] != threading.get_ident()
@@ -0,0 +1,89 @@
+import os
+import shutil
+import subprocess
+import threading
+
+import pytest
+
+from computer_use_demo.tools.edit import EditTool
+from computer_use_demo.tools.listing import forget_listings, list_directory
+
+
+@pytest.fixture
+def tree(tmp_path):
+    paths = ["a/b/c/deep.txt", "a/file.txt", "a/.hidden", ".git/config", "top.txt", "my dir/x y.txt"]
+    for path in paths:
+        (tmp_path / path).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / path).write_text("")
+    return tmp_path
+
+
+@pytest.mark.skipif(shutil.which("find") is None, reason="needs find")
+def test_listing_matches_find(tree):
+    listing = list_directory(tree)
+    found = subprocess.run(
+        ["find", str(tree), "-maxdepth", "2", "-not", "-path", "*/.*"],
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    assert sorted(listing.output.splitlines()) == sorted(found.splitlines())
+    assert listing.output.splitlines()[0] == str(tree)
+    assert f"{tree}/my dir/x y.txt" in listing.output
+    assert not listing.errors and not listing.truncated
+
+
+def test_listing_is_cached_until_a_directory_changes(tree):
+    listing = list_directory(tree)
+    assert list_directory(tree) is listing
+
+    (tree / "a" / "new.txt").write_text("")
+    os.utime(tree / "a", ns=(1, 1))  # mtimes may not tick between quick writes
+    assert f"{tree}/a/new.txt" in list_directory(tree).output
+
+    listing = list_directory(tree)
+    forget_listings(tree / "a" / "other.txt")
+    assert list_directory(tree) is not listing
+
+
+def test_listing_cache_is_shared_between_threads(tmp_path):
+    # more directories than are cached, so that listing them keeps evicting
+    directories = [tmp_path / f"d{i}" for i in range(100)]
+    for directory in directories:
+        directory.mkdir()
+    errors: list[Exception] = []
+
+    def list_all():
+        try:
+            for _ in range(5):
+                for directory in directories:
+                    list_directory(directory)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=list_all) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    while any(thread.is_alive() for thread in threads):
+        forget_listings(directories[0] / "file.txt")
+    for thread in threads:
+        thread.join()
+    assert not errors
+
+
+def test_listing_stops_at_entry_limit(tree):
+    listing = list_directory(tree, max_entries=3)
+    assert listing.truncated
+    lines = listing.output.splitlines()
+    assert len(lines) == 5  # the directory, three entries and the note
+    assert lines[-1].startswith("... listing stopped after 3 entries")
+
+
+@pytest.mark.asyncio
+async def test_edit_tool_writes_refresh_listings(tree):
+    edit_tool = EditTool()
+    result = await edit_tool(command="view", path=str(tree))
+    assert "excluding hidden items" in result.output
+    await edit_tool(command="create", path=str(tree / "a" / "created.txt"), file_text="x")
+    result = await edit_tool(command="view", path=str(tree))
+    assert f"{tree}/a/created.txt" in result.output
@@ -0,0 +1,91 @@
+import random
+
+import pytest
+from PIL import Image, ImageDraw
+
+from computer_use_demo.tools.base import ToolError
+from computer_use_demo.tools.locate import TemplateLibrary, find_template, match_scores
+
+np = pytest.importorskip("numpy")
+
+
+def _desktop(seed: int = 0) -> Image.Image:
+    """A frame of UI-like blocks: flat fills with outlines and some noise."""
+    rng = random.Random(seed)
+    frame = Image.new("RGB", (320, 240), (230, 230, 230))
+    draw = ImageDraw.Draw(frame)
+    for _ in range(40):
+        left, top = rng.randrange(300), rng.randrange(220)
+        color = tuple(rng.randrange(256) for _ in range(3))
+        draw.rectangle(
+            (left, top, left + rng.randrange(4, 40), top + rng.randrange(4, 30)),
+            fill=color,
+            outline=(0, 0, 0),
+        )
+    return frame
+
+
+def _button() -> Image.Image:
+    button = Image.new("RGB", (36, 20), (40, 90, 200))
+    draw = ImageDraw.Draw(button)
+    draw.rectangle((0, 0, 35, 19), outline=(10, 10, 10))
+    draw.line((8, 4, 27, 15), fill=(255, 255, 255), width=3)
+    draw.line((8, 15, 27, 4), fill=(255, 255, 255), width=3)
+    return button
+
+
+def test_match_scores_is_normalised_correlation():
+    rng = np.random.default_rng(0)
+    frame = Image.fromarray(rng.integers(0, 256, (20, 24), dtype=np.uint8))
+    template = frame.crop((5, 7, 11, 12))
+    scores = match_scores(frame, template)
+    assert scores.shape == (16, 19)
+
+    f = np.asarray(frame, dtype=np.float64)
+    t = np.asarray(template, dtype=np.float64)
+    window = f[3:8, 2:8]
+    expected = ((window - window.mean()) * (t - t.mean())).sum() / np.sqrt(
+        ((window - window.mean()) ** 2).sum() * ((t - t.mean()) ** 2).sum()
+    )
+    assert scores[3, 2] == pytest.approx(expected)
+    assert scores[7, 5] == pytest.approx(1.0)
+    assert np.unravel_index(scores.argmax(), scores.shape) == (7, 5)
+
+
+def test_find_template_locates_every_copy():
+    frame = _desktop()
+    frame.paste(_button(), (41, 33))
+    frame.paste(_button(), (250, 180))
+    matches = find_template(frame, _button(), max_matches=5)
+    assert sorted((match.left, match.top) for match in matches) == [(41, 33), (250, 180)]
+    assert all(match.confidence > 0.99 for match in matches)
+    assert matches[0].center in ((59, 43), (268, 190))
+
+
+def test_find_template_matches_other_scales():
+    frame = _desktop(1)
+    button = _button()
+    frame.paste(button.resize((45, 25), Image.Resampling.BICUBIC), (101, 77))
+    [match] = find_template(frame, button, threshold=0.8, max_matches=1)
+    assert (match.width, match.height) == (45, 25)
+    assert abs(match.left - 101) <= 1 and abs(match.top - 77) <= 1
+
+
+def test_find_template_reports_nothing_below_threshold():
+    assert find_template(_desktop(2), _button(), threshold=0.9) == []
+    with pytest.raises(ToolError, match="single color"):
+        find_template(_desktop(), Image.new("RGB", (10, 10), (1, 2, 3)))
+
+
+def test_template_library_persists(tmp_path):
+    library = TemplateLibrary(tmp_path)
+    library.add("close-button", _button())
+    assert (tmp_path / "close-button.png").exists()
+
+    reopened = TemplateLibrary(tmp_path)
+    assert "close-button" in reopened
+    assert reopened.names == ["close-button"]
+    assert reopened.get("close-button").tobytes() == _button().tobytes()
+    assert reopened.get("missing") is None
+    with pytest.raises(ToolError, match="Invalid template name"):
+        library.add("../escape", _button())
@@ -0,0 +1,104 @@
+import asyncio
+import sys
+
+import pytest
+
+from computer_use_demo.tools.run import (
+    CommandExecutor,
+    Truncator,
+    direct_argv,
+    maybe_truncate,
+    truncate,
+)
+
+
+def test_direct_argv():
+    assert direct_argv([sys.executable, "-V"]) == [sys.executable, "-V"]
+    # shell features and builtins need cmd.exe
+    assert direct_argv("dir /b") is None
+    assert direct_argv("echo hi > out.txt") is None
+    assert direct_argv("type a.txt | more") is None
+    assert direct_argv("program_that_does_not_exist --flag") is None
+
+
+@pytest.mark.asyncio
+async def test_run_many():
+    executor = CommandExecutor(max_concurrency=2)
+    results = await executor.run_many(
+        [[sys.executable, "-c", f"print({i})"] for i in range(4)]
+    )
+    assert [result.stdout.strip() for result in results] == ["0", "1", "2", "3"]
+    for result in results:
+        assert result.returncode == 0
+        assert not result.shell
+        assert 0 < result.spawn_time <= result.wall_time
+
+
+def test_run_many_in_several_event_loops():
+    # one executor outlives the loop it was first used in, like the module-level one
+    executor = CommandExecutor(max_concurrency=1)
+    cmds = [[sys.executable, "-c", f"print({i})"] for i in range(3)]
+    for _ in range(2):
+        results = asyncio.run(executor.run_many(cmds))
+        assert [result.stdout.strip() for result in results] == ["0", "1", "2"]
+
+
+@pytest.mark.asyncio
+async def test_run_timeout():
+    executor = CommandExecutor()
+    with pytest.raises(TimeoutError, match="timed out after 0.1 seconds"):
+        await executor.run(
+            [sys.executable, "-c", "import time; time.sleep(5)"], timeout=0.1
+        )
+
+
+def test_truncate_keeps_head_and_tail():
+    content = "".join(f"line {i}\n" for i in range(1000))
+    assert truncate(content, max_tokens=None) == content
+    assert maybe_truncate(content, truncate_after=len(content)) == content
+
+    result = truncate(content, max_tokens=10)
+    assert result.startswith("line 0\nline 1\n<response clipped>")
+    assert result.endswith("line 998\nline 999\n")
+    assert "(996 lines) were left out" in result
+
+
+def test_truncator_keeps_output_at_the_budget():
+    # the head stops short of its share before the long line; nothing may go missing
+    content = "".join(f"{i:04}\n" for i in range(1000)) + "x" * 3499 + "\n"
+    content += "".join(f"{i:04}\n" for i in range(1500))
+    assert len(content) == 16000
+    for piece_size in (len(content), 7):
+        truncator = Truncator(max_tokens=4000)
+        for start in range(0, len(content), piece_size):
+            truncator.feed(content[start : start + piece_size])
+        assert truncator.getvalue() == content
+    assert maybe_truncate(content) == content
+
+    # one character over, and the omission is announced
+    truncator = Truncator(max_tokens=4000)
+    truncator.feed(content + "z")
+    result = truncator.getvalue()
+    assert "<response clipped>" in result
+    assert result.endswith("z")
+
+
+def test_truncator_folds_repeated_lines():
+    truncator = Truncator(max_tokens=40)
+    truncator.feed("start\n" + "retrying...\n" * 1000)
+    truncator.feed("done")
+    # the head fills up with 6 repeats, the tail folds the rest into one line
+    assert truncator.getvalue() == (
+        "start\n"
+        + "retrying...\n" * 7
+        + "<previous line repeated 993 more times>\ndone"
+    )
+
+
+def test_truncator_cuts_long_lines():
+    truncator = Truncator(max_tokens=2)
+    for _ in range(100):
+        truncator.feed("0123456789")
+    result = truncator.getvalue()
+    assert result.startswith("0123\n<response clipped>")
+    assert result.endswith("\n6789")
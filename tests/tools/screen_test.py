@@ -0,0 +1,58 @@
+from types import SimpleNamespace
+from unittest.mock import MagicMock, patch
+
+import pytest
+from PIL import Image
+
+from computer_use_demo.tools import screen
+from computer_use_demo.tools.screen import (
+    ImageGrabBackend,
+    MssBackend,
+    ToolError,
+    benchmark,
+    default_backend,
+)
+
+
+def test_imagegrab_backend():
+    with patch(
+        "computer_use_demo.tools.screen.ImageGrab.grab",
+        return_value=Image.new("RGBA", (64, 48)),
+    ) as grab:
+        image = ImageGrabBackend(":1").grab((0, 0, 64, 48))
+    grab.assert_called_once_with(bbox=(0, 0, 64, 48), xdisplay=":1")
+    assert image.mode == "RGB"
+    assert image.size == (64, 48)
+
+
+def test_mss_backend_reuses_two_buffers():
+    sct = MagicMock()
+    sct.monitors = [None, {"left": 0, "top": 0, "width": 2, "height": 1}]
+    # two BGRX pixels: blue, then red
+    sct.grab.return_value = SimpleNamespace(
+        raw=bytearray(b"\xff\x00\x00\x00\x00\x00\xff\x00"), size=(2, 1)
+    )
+    fake_mss = SimpleNamespace(mss=lambda **kwargs: sct, ScreenShotError=Exception)
+    with patch.object(screen, "mss", fake_mss):
+        backend = MssBackend()
+        first, second, third = backend.grab(), backend.grab(), backend.grab()
+    assert first.getpixel((0, 0)) == (0, 0, 255)
+    assert first.getpixel((1, 0)) == (255, 0, 0)
+    assert first is not second
+    assert first is third
+
+
+def test_default_backend(monkeypatch):
+    monkeypatch.setattr(screen, "mss", None)
+    assert isinstance(default_backend(), ImageGrabBackend)
+    monkeypatch.setenv("CAPTURE_BACKEND", "nope")
+    with pytest.raises(ToolError, match="Unknown capture backend nope"):
+        default_backend()
+
+
+def test_benchmark():
+    backend = MagicMock()
+    result = benchmark(backend, (1024, 768), iterations=3)
+    assert backend.grab.call_count == 4
+    backend.grab.assert_called_with((0, 0, 1024, 768))
+    assert result["median_ms"] <= result["max_ms"]
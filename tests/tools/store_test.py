@@ -0,0 +1,39 @@
+import os
+import time
+
+from computer_use_demo.tools.store import ScreenshotStore
+
+
+def test_store_deduplicates_by_content(tmp_path):
+    store = ScreenshotStore(tmp_path)
+    first = store.put(b"frame", "png")
+    assert store.put(b"frame", "png") == first
+    assert len(list(tmp_path.iterdir())) == 1
+    assert store.get(first) == b"frame"
+    assert store.path(first) == tmp_path / f"{first}.png"
+    assert store.get("0" * 64) is None
+
+
+def test_store_evicts_least_recently_used(tmp_path):
+    store = ScreenshotStore(tmp_path, max_bytes=10)
+    a = store.put(b"aaaa")
+    b = store.put(b"bbbb")
+    store.get(a)  # a is now more recent than b
+    c = store.put(b"cccc")
+    assert store.get(b) is None
+    assert store.get(a) == b"aaaa"
+    assert store.get(c) == b"cccc"
+    assert store.stats == {"images": 2, "bytes": 8, "evictions": 1}
+
+
+def test_store_evicts_old_images(tmp_path):
+    store = ScreenshotStore(tmp_path, max_age=60)
+    old = store.put(b"old")
+    an_hour_ago = time.time() - 3600
+    os.utime(store.path(old), (an_hour_ago, an_hour_ago))
+
+    # a new store picks up what is on disk, and expires it on the next put
+    store = ScreenshotStore(tmp_path, max_age=60)
+    new = store.put(b"new")
+    assert store.get(old) is None
+    assert store.get(new) == b"new"
@@ -1,14 +1,24 @@
 from .base import CLIResult, ToolResult
-from .bash import BashTool
+from .bash import BashTool, OutputChunk
+from .cache import CommandCache
 from .collection import ToolCollection
 from .computer import ComputerTool
+from .display import Display, DisplayPool
 from .edit import EditTool
+from .locate import TemplateLibrary
+from .store import ScreenshotStore
 
 __ALL__ = [
     BashTool,
     CLIResult,
+    CommandCache,
     ComputerTool,
+    Display,
+    DisplayPool,
     EditTool,
+    OutputChunk,
+    ScreenshotStore,
+    TemplateLibrary,
     ToolCollection,
     ToolResult,
 ]
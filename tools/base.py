@@ -28,6 +28,10 @@ class ToolResult:
     error: str | None = None
     base64_image: str | None = None
     system: str | None = None
+    # e.g. "image/jpeg"; None means the base64_image is a PNG
+    image_media_type: str | None = None
+    # where the image can be found again in a ScreenshotStore
+    image_hash: str | None = None
 
     def __bool__(self):
         return any(getattr(self, field.name) for field in fields(self))
@@ -47,6 +51,10 @@ class ToolResult:
             error=combine_fields(self.error, other.error),
             base64_image=combine_fields(self.base64_image, other.base64_image, False),
             system=combine_fields(self.system, other.system),
+            image_media_type=combine_fields(
+                self.image_media_type, other.image_media_type, False
+            ),
+            image_hash=combine_fields(self.image_hash, other.image_hash, False),
         )
 
     def replace(self, **kwargs):
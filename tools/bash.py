@@ -1,11 +1,95 @@
 import asyncio
+import codecs
+import contextlib
 import os
-from typing import ClassVar, Literal
+import tempfile
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import BinaryIO, Callable, ClassVar, Literal
 
+import psutil
 from anthropic.types.beta import BetaToolBash20241022Param
 
 from .base import BaseAnthropicTool, CLIResult, ToolError, ToolResult
+from .cache import CommandCache, command_kind
 from .debug import tool_logger, log_performance
+from .run import CHARS_PER_TOKEN, MAX_RESPONSE_TOKENS, Truncator
+
+
+@dataclass(frozen=True)
+class OutputChunk:
+    """A piece of command output, delivered while the command is still running."""
+
+    stream: Literal["stdout", "stderr"]
+    text: str
+
+
+# return True from the callback to stop waiting for the rest of the output
+OutputCallback = Callable[[OutputChunk], bool | None]
+
+DEFAULT_SESSION = "default"
+
+
+class _OutputCapture:
+    """
+    Captures one stream of a command's output with bounded memory.
+
+    The output is fed through a Truncator that keeps its start and end within a token
+    budget. Once the output outgrows that budget, everything is also written to a
+    temporary file, so the middle lives only on disk and the model can be pointed at
+    the full log.
+    """
+
+    def __init__(self, name: str, max_tokens: int):
+        self._name = name
+        self._spill_after = max_tokens * CHARS_PER_TOKEN  # bytes
+        self._truncator = Truncator(max_tokens)
+        self._decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self._buffer = bytearray()  # raw output, until it is spilled
+        self._spill: BinaryIO | None = None
+        self.size = 0
+        self.spill_path: str | None = None
+
+    def write(self, data: bytes):
+        self.size += len(data)
+        self._truncator.feed(self._decoder.decode(data))
+        if self._spill is not None:
+            self._spill.write(data)
+            return
+        self._buffer += data
+        if len(self._buffer) > self._spill_after:
+            self._start_spill()
+
+    def _start_spill(self):
+        fd, self.spill_path = tempfile.mkstemp(prefix=f"bash_{self._name}_", suffix=".log")
+        self._spill = os.fdopen(fd, "wb")
+        # everything captured so far is still in memory at this point
+        self._spill.write(self._buffer)
+        self._buffer = bytearray()
+        tool_logger.debug(f"Spilling {self._name} output to {self.spill_path}")
+
+    def getvalue(self) -> str:
+        """Return the truncated output, noting where the full log lives if it was spilled."""
+        self._truncator.feed(self._decoder.decode(b"", final=True))
+        if self._spill is None:
+            return self._truncator.getvalue()
+        if not self._spill.closed:
+            self._spill.flush()
+        return self._truncator.getvalue(
+            f"The full {self._name} ({self.size} bytes) was saved to {self.spill_path}."
+        )
+
+    def close(self):
+        if self._spill is not None:
+            self._spill.close()
+
+    def discard(self):
+        """Close the capture and remove its spill file; nobody will read it."""
+        self.close()
+        if self.spill_path is not None:
+            with contextlib.suppress(OSError):
+                os.remove(self.spill_path)
 
 
 class _BashSession:
@@ -15,13 +99,41 @@ class _BashSession:
     _process: asyncio.subprocess.Process
 
     command: str = "cmd.exe"
-    _output_delay: float = 0.2  # seconds
+    _read_size: int = 64 * 1024  # bytes
+    _max_output_tokens: int = MAX_RESPONSE_TOKENS  # per stream
     _timeout: float = 120.0  # seconds
+    _interrupt_timeout: float = 5.0  # seconds to wait for the prompt after an interrupt
+    # process start times are only recorded to a clock tick or so
+    _create_time_slack: float = 0.05  # seconds
     _sentinel: str = "END_OF_COMMAND"
+    # full logs of the latest commands whose output was cut short, kept for the model to read
+    _max_spill_files: int = 8
+    _max_spill_bytes: int = 256 * 1024 * 1024
 
     def __init__(self):
         self._started = False
-        self._timed_out = False
+        # the timeout after which the shell stopped responding, if it did
+        self._timed_out: float | None = None
+        self._readers: list[asyncio.Task] = []
+        self._wakeup = asyncio.Event()
+        self._eof = False
+        # stdout bytes that might be the start of a sentinel split across reads
+        self._carry = b""
+        self._at_line_start = True
+        # sentinels still owed by commands whose caller stopped waiting early
+        self._stale_sentinels = 0
+        self._on_output: OutputCallback | None = None
+        # commands sent to one shell must not interleave
+        self._lock = asyncio.Lock()
+        # pids of the shell itself, which an interrupt must not kill
+        self._shell_pids: set[int] = set()
+        # when the running command was sent; processes older than it are not its own
+        self._command_started = 0.0
+        # the shell's directory, as reported with the last sentinel
+        self._cwd: str | None = None
+        # (path, bytes) of the full logs kept on disk, oldest first
+        self._spills: deque[tuple[str, int]] = deque()
+        self._reset_output()
 
     @log_performance
     async def start(self):
@@ -41,19 +153,266 @@ class _BashSession:
             tool_logger.error(f"Failed to start Windows command prompt: {str(e)}")
             raise ToolError(f"Failed to start Windows command prompt: {str(e)}")
 
+        self._readers = [
+            asyncio.create_task(self._read_stdout()),
+            asyncio.create_task(self._read_stderr()),
+        ]
         self._started = True
 
+        # wait for the prompt, which also drops the startup banner, then note
+        # which processes make up the shell so that an interrupt can spare them
+        if not await self._wait_for_prompt():
+            self.stop()
+            raise ToolError("Windows command prompt did not become ready")
+        self._take_output()
+        self._shell_pids = {self._process.pid} | {child.pid for child in self._children()}
+
     def stop(self):
         """Terminate the command prompt."""
         if not self._started:
             raise ToolError("Session has not started.")
+        for reader in self._readers:
+            reader.cancel()
+        self._stdout.discard()
+        self._stderr.discard()
+        while self._spills:
+            self._remove_spill()
         if self._process.returncode is not None:
             return
         self._process.terminate()
         tool_logger.info("Terminated Windows command prompt process")
 
-    async def run(self, command: str):
-        """Execute a command in the command prompt."""
+    def _children(self) -> list[psutil.Process]:
+        try:
+            return psutil.Process(self._process.pid).children(recursive=True)
+        except psutil.Error:
+            return []
+
+    def cwd(self) -> str | None:
+        """
+        The shell's current directory, or None if it cannot be determined, e.g. while
+        a command abandoned by its caller may still change it.
+        """
+        return self._cwd
+
+    @property
+    def _sentinel_command(self) -> str:
+        # `%^CD%` escapes the expansion of the whole line, which happens before any of
+        # it runs; `call` expands it once the echo runs, after the command's own `cd`
+        return f"echo.& call echo {self._sentinel} %^CD%"
+
+    @staticmethod
+    def _parse_cwd(data: bytes) -> str | None:
+        try:
+            cwd = data.decode().strip()
+        except UnicodeDecodeError:
+            return None
+        # an unexpanded variable means the directory was not reported
+        return cwd if cwd and "%" not in cwd else None
+
+    async def _wait_for_prompt(self) -> bool:
+        """Ask the shell to echo a bare sentinel and wait until it does."""
+        assert self._process.stdin
+        self._process.stdin.write(f"{self._sentinel_command}\n".encode())
+        await self._process.stdin.drain()
+        return await self._wait_for_sentinel()
+
+    async def _wait_for_sentinel(self) -> bool:
+        """Wait up to `_interrupt_timeout` for the sentinel; False if it does not come."""
+        try:
+            async with asyncio.timeout(self._interrupt_timeout):
+                while not (self._sentinel_seen or self._eof):
+                    self._wakeup.clear()
+                    await self._wakeup.wait()
+        except asyncio.TimeoutError:
+            return False
+        return self._sentinel_seen
+
+    async def _interrupt(self) -> bool:
+        """
+        Kill the running foreground command but keep the shell, its working
+        directory and environment alive. Only processes created since the command
+        was sent are killed; ones an earlier command left running (e.g. with `start`)
+        are spared. Returns False if the shell could not be brought back to its prompt.
+        """
+        since = self._command_started - self._create_time_slack
+        commands = []
+        for process in self._children():
+            if process.pid in self._shell_pids:
+                continue
+            with contextlib.suppress(psutil.Error):
+                if process.create_time() >= since:
+                    commands.append(process)
+        if not commands:
+            # nothing to kill; the shell itself is busy (e.g. a builtin loop)
+            return False
+        for process in commands:
+            with contextlib.suppress(psutil.Error):
+                process.kill()
+        tool_logger.info(f"Interrupted {len(commands)} process(es) of a timed out command")
+        # the sentinel follows the command whether or not it succeeded
+        return await self._wait_for_sentinel()
+
+    def _reset_output(self):
+        """Clear the captured output so that the next command starts fresh."""
+        self._stdout = self._new_capture("stdout")
+        self._stderr = self._new_capture("stderr")
+        self._sentinel_seen = False
+        self._stop_requested = False
+        self._decoders = {
+            "stdout": codecs.getincrementaldecoder("utf-8")(errors="replace"),
+            "stderr": codecs.getincrementaldecoder("utf-8")(errors="replace"),
+        }
+        self._wakeup.clear()
+
+    def _new_capture(self, name: str) -> _OutputCapture:
+        return _OutputCapture(name, self._max_output_tokens)
+
+    def _emit(self, stream: Literal["stdout", "stderr"], data: bytes):
+        """Pass newly captured output to the streaming callback, if any."""
+        if self._on_output is None or not data:
+            return
+        text = self._decoders[stream].decode(data)
+        if not text:
+            return
+        try:
+            stop = self._on_output(OutputChunk(stream=stream, text=text))
+        except Exception as e:
+            tool_logger.error(f"Output callback failed, detaching it: {str(e)}")
+            self._on_output = None
+            return
+        if stop:
+            self._stop_requested = True
+            self._wakeup.set()
+
+    def _append_stdout(self, data: bytes):
+        if not data:
+            return
+        self._at_line_start = data.endswith(b"\n")
+        if self._stale_sentinels:
+            return
+        self._stdout.write(data)
+        self._emit("stdout", data)
+
+    def _feed_stdout(self, chunk: bytes):
+        """Scan newly arrived stdout bytes for the sentinel and buffer the rest."""
+        if self._sentinel_seen:
+            # anything between the sentinel and the next command is dropped
+            return
+
+        # the sentinel only counts at the start of a line, so that the command
+        # prompt echoing `echo END_OF_COMMAND` back does not end the command; the
+        # `echo.` before it starts that line even if the output did not end one
+        sentinel = self._sentinel.encode()
+        data = self._carry + chunk
+        if self._at_line_start and data.startswith(sentinel):
+            index = 0
+        else:
+            index = data.find(b"\n" + sentinel)
+        if index == -1:
+            # hold back only a trailing partial sentinel, which may complete on the next read
+            if self._at_line_start and sentinel.startswith(data):
+                split = 0
+            else:
+                split = data.rfind(b"\n", max(0, len(data) - len(sentinel)))
+                if split == -1 or not sentinel.startswith(data[split + 1 :]):
+                    split = len(data)
+                # the line break before a sentinel may be split across reads too
+                if split > 0 and data[split - 1 : split] == b"\r":
+                    split -= 1
+            self._append_stdout(data[:split])
+            self._carry = data[split:]
+            return
+
+        # the line break before the sentinel is `echo.`'s, not the command's
+        end = index - 1 if index > 0 and data[index - 1 : index] == b"\r" else index
+        self._append_stdout(data[:end])
+        start = data.index(sentinel, index) + len(sentinel)
+        newline = data.find(b"\n", start)
+        if newline == -1:
+            # the rest of the sentinel line, with the directory, has yet to arrive
+            self._carry = data[index:]
+            return
+        self._carry = b""
+        self._at_line_start = True
+        self._cwd = self._parse_cwd(data[start:newline])
+        if self._stale_sentinels:
+            # this sentinel belongs to a command nobody is waiting for any more
+            self._stale_sentinels -= 1
+            self._stdout.discard()
+            self._stderr.discard()
+            self._stdout = self._new_capture("stdout")
+            self._stderr = self._new_capture("stderr")
+            self._feed_stdout(data[newline + 1 :])
+            return
+        self._sentinel_seen = True
+        self._wakeup.set()
+
+    async def _read_stdout(self):
+        assert self._process.stdout
+        while chunk := await self._process.stdout.read(self._read_size):
+            self._feed_stdout(chunk)
+        self._eof = True
+        self._wakeup.set()
+
+    async def _read_stderr(self):
+        assert self._process.stderr
+        while chunk := await self._process.stderr.read(self._read_size):
+            if self._stale_sentinels:
+                continue
+            self._stderr.write(chunk)
+            self._emit("stderr", chunk)
+
+    def _take_output(self) -> tuple[str, str]:
+        """Decode the output of the current command and reset the buffers."""
+        output = self._stdout.getvalue()
+        error = self._stderr.getvalue()
+        self._stdout.close()
+        self._stderr.close()
+        self._keep_spills(self._stdout, self._stderr)
+        self._reset_output()
+        return output, error
+
+    def _keep_spills(self, *captures: _OutputCapture):
+        """Keep the full logs of captures that spilled, deleting the oldest beyond the caps."""
+        new = [(c.spill_path, c.size) for c in captures if c.spill_path is not None]
+        self._spills.extend(new)
+        # the logs just pointed to in the output are kept whatever their size
+        while len(self._spills) > len(new) and (
+            len(self._spills) > self._max_spill_files
+            or sum(size for _, size in self._spills) > self._max_spill_bytes
+        ):
+            self._remove_spill()
+
+    def _remove_spill(self):
+        path, _ = self._spills.popleft()
+        with contextlib.suppress(OSError):
+            os.remove(path)
+
+    async def run(
+        self,
+        command: str,
+        on_output: OutputCallback | None = None,
+        timeout: float | None = None,
+    ):
+        """
+        Execute a command in the command prompt.
+
+        If `on_output` is given it is called with each chunk of stdout/stderr as it
+        arrives; returning True from it stops waiting and returns what was seen so far.
+        A command that runs past `timeout` (default `_timeout`) is interrupted and its
+        partial output returned, without restarting the command prompt.
+        """
+        if timeout is None:
+            timeout = self._timeout
+        elif timeout < 0:
+            raise ToolError(f"timeout must not be negative, not {timeout!r}")
+        async with self._lock:
+            return await self._run(command, on_output, timeout)
+
+    async def _run(
+        self, command: str, on_output: OutputCallback | None, timeout: float
+    ):
         if not self._started:
             raise ToolError("Session has not started.")
         if self._process.returncode is not None:
@@ -62,52 +421,109 @@ class _BashSession:
                 system="tool must be restarted",
                 error=f"command prompt has exited with returncode {self._process.returncode}",
             )
-        if self._timed_out:
+        if self._timed_out is not None:
             raise ToolError(
-                f"timed out: command prompt has not returned in {self._timeout} seconds and must be restarted",
+                f"timed out: command prompt has not returned in {self._timed_out} seconds and must be restarted",
             )
 
         # we know these are not None because we created the process with PIPEs
         assert self._process.stdin
-        assert self._process.stdout
-        assert self._process.stderr
 
-        # send command to the process
-        self._process.stdin.write(
-            command.encode() + f" && echo {self._sentinel}\n".encode()
-        )
+        # send command to the process; `&` echoes the sentinel even if the command
+        # fails, so that an interrupted or abandoned command still ends with one
+        self._command_started = time.time()
+        self._process.stdin.write(f"{command} & {self._sentinel_command}\n".encode())
         await self._process.stdin.drain()
 
-        # read output from the process, until the sentinel is found
+        # the reader tasks wake us as soon as the sentinel shows up on stdout
+        self._on_output = on_output
+        system = None
         try:
-            async with asyncio.timeout(self._timeout):
-                while True:
-                    await asyncio.sleep(self._output_delay)
-                    # if we read directly from stdout/stderr, it will wait forever for
-                    # EOF. use the StreamReader buffer directly instead.
-                    output = self._process.stdout._buffer.decode()  # pyright: ignore[reportAttributeAccessIssue]
-                    if self._sentinel in output:
-                        # strip the sentinel and break
-                        output = output[: output.index(self._sentinel)]
-                        break
+            async with asyncio.timeout(timeout):
+                await self._wakeup.wait()
         except asyncio.TimeoutError:
-            self._timed_out = True
-            raise ToolError(
-                f"timed out: command prompt has not returned in {self._timeout} seconds and must be restarted",
-            ) from None
+            if not await self._interrupt():
+                self._timed_out = timeout
+                raise ToolError(
+                    f"timed out: command prompt has not returned in {timeout} seconds and must be restarted",
+                ) from None
+            system = f"timed out: the command did not finish in {timeout} seconds and was interrupted; the output so far is shown and the command prompt is still usable"
+        finally:
+            self._on_output = None
 
+        if self._eof:
+            returncode = await self._process.wait()
+            tool_logger.error(f"Command prompt exited with code {returncode}")
+            return ToolResult(
+                system="tool must be restarted",
+                error=f"command prompt has exited with returncode {returncode}",
+            )
+
+        if self._stop_requested and not self._sentinel_seen:
+            # the command keeps running; drop its output until its sentinel arrives,
+            # which also tells where it left the shell
+            self._stale_sentinels += 1
+            self._cwd = None
+            system = "stopped reading early; the command is still running and the rest of its output was discarded"
+        else:
+            # stderr written before the sentinel is already in the pipe; give the
+            # stderr reader a chance to pick it up
+            await asyncio.sleep(0)
+
+        output, error = self._take_output()
         if output.endswith("\n"):
             output = output[:-1]
-
-        error = self._process.stderr._buffer.decode()  # pyright: ignore[reportAttributeAccessIssue]
         if error.endswith("\n"):
             error = error[:-1]
 
-        # clear the buffers so that the next output can be read correctly
-        self._process.stdout._buffer.clear()  # pyright: ignore[reportAttributeAccessIssue]
-        self._process.stderr._buffer.clear()  # pyright: ignore[reportAttributeAccessIssue]
+        return CLIResult(output=output, error=error, system=system)
+
 
-        return CLIResult(output=output, error=error)
+class _SessionPool:
+    """Keeps started command prompt sessions ready, so handing one out never waits on a spawn."""
+
+    def __init__(self, size: int):
+        self.size = size
+        self._ready: deque[_BashSession] = deque()
+        self._refill: asyncio.Task | None = None
+
+    async def acquire(self) -> _BashSession:
+        """Take a warm session if one is ready, otherwise start one, then refill in the background."""
+        session = None
+        while self._ready:
+            candidate = self._ready.popleft()
+            if candidate._process.returncode is None:
+                session = candidate
+                break
+        if session is None:
+            session = _BashSession()
+            await session.start()
+        self.refill()
+        return session
+
+    def refill(self) -> asyncio.Task:
+        """Start warming sessions in the background until the pool is full."""
+        if self._refill is None or self._refill.done():
+            self._refill = asyncio.create_task(self._fill())
+        return self._refill
+
+    async def _fill(self):
+        while len(self._ready) < self.size:
+            session = _BashSession()
+            try:
+                await session.start()
+            except ToolError as e:
+                tool_logger.error(f"Failed to warm up a command prompt session: {e.message}")
+                return
+            self._ready.append(session)
+
+    async def close(self):
+        # let an in-flight spawn finish rather than cancelling it: cancelling
+        # create_subprocess_shell before its pipes connect can hang the loop
+        if self._refill is not None:
+            await self._refill
+        while self._ready:
+            self._ready.popleft().stop()
 
 
 class BashTool(BaseAnthropicTool):
@@ -116,33 +532,77 @@ class BashTool(BaseAnthropicTool):
     The tool parameters are defined by Anthropic and are not editable.
     """
 
-    _session: _BashSession | None
+    _sessions: dict[str, _BashSession]
     name: ClassVar[Literal["bash"]] = "bash"
     api_type: ClassVar[Literal["bash_20241022"]] = "bash_20241022"
 
-    def __init__(self):
-        self._session = None
+    def __init__(self, pool_size: int = 1, cache: CommandCache | None = None):
+        self._sessions = {}
+        # opt-in cache for the results of read-only commands
+        self._cache = cache
+        self._sessions_lock = asyncio.Lock()
+        self._pool = _SessionPool(pool_size)
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            pass  # no event loop yet; the pool warms up on first use
+        else:
+            self._pool.refill()
         super().__init__()
 
+    @property
+    def _session(self) -> _BashSession | None:
+        return self._sessions.get(DEFAULT_SESSION)
+
+    async def warm_up(self):
+        """Fill the pool of ready sessions, so the first command skips the spawn."""
+        await self._pool.refill()
+
     async def __call__(
-        self, command: str | None = None, restart: bool = False, **kwargs
+        self,
+        command: str | None = None,
+        restart: bool = False,
+        on_output: OutputCallback | None = None,
+        session: str = DEFAULT_SESSION,
+        timeout: float | None = None,
+        **kwargs,
     ):
         if restart:
-            if self._session:
-                self._session.stop()
-            self._session = _BashSession()
-            await self._session.start()
+            async with self._sessions_lock:
+                if old := self._sessions.pop(session, None):
+                    old.stop()
+                self._sessions[session] = await self._pool.acquire()
 
             return ToolResult(system="tool has been restarted.")
 
-        if self._session is None:
-            self._session = _BashSession()
-            await self._session.start()
+        async with self._sessions_lock:
+            if session not in self._sessions:
+                self._sessions[session] = await self._pool.acquire()
+            _session = self._sessions[session]
+
+        if command is None:
+            raise ToolError("no command provided.")
 
-        if command is not None:
-            return await self._session.run(command)
+        # streamed commands always run, so that the caller sees their output live
+        cwd = _session.cwd() if self._cache is not None and on_output is None else None
+        if cwd is not None and (cached := self._cache.get(command, cwd)) is not None:
+            return cached
+        result = await _session.run(command, on_output=on_output, timeout=timeout)
+        if self._cache is not None:
+            # a result is only keyed on the directory if the shell is still in it
+            if cwd is not None and result.system is None and _session.cwd() == cwd:
+                self._cache.put(command, cwd, result)
+            elif command_kind(command) == "write":
+                # it may have written something even if it did not finish normally
+                self._cache.clear()
+        return result
 
-        raise ToolError("no command provided.")
+    async def close(self):
+        """Stop every session of this tool, including the warm ones."""
+        for _session in self._sessions.values():
+            _session.stop()
+        self._sessions.clear()
+        await self._pool.close()
 
     def to_params(self) -> BetaToolBash20241022Param:
         return {
@@ -0,0 +1,241 @@
+"""Result cache for read-only shell commands."""
+
+import os
+import shlex
+import stat
+import time
+import weakref
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Literal
+
+from .debug import tool_logger
+
+# programs that only inspect the filesystem, as long as no shell features are used
+READ_ONLY_COMMANDS: frozenset[str] = frozenset(
+    {
+        "cat", "dir", "file", "find", "findstr", "grep", "head", "ls", "more",
+        "stat", "tail", "tree", "type", "wc", "where", "which",
+    }
+)
+READ_ONLY_GIT_COMMANDS: frozenset[str] = frozenset(
+    {"blame", "diff", "grep", "log", "ls-files", "rev-parse", "show", "status"}
+)
+# commands that change neither files nor cached results
+NEUTRAL_COMMANDS: frozenset[str] = frozenset(
+    {"cd", "chdir", "cls", "echo", "popd", "pushd", "pwd", "set", "title"}
+)
+# find options that write or run other programs
+FIND_ACTIONS: frozenset[str] = frozenset(
+    {"-delete", "-exec", "-execdir", "-fls", "-fprint", "-fprint0", "-fprintf", "-ok", "-okdir"}
+)
+# pipes, redirection, chaining and variable expansion make a command unpredictable
+UNSAFE_CHARACTERS: frozenset[str] = frozenset("|&;<>^%!`$()\n")
+WILDCARDS: frozenset[str] = frozenset("*?[")
+
+CommandKind = Literal["read", "write", "neutral"]
+
+
+def _split(command: str) -> list[str] | None:
+    if any(char in UNSAFE_CHARACTERS for char in command):
+        return None
+    try:
+        return [arg.strip("\"'") for arg in shlex.split(command, posix=False)]
+    except ValueError:
+        return None
+
+
+def command_kind(command: str) -> CommandKind:
+    """
+    Classify a command as read-only, neutral (changes only the shell's own state),
+    or a write. Anything that cannot be classified confidently is a write.
+    """
+    argv = _split(command)
+    if not argv:
+        return "write"
+    program = os.path.splitext(os.path.basename(argv[0]))[0].lower()
+    if program in NEUTRAL_COMMANDS:
+        return "neutral"
+    if program == "git":
+        # `--output=<file>` and `-o <file>` write what any subcommand prints to a file
+        if any(arg.split("=", 1)[0] == "--output" or arg.startswith("-o") for arg in argv[1:]):
+            return "write"
+        subcommand = next((arg for arg in argv[1:] if not arg.startswith("-")), None)
+        return "read" if subcommand in READ_ONLY_GIT_COMMANDS else "write"
+    if program == "find" and any(arg in FIND_ACTIONS for arg in argv[1:]):
+        return "write"
+    return "read" if program in READ_ONLY_COMMANDS else "write"
+
+
+def _git_root(cwd: str) -> str | None:
+    path = cwd
+    while True:
+        if os.path.isdir(os.path.join(path, ".git")):
+            return path
+        parent = os.path.dirname(path)
+        if parent == path:
+            return None
+        path = parent
+
+
+def _normalize(path: str) -> str:
+    return os.path.normcase(os.path.abspath(path))
+
+
+def paths_involved(argv: list[str], cwd: str) -> tuple[str, ...]:
+    """The paths whose state a read-only command's output depends on."""
+    paths = {cwd}
+    for arg in argv[1:]:
+        if arg.startswith("-") or (os.name == "nt" and arg.startswith("/")):
+            continue  # an option
+        if any(char in WILDCARDS for char in arg):
+            # the matches are whatever the containing directory holds
+            arg = os.path.dirname(arg) or "."
+        paths.add(os.path.join(cwd, arg))
+    if os.path.splitext(os.path.basename(argv[0]))[0].lower() == "git":
+        if root := _git_root(cwd):
+            paths.update(
+                {root, os.path.join(root, ".git", "index"), os.path.join(root, ".git", "HEAD")}
+            )
+    return tuple(sorted(_normalize(path) for path in paths))
+
+
+def fingerprint(path: str) -> tuple | None:
+    """
+    Cheap summary of a path's state: mtime and size for a file, and for a directory
+    also the names, sizes and mtimes of its entries (not recursively).
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    if not stat.S_ISDIR(st.st_mode):
+        return (st.st_mtime_ns, st.st_size)
+    listing = set()
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                entry_stat = entry.stat(follow_symlinks=False)
+                listing.add((entry.name, entry_stat.st_mtime_ns, entry_stat.st_size))
+    except OSError:
+        pass
+    return (st.st_mtime_ns, hash(frozenset(listing)))
+
+
+@dataclass
+class _Entry:
+    result: Any
+    paths: tuple[str, ...]
+    fingerprints: tuple
+    created: float
+
+
+# live caches, so that writes made outside of them (e.g. by EditTool) can invalidate them
+_caches: "weakref.WeakSet[CommandCache]" = weakref.WeakSet()
+
+
+class CommandCache:
+    """
+    LRU cache of the results of read-only commands.
+
+    Entries are keyed on the command and the working directory, and are only served
+    while the paths the command involves are unchanged. Running anything that is not
+    read-only clears the cache, since it could have changed anything; changes deep
+    inside a directory tree made behind the tools' backs are only caught by `max_age`.
+    """
+
+    def __init__(self, max_entries: int = 256, max_age: float | None = 60.0):
+        self.max_entries = max_entries
+        self.max_age = max_age  # seconds
+        self._entries: OrderedDict[tuple[str, str], _Entry] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        _caches.add(self)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, command: str, cwd: str) -> Any | None:
+        """Return the cached result of `command` run in `cwd`, if it is still valid."""
+        if command_kind(command) != "read":
+            return None
+        key = (command, _normalize(cwd))
+        entry = self._entries.get(key)
+        if entry is not None and self._is_fresh(entry):
+            self._entries.move_to_end(key)
+            self.hits += 1
+            tool_logger.debug(f"Command cache hit for '{command}'")
+            return entry.result
+        if entry is not None:
+            del self._entries[key]
+        self.misses += 1
+        return None
+
+    def _is_fresh(self, entry: _Entry) -> bool:
+        if self.max_age is not None and time.monotonic() - entry.created > self.max_age:
+            return False
+        return tuple(fingerprint(path) for path in entry.paths) == entry.fingerprints
+
+    def put(self, command: str, cwd: str, result: Any):
+        """
+        Record the result of a command that has just run: cache it if it is read-only,
+        or clear the cache if it may have written something.
+        """
+        kind = command_kind(command)
+        if kind == "write":
+            if self._entries:
+                self.clear()
+            return
+        if kind == "neutral":
+            return
+        cwd = _normalize(cwd)
+        argv = _split(command)
+        assert argv  # a read-only command always splits
+        paths = paths_involved(argv, cwd)
+        self._entries[(command, cwd)] = _Entry(
+            result=result,
+            paths=paths,
+            fingerprints=tuple(fingerprint(path) for path in paths),
+            created=time.monotonic(),
+        )
+        self._entries.move_to_end((command, cwd))
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, *paths: str | os.PathLike):
+        """Drop every entry involving one of `paths`, or a directory containing one."""
+        written = [_normalize(os.fspath(path)) for path in paths]
+        stale = [
+            key
+            for key, entry in self._entries.items()
+            if any(
+                involved == path
+                or path.startswith(involved.rstrip(os.sep) + os.sep)
+                or involved.startswith(path.rstrip(os.sep) + os.sep)
+                for involved in entry.paths
+                for path in written
+            )
+        ]
+        for key in stale:
+            del self._entries[key]
+        self.invalidations += len(stale)
+
+    def clear(self):
+        self.invalidations += len(self._entries)
+        self._entries.clear()
+
+    @property
+    def stats(self) -> dict[str, int]:
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+        }
+
+
+def invalidate_paths(*paths: str | os.PathLike):
+    """Tell every live cache that `paths` were written."""
+    for cache in list(_caches):
+        cache.invalidate(*paths)
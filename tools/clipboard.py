@@ -0,0 +1,82 @@
+"""Reading and writing the system clipboard, for pasting text instead of typing it."""
+
+import os
+import shutil
+import subprocess
+
+from .debug import tool_logger
+
+try:
+    import pyperclip
+except ImportError:  # pyautogui normally brings it along
+    pyperclip = None
+
+_TIMEOUT = 2.0  # seconds
+
+
+def _x11_commands() -> tuple[list[str], list[str]] | None:
+    """Commands to write and read the X11 clipboard selection, if a tool is installed."""
+    if shutil.which("xclip"):
+        return (
+            ["xclip", "-selection", "clipboard", "-in"],
+            ["xclip", "-selection", "clipboard", "-out"],
+        )
+    if shutil.which("xsel"):
+        return ["xsel", "--clipboard", "--input"], ["xsel", "--clipboard", "--output"]
+    return None
+
+
+def _x11_env(display: str | None) -> dict[str, str] | None:
+    return {**os.environ, "DISPLAY": display} if display else None
+
+
+def write_clipboard(text: str, display: str | None = None) -> bool:
+    """
+    Put `text` on the clipboard; return whether that worked. An X11 `display` other
+    than the default one is reached through xclip or xsel.
+    """
+    if pyperclip is not None and display is None:
+        try:
+            pyperclip.copy(text)
+            return True
+        except pyperclip.PyperclipException as e:
+            tool_logger.debug(f"pyperclip could not write the clipboard: {e}")
+    if (commands := _x11_commands()) is None:
+        return False
+    try:
+        subprocess.run(
+            commands[0],
+            input=text.encode(),
+            env=_x11_env(display),
+            timeout=_TIMEOUT,
+            check=True,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+    except (OSError, subprocess.SubprocessError) as e:
+        tool_logger.debug(f"{commands[0][0]} could not write the clipboard: {e}")
+        return False
+    return True
+
+
+def read_clipboard(display: str | None = None) -> str | None:
+    """Return the text on the clipboard, or None if it cannot be read."""
+    if pyperclip is not None and display is None:
+        try:
+            return pyperclip.paste()
+        except pyperclip.PyperclipException as e:
+            tool_logger.debug(f"pyperclip could not read the clipboard: {e}")
+    if (commands := _x11_commands()) is None:
+        return None
+    try:
+        result = subprocess.run(
+            commands[1],
+            env=_x11_env(display),
+            timeout=_TIMEOUT,
+            check=True,
+            capture_output=True,
+        )
+    except (OSError, subprocess.SubprocessError) as e:
+        tool_logger.debug(f"{commands[1][0]} could not read the clipboard: {e}")
+        return None
+    return result.stdout.decode(errors="replace")
@@ -1,20 +1,37 @@
 import asyncio
 import base64
+import io
 import os
-from pathlib import Path
-from typing import Literal, TypedDict
-from uuid import uuid4
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Literal, TypedDict
 from enum import Enum, StrEnum
 import pyautogui
-from PIL import ImageGrab
+from PIL import Image, ImageChops, features
 from anthropic.types.beta import BetaToolComputerUse20241022Param
 
 from .base import BaseAnthropicTool, ToolError, ToolResult
+from .clipboard import read_clipboard, write_clipboard
+from .display import Display, XdotoolInput
+from .debug import tool_logger
+from .locate import Match, TemplateLibrary, find_template
+from .screen import CaptureBackend, default_backend
+from .store import ScreenshotStore
 
 OUTPUT_DIR = "/tmp/outputs"
 
 TYPING_DELAY_MS = 12
 TYPING_GROUP_SIZE = 50
+PASTE_KEYS = ("command", "v") if sys.platform == "darwin" else ("ctrl", "v")
+
+UNCHANGED_MESSAGE = "screen unchanged since last screenshot"
+
+# qualities tried for lossy encodings, best first
+LOSSY_QUALITIES = (85, 75, 65, 55, 45, 35, 25)
+# a frame whose sample has more distinct colors than this is treated as photographic
+PHOTO_COLOR_COUNT = 4096
 
 Action = Literal[
     "key",
@@ -27,8 +44,20 @@ Action = Literal[
     "double_click",
     "screenshot",
     "cursor_position",
+    "batch",
+    "locate",
+    "remember_template",
+    "wait_for",
 ]
 
+# parameters other than text and coordinate, by the actions that take them
+ACTION_PARAMS: dict[str, frozenset[str]] = {
+    "batch": frozenset({"actions"}),
+    "locate": frozenset({"template", "threshold"}),
+    "remember_template": frozenset({"template", "region"}),
+    "wait_for": frozenset({"condition", "timeout", "interval"}),
+}
+
 
 class Resolution(TypedDict):
     width: int
@@ -49,12 +78,199 @@ class ScalingSource(StrEnum):
     API = "api"
 
 
+class BatchAction(TypedDict, total=False):
+    action: Action  # required
+    text: str
+    coordinate: tuple[int, int]
+    wait: float  # seconds to pause after the action
+
+
+WaitConditionKind = Literal[
+    "region_changed",
+    "region_stable",
+    "template_appeared",
+    "template_gone",
+    "pixel_color",
+]
+
+
+class WaitCondition(TypedDict, total=False):
+    condition: WaitConditionKind  # required
+    # left, top, right, bottom in API coordinates; the whole screen if not given
+    region: tuple[int, int, int, int]
+    template: str  # a stored template name, or base64 image data
+    coordinate: tuple[int, int]  # for pixel_color
+    color: tuple[int, int, int]  # for pixel_color
+    tolerance: int  # how far each channel may be from color
+    stable_for: float  # seconds the region must not change, for region_stable
+
+
 class ComputerToolOptions(TypedDict):
     display_height_px: int
     display_width_px: int
     display_number: int | None
 
 
+@dataclass(frozen=True)
+class ImageEncoding:
+    """How a screenshot was encoded."""
+
+    format: Literal["PNG", "JPEG", "WEBP"]
+    quality: int | None  # None for lossless
+    size: int  # bytes
+    seconds: float
+
+    @property
+    def media_type(self) -> str:
+        return f"image/{self.format.lower()}"
+
+
+def is_photographic(image: Image.Image) -> bool:
+    """Whether an image has too many colors for PNG to compress it well (photos, video)."""
+    sample = image.resize(
+        (max(1, image.width // 4), max(1, image.height // 4)), Image.Resampling.NEAREST
+    )
+    return sample.getcolors(PHOTO_COLOR_COUNT) is None
+
+
+def encode_image(
+    image: Image.Image,
+    byte_budget: int | None = None,
+    png_compress_level: int = 6,
+) -> tuple[bytes, ImageEncoding]:
+    """
+    Encode a screenshot in the format that suits its content: PNG for text and UI,
+    JPEG for photographic frames or when a PNG would exceed `byte_budget`, at the best
+    quality that fits the budget. WebP is smaller still but about ten times slower to
+    encode, so it is only used when no JPEG fits.
+    """
+    start = time.perf_counter()
+
+    def save(format: str, **params) -> bytes:
+        buffer = io.BytesIO()
+        image.save(buffer, format=format, **params)
+        return buffer.getvalue()
+
+    def done(data: bytes, format, quality: int | None) -> tuple[bytes, ImageEncoding]:
+        return data, ImageEncoding(
+            format=format,
+            quality=quality,
+            size=len(data),
+            seconds=time.perf_counter() - start,
+        )
+
+    def best_fit(format: str, **params) -> tuple[bytes, int] | None:
+        """The best quality encoding within the budget, if there is one."""
+        data = save(format, quality=LOSSY_QUALITIES[0], **params)
+        if len(data) <= byte_budget:
+            return data, LOSSY_QUALITIES[0]
+        # binary search the rest; lower qualities make smaller files
+        best = None
+        low, high = 1, len(LOSSY_QUALITIES) - 1
+        while low <= high:
+            middle = (low + high) // 2
+            data = save(format, quality=LOSSY_QUALITIES[middle], **params)
+            if len(data) <= byte_budget:
+                best = data, LOSSY_QUALITIES[middle]
+                high = middle - 1
+            else:
+                low = middle + 1
+        return best
+
+    if not is_photographic(image):
+        data = save("PNG", compress_level=png_compress_level)
+        if byte_budget is None or len(data) <= byte_budget:
+            return done(data, "PNG", None)
+
+    image = image.convert("RGB")
+    if byte_budget is None:
+        quality = LOSSY_QUALITIES[0]
+        return done(save("JPEG", quality=quality, optimize=True), "JPEG", quality)
+    if fit := best_fit("JPEG", optimize=True):
+        return done(fit[0], "JPEG", fit[1])
+    if features.check("webp") and (fit := best_fit("WEBP", method=2)):
+        return done(fit[0], "WEBP", fit[1])
+    # nothing fits; send the smallest we can make
+    format = "WEBP" if features.check("webp") else "JPEG"
+    quality = LOSSY_QUALITIES[-1]
+    return done(save(format, quality=quality), format, quality)
+
+
+@dataclass(frozen=True)
+class TextEntry:
+    """How the text of a type action was entered."""
+
+    method: Literal["typed", "pasted"]
+    chars: int
+    seconds: float
+
+
+class InputExecutor:
+    """
+    Runs blocking input and screen capture calls on one dedicated thread, in the order
+    they were submitted: input never interleaves, and the event loop stays free while
+    a long typewrite or a slow capture runs.
+    """
+
+    _slow_wait = 0.1  # seconds; queue waits longer than this are logged
+
+    def __init__(self):
+        self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="input")
+        self.queue_depth = 0  # calls submitted but not finished
+        self.max_queue_depth = 0
+        self.calls = 0
+        self._total_wait = 0.0  # seconds calls spent queued
+        self._total_run = 0.0  # seconds calls spent running
+
+    async def run(self, func: Callable[..., Any], *args: Any) -> Any:
+        submitted = time.perf_counter()
+
+        def call():
+            started = time.perf_counter()
+            try:
+                return func(*args)
+            finally:
+                self._total_wait += started - submitted
+                self._total_run += time.perf_counter() - started
+                self.calls += 1
+                if started - submitted > self._slow_wait:
+                    tool_logger.debug(
+                        f"{getattr(func, '__name__', func)} waited "
+                        f"{started - submitted:.3f}s behind {self.queue_depth - 1} calls"
+                    )
+
+        self.queue_depth += 1
+        self.max_queue_depth = max(self.max_queue_depth, self.queue_depth)
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._pool, call)
+        finally:
+            self.queue_depth -= 1
+
+    @property
+    def stats(self) -> dict[str, float]:
+        calls = self.calls or 1
+        return {
+            "queue_depth": self.queue_depth,
+            "max_queue_depth": self.max_queue_depth,
+            "calls": self.calls,
+            "mean_wait_ms": self._total_wait / calls * 1000,
+            "mean_run_ms": self._total_run / calls * 1000,
+        }
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+# input is global to the desktop, so every ComputerTool shares one executor by default
+_input_executor = InputExecutor()
+
+
+def _drag_to(mouse, x: int, y: int):
+    mouse.mouseDown()
+    mouse.moveTo(x, y)
+    mouse.mouseUp()
+
+
 def chunks(s: str, chunk_size: int) -> list[str]:
     return [s[i : i + chunk_size] for i in range(0, len(s), chunk_size)]
 
@@ -71,8 +287,38 @@ class ComputerTool(BaseAnthropicTool):
     height: int
     display_num: int | None
 
-    _screenshot_delay = 2.0
+    _screenshot_delay = 2.0  # seconds; the longest a screenshot waits for the screen to settle
+    _settle_interval = 0.05  # seconds between the frames compared while settling
+    _settle_frames = 3  # consecutive matching frames that count as settled
     _scaling_enabled = True
+    # zlib level for screenshot PNGs: 1 is fastest, 9 is smallest
+    _png_compress_level = 6
+    # screenshots larger than this are sent lossy; None sends PNG unless photographic
+    _image_byte_budget: int | None = 512 * 1024
+    # keep every screenshot in a ScreenshotStore at OUTPUT_DIR unless given a store
+    _save_screenshots = False
+    # answer with UNCHANGED_MESSAGE instead of an image identical to the last one sent
+    _skip_unchanged = True
+    _fingerprint_scale = 8  # fingerprints are 1/8 of the sent image in each dimension
+    _change_threshold = 8  # grey levels (of 255) a fingerprint cell may drift by
+    # "region" sends only the bounding box of what changed since the last screenshot
+    _screenshot_mode: Literal["full", "region"] = "full"
+    _max_region_fraction = 0.5  # send the full frame if more than this changed
+    _region_padding = 8  # pixels of context around a changed region
+    _max_batch_wait = 5.0  # seconds; longest pause allowed between batched actions
+    # text longer than this (or that is not plain ASCII) is pasted rather than typed
+    _paste_threshold = 100
+    _paste_settle = 0.2  # seconds for the target to read the clipboard before it is restored
+    _typing_interval = TYPING_DELAY_MS / 1000  # seconds between typed characters
+    _locate_threshold = 0.8  # lowest confidence reported as a match
+    _locate_downscale = 4  # templates are first matched on frames shrunk this much
+    _max_wait_for = 300.0  # seconds; the longest timeout wait_for accepts
+    _min_poll_interval = 0.02  # seconds
+
+    @property
+    def _input(self):
+        """pyautogui, or an xdotool stand-in for it when driving a leased display."""
+        return self._xdotool_input or pyautogui
 
     @property
     def options(self) -> ComputerToolOptions:
@@ -88,20 +334,60 @@ class ComputerTool(BaseAnthropicTool):
     def to_params(self) -> BetaToolComputerUse20241022Param:
         return {"name": self.name, "type": self.api_type, **self.options}
 
-    def __init__(self):
+    def __init__(
+        self,
+        capture: CaptureBackend | None = None,
+        executor: InputExecutor | None = None,
+        store: ScreenshotStore | None = None,
+        display: Display | None = None,
+        templates: TemplateLibrary | None = None,
+    ):
         super().__init__()
 
-        self.width = int(os.getenv("WIDTH") or 0)
-        self.height = int(os.getenv("HEIGHT") or 0)
-        assert self.width and self.height, "WIDTH, HEIGHT must be set"
-        if (display_num := os.getenv("DISPLAY_NUM")) is not None:
-            self.display_num = int(display_num)
-            self._display_prefix = f"DISPLAY=:{self.display_num} "
+        # without a display handle (e.g. leased from a DisplayPool), use the env's desktop
+        self._xdotool_input = None
+        if display is not None:
+            self.width = display.width
+            self.height = display.height
+            self.display_num = display.number
+            self._display_prefix = f"DISPLAY={display.name} "
+            self._xdisplay = display.name
+            # pyautogui is bound to the display it was imported under
+            self._xdotool_input = XdotoolInput(display.name, TYPING_DELAY_MS)
         else:
-            self.display_num = None
-            self._display_prefix = ""
+            self.width = int(os.getenv("WIDTH") or 0)
+            self.height = int(os.getenv("HEIGHT") or 0)
+            assert self.width and self.height, "WIDTH, HEIGHT must be set"
+            if (display_num := os.getenv("DISPLAY_NUM")) is not None:
+                self.display_num = int(display_num)
+                self._display_prefix = f"DISPLAY=:{self.display_num} "
+            else:
+                self.display_num = None
+                self._display_prefix = ""
+            self._xdisplay = None
+            if self.display_num is not None and sys.platform == "linux":
+                self._xdisplay = f":{self.display_num}"
 
         self.xdotool = None
+        if capture is None:
+            capture = default_backend(self._xdisplay)
+        self._capture = capture
+        if executor is None:
+            # input to different displays need not wait for each other
+            executor = _input_executor if display is None else InputExecutor()
+        self._executor = executor
+        if store is None and self._save_screenshots:
+            store = ScreenshotStore(OUTPUT_DIR)
+        self._store = store
+        self.last_text_entry: TextEntry | None = None
+        # set by input actions: the next screenshot first waits for the screen to settle
+        self._needs_settle = False
+        self.last_settle_time: float | None = None
+        self._last_fingerprint: Image.Image | None = None
+        self._last_frame: Image.Image | None = None
+        self.last_encoding: ImageEncoding | None = None
+        self.templates = templates if templates is not None else TemplateLibrary()
+        self.last_matches: list[Match] = []
 
     async def __call__(
         self,
@@ -109,29 +395,134 @@ class ComputerTool(BaseAnthropicTool):
         action: Action,
         text: str | None = None,
         coordinate: tuple[int, int] | None = None,
+        actions: list[BatchAction] | None = None,
+        template: str | None = None,
+        threshold: float | None = None,
+        region: tuple[int, int, int, int] | None = None,
+        condition: WaitCondition | None = None,
+        timeout: float | None = None,
+        interval: float | None = None,
     ):
+        params = {
+            "actions": actions,
+            "template": template,
+            "threshold": threshold,
+            "region": region,
+            "condition": condition,
+            "timeout": timeout,
+            "interval": interval,
+        }
+        position = self._validate(action, text, coordinate, params)
+        if action == "batch":
+            assert actions is not None
+            return await self.batch(actions)
+        if action == "locate":
+            assert template is not None
+            return await self.locate(template, threshold)
+        if action == "remember_template":
+            assert template is not None and region is not None
+            return self.remember_template(template, tuple(region))
+        if action == "wait_for":
+            assert condition is not None
+            polling = {"timeout": timeout, "interval": interval}
+            return await self.wait_for(
+                condition, **{name: value for name, value in polling.items() if value is not None}
+            )
+        return await self._perform(action, text, position)
+
+    async def batch(self, actions: list[BatchAction]) -> ToolResult:
+        """
+        Run a sequence of actions back to back and take a single screenshot at the end.
+
+        Every action is validated (and its coordinate scaled) before any of them runs.
+        Execution stops at the first action that fails; the outputs so far, the error
+        and the final screenshot are merged into one result.
+        """
+        steps: list[tuple[BatchAction, tuple[int, int] | None]] = []
+        for number, step in enumerate(actions, start=1):
+            action = step.get("action")
+            if action == "screenshot":
+                raise ToolError(
+                    f"action {number}: screenshot is not accepted in a batch; "
+                    "one is taken at the end"
+                )
+            if action == "batch":
+                raise ToolError(f"action {number}: a batch cannot contain another batch")
+            try:
+                position = self._validate(action, step.get("text"), step.get("coordinate"))
+                wait = step.get("wait")
+                if wait is not None and (
+                    isinstance(wait, bool) or not isinstance(wait, (int, float)) or wait < 0
+                ):
+                    raise ToolError(
+                        f"wait must be a non-negative number of seconds, not {wait!r}"
+                    )
+            except ToolError as e:
+                raise ToolError(f"action {number} ({action}): {e.message}") from None
+            steps.append((step, position))
+
+        outputs: list[str] = []
+        error = None
+        for number, (step, position) in enumerate(steps, start=1):
+            try:
+                result = await self._perform(step["action"], step.get("text"), position)
+            except Exception as e:
+                message = e.message if isinstance(e, ToolError) else str(e)
+                error = f"action {number} ({step['action']}) failed: {message}"
+                break
+            if result.output:
+                outputs.append(result.output)
+            if wait := step.get("wait"):
+                await asyncio.sleep(min(wait, self._max_batch_wait))
+
+        screenshot = await self.screenshot()
+        if screenshot.output:
+            outputs.append(screenshot.output)
+        return screenshot.replace(output="\n".join(outputs) or None, error=error)
+
+    def _validate(
+        self,
+        action: Action,
+        text: str | None,
+        coordinate: tuple[int, int] | None,
+        params: dict[str, Any] | None = None,
+    ) -> tuple[int, int] | None:
+        """
+        Check the arguments of an action, including the `params` only some actions
+        take; return its coordinate scaled to the screen.
+        """
+        params = {name: value for name, value in (params or {}).items() if value is not None}
+        if unexpected := sorted(params.keys() - ACTION_PARAMS.get(action, frozenset())):
+            raise ToolError(f"{unexpected[0]} is not accepted for {action}")
+
+        if action == "batch" and not params.get("actions"):
+            raise ToolError("actions is required for batch")
+        if action in ("locate", "remember_template") and not params.get("template"):
+            raise ToolError(f"template is required for {action}")
+        if action == "locate" and (threshold := params.get("threshold")) is not None:
+            if not 0 < threshold <= 1:
+                raise ToolError(f"threshold must be between 0 and 1, not {threshold}")
+        if action == "remember_template":
+            if (region := params.get("region")) is None:
+                raise ToolError("region is required for remember_template")
+            if len(region) != 4:
+                raise ToolError("region must be left, top, right, bottom")
+        if action == "wait_for":
+            if not isinstance(params.get("condition"), dict):
+                raise ToolError("condition is required for wait_for")
+            for name in ("timeout", "interval"):
+                if (value := params.get(name)) is not None and value <= 0:
+                    raise ToolError(f"{name} must be positive, not {value}")
+
         if action in ("mouse_move", "left_click_drag"):
             if coordinate is None:
                 raise ToolError(f"coordinate is required for {action}")
-            x, y = self.scale_coordinates(ScalingSource.API, *coordinate)
-
-            if action == "mouse_move":
-                pyautogui.moveTo(x, y)
-            elif action == "left_click_drag":
-                pyautogui.mouseDown()
-                pyautogui.moveTo(x, y)
-                pyautogui.mouseUp()
-            return ToolResult(output=f"Mouse moved to {x}, {y}")
+            return self.scale_coordinates(ScalingSource.API, *coordinate)
 
         if action in ("key", "type"):
             if text is None:
                 raise ToolError(f"text is required for {action}")
-
-            if action == "key":
-                pyautogui.press(text)
-            elif action == "type":
-                pyautogui.typewrite(text, interval=TYPING_DELAY_MS / 1000)
-            return ToolResult(output=f"Typed: {text}")
+            return None
 
         if action in (
             "left_click",
@@ -140,58 +531,458 @@ class ComputerTool(BaseAnthropicTool):
             "middle_click",
             "screenshot",
             "cursor_position",
+            "batch",
+            "locate",
+            "remember_template",
+            "wait_for",
         ):
             if text is not None:
                 raise ToolError(f"text is not accepted for {action}")
             if coordinate is not None:
                 raise ToolError(f"coordinate is not accepted for {action}")
+            return None
 
-            if action == "screenshot":
-                return await self.screenshot()
-            elif action == "cursor_position":
-                x, y = pyautogui.position()
-                x, y = self.scale_coordinates(
-                    ScalingSource.COMPUTER, x, y
+        raise ToolError(f"Invalid action: {action}")
+
+    async def _perform(
+        self, action: Action, text: str | None, position: tuple[int, int] | None
+    ) -> ToolResult:
+        """Carry out an action whose arguments have been validated."""
+        if action not in ("screenshot", "cursor_position"):
+            self._needs_settle = True
+        if action in ("mouse_move", "left_click_drag"):
+            assert position is not None
+            x, y = position
+            if action == "mouse_move":
+                await self._executor.run(self._input.moveTo, x, y)
+            elif action == "left_click_drag":
+                await self._executor.run(_drag_to, self._input, x, y)
+            return ToolResult(output=f"Mouse moved to {x}, {y}")
+
+        if action in ("key", "type"):
+            assert text is not None
+            if action == "type":
+                entry = await self._enter_text(text)
+                return ToolResult(
+                    output=f"Typed ({entry.method}, {entry.seconds:.2f}s): {text}"
                 )
-                return ToolResult(output=f"X={x},Y={y}")
-            else:
-                click_arg = {
-                    "left_click": pyautogui.click,
-                    "right_click": pyautogui.rightClick,
-                    "middle_click": pyautogui.middleClick,
-                    "double_click": pyautogui.doubleClick,
-                }[action]
-                click_arg()
-                return ToolResult(output=f"{action} performed")
+            await self._executor.run(self._input.press, text)
+            return ToolResult(output=f"Typed: {text}")
 
-        raise ToolError(f"Invalid action: {action}")
+        if action == "screenshot":
+            return await self.screenshot()
+        elif action == "cursor_position":
+            x, y = await self._executor.run(self._input.position)
+            x, y = self.scale_coordinates(
+                ScalingSource.COMPUTER, x, y
+            )
+            return ToolResult(output=f"X={x},Y={y}")
+        else:
+            click_arg = {
+                "left_click": self._input.click,
+                "right_click": self._input.rightClick,
+                "middle_click": self._input.middleClick,
+                "double_click": self._input.doubleClick,
+            }[action]
+            await self._executor.run(click_arg)
+            return ToolResult(output=f"{action} performed")
+
+    async def _enter_text(self, text: str) -> TextEntry:
+        """
+        Enter text into the focused window. Long or non-ASCII text is pasted through
+        the clipboard, which takes the same time for any length; short text, or text
+        the clipboard could not take, is typed in groups, `_typing_interval` apart
+        per character so that slow targets keep up.
+        """
+        start = time.perf_counter()
+        method = "typed"
+        if len(text) > self._paste_threshold or not text.isascii():
+            if await self._paste(text):
+                method = "pasted"
+            elif not text.isascii():
+                tool_logger.warning("Typing non-ASCII text; some characters may be lost")
+        if method == "typed":
+            for group in chunks(text, TYPING_GROUP_SIZE):
+                await self._executor.run(self._input.typewrite, group, self._typing_interval)
+                await asyncio.sleep(TYPING_DELAY_MS / 1000)
+
+        entry = TextEntry(method=method, chars=len(text), seconds=time.perf_counter() - start)
+        self.last_text_entry = entry
+        tool_logger.debug(
+            f"{entry.method.capitalize()} {entry.chars} characters in {entry.seconds:.3f}s"
+        )
+        return entry
+
+    async def _paste(self, text: str) -> bool:
+        """
+        Paste text through the clipboard, restoring its old content afterwards. Returns
+        False, so that the text is typed instead, if the clipboard does not hold the
+        text once it was written. Only the clipboard is checked: whether the target
+        accepted the paste keystroke is not, and the result reports the text as pasted.
+        """
+        run = self._executor.run
+        previous = await run(read_clipboard, self._xdisplay)
+        # check what landed on the clipboard before pasting it anywhere
+        if (
+            not await run(write_clipboard, text, self._xdisplay)
+            or await run(read_clipboard, self._xdisplay) != text
+        ):
+            tool_logger.debug("Clipboard unavailable; typing instead of pasting")
+            return False
+        await run(self._input.hotkey, *PASTE_KEYS)
+        await asyncio.sleep(self._paste_settle)
+        if previous is not None:
+            await run(write_clipboard, previous, self._xdisplay)
+        return True
+
+    async def screenshot(self, force: bool = False, region: bool | None = None):
+        """
+        Take a screenshot of the current screen and return the base64 encoded image.
+        If the screen looks the same as in the last screenshot returned, return a short
+        note instead, unless `force` is set. In region mode (`region`, defaulting to
+        `_screenshot_mode`), only the part that changed since then is returned.
+        """
+        screenshot = await self._grab_frame()
+        fingerprint = self._fingerprint(screenshot)
+        if not force and self._skip_unchanged and self._is_unchanged(fingerprint):
+            return ToolResult(output=UNCHANGED_MESSAGE)
+        self._last_fingerprint = fingerprint
+
+        if region is None:
+            region = self._screenshot_mode == "region"
+        box = self._changed_box(screenshot) if region and not force else None
+        # an unscaled frame may be a buffer the backend reuses for later grabs
+        self._last_frame = screenshot.copy() if self._scaling_target() is None else screenshot
+        output = None
+        if box is not None:
+            left, top, right, bottom = box
+            output = (
+                f"Only the changed region of the screen is shown: it spans ({left}, {top}) "
+                f"to ({right}, {bottom}) of the {screenshot.width}x{screenshot.height} "
+                f"screen. Add ({left}, {top}) to a position in this image to get its "
+                "screen coordinate."
+            )
+            screenshot = screenshot.crop(box)
 
-    async def screenshot(self):
-        """Take a screenshot of the current screen and return the base64 encoded image."""
-        output_dir = Path(OUTPUT_DIR)
-        output_dir.mkdir(parents=True, exist_ok=True)
-        path = output_dir / f"screenshot_{uuid4().hex}.png"
+        # encoding takes tens of milliseconds; keep the event loop free meanwhile
+        data, encoding = await asyncio.to_thread(
+            encode_image, screenshot, self._image_byte_budget, self._png_compress_level
+        )
+        self.last_encoding = encoding
+        tool_logger.debug(
+            f"Encoded {screenshot.width}x{screenshot.height} screenshot as "
+            f"{encoding.format} (quality {encoding.quality}): {encoding.size} bytes "
+            f"in {encoding.seconds:.4f}s"
+        )
 
-        screenshot = ImageGrab.grab()
-        screenshot.save(path)
+        image_hash = None
+        if self._store is not None:
+            image_hash = await asyncio.to_thread(
+                self._store.put, data, encoding.format.lower()
+            )
 
-        if path.exists():
-            return ToolResult(
-                base64_image=base64.b64encode(path.read_bytes()).decode()
+        return ToolResult(
+            output=output,
+            base64_image=base64.b64encode(data).decode(),
+            image_media_type=encoding.media_type,
+            image_hash=image_hash,
+        )
+
+    async def _grab_frame(self) -> Image.Image:
+        """
+        Capture the screen (waiting for it to settle after input) at the resolution
+        the API's coordinates refer to.
+        """
+        if self._needs_settle:
+            self._needs_settle = False
+            await self._settle()
+        frame = await self._executor.run(self._capture.grab)
+        if (target := self._scaling_target()) is not None:
+            frame = frame.resize(
+                (target["width"], target["height"]),
+                Image.Resampling.BILINEAR,
+                reducing_gap=2.0,
             )
-        raise ToolError(f"Failed to take screenshot.")
+        return frame
+
+    def _template_image(self, template: str | bytes | Image.Image) -> Image.Image:
+        """Resolve a template given as an image, encoded image data, or a stored name."""
+        if isinstance(template, Image.Image):
+            return template
+        if isinstance(template, str):
+            if (image := self.templates.get(template)) is not None:
+                return image
+            try:
+                template = base64.b64decode(template, validate=True)
+            except ValueError:
+                raise ToolError(f"Unknown template: {template}") from None
+        try:
+            with Image.open(io.BytesIO(template)) as image:
+                return image.convert("RGB")
+        except OSError:
+            raise ToolError("The template is not a stored name or a readable image") from None
+
+    async def _find(
+        self,
+        template: Image.Image,
+        threshold: float | None = None,
+        max_matches: int = 5,
+        frame: Image.Image | None = None,
+    ) -> list[Match]:
+        """Find a template on the screen (or in `frame`), in API coordinates."""
+        if frame is None:
+            frame = await self._grab_frame()
+        return await asyncio.to_thread(
+            find_template,
+            frame,
+            template,
+            self._locate_threshold if threshold is None else threshold,
+            max_matches,
+            downscale=self._locate_downscale,
+        )
 
-    def scale_coordinates(self, source: ScalingSource, x: int, y: int):
-        """Scale coordinates to a target maximum resolution."""
-        # Always perform scaling
+    async def locate(
+        self,
+        template: str | bytes | Image.Image,
+        threshold: float | None = None,
+        max_matches: int = 5,
+    ) -> ToolResult:
+        """
+        Find a UI element on screen by matching a reference image, locally and without
+        a screenshot round trip. `template` is the name of a stored template, an
+        image, or its encoded (optionally base64) data, at the scale of the API's
+        screenshots. Matches are reported best first, by the API coordinate of their
+        center.
+        """
+        image = self._template_image(template)
+        start = time.perf_counter()
+        matches = self.last_matches = await self._find(image, threshold, max_matches)
+        tool_logger.debug(
+            f"Located {len(matches)} matches in {(time.perf_counter() - start) * 1000:.1f}ms"
+        )
+        if not matches:
+            return ToolResult(output="No match found")
+        return ToolResult(
+            output="\n".join(
+                f"Match at {match.center[0]}, {match.center[1]} "
+                f"({match.width}x{match.height}, confidence {match.confidence:.2f})"
+                for match in matches
+            )
+        )
+
+    def remember_template(self, name: str, box: tuple[int, int, int, int]) -> ToolResult:
+        """
+        Store the part of the last screenshot inside `box` (left, top, right, bottom,
+        in API coordinates) as a template to locate later by `name`.
+        """
+        if self._last_frame is None:
+            raise ToolError("Take a screenshot before storing a template")
+        left, top, right, bottom = box
+        if not (0 <= left < right <= self._last_frame.width) or not (
+            0 <= top < bottom <= self._last_frame.height
+        ):
+            raise ToolError(f"Box {box} is not inside the screen")
+        self.templates.add(name, self._last_frame.crop(box))
+        return ToolResult(output=f"Stored template {name}")
+
+    async def wait_for(
+        self, condition: WaitCondition, timeout: float = 30.0, interval: float = 0.25
+    ) -> ToolResult:
+        """
+        Poll the screen locally every `interval` seconds until `condition` holds or
+        `timeout` seconds pass, then return a single screenshot. Region conditions
+        capture only their region while polling.
+        """
+        kind = condition.get("condition")
+        region, check = self._wait_check(kind, condition)
+        timeout = min(timeout, self._max_wait_for)
+        interval = max(interval, self._min_poll_interval)
+
+        start = time.perf_counter()
+        deadline = start + timeout
+        polls = 0
+        while True:
+            polls += 1
+            frame = await self._grab_region(region)
+            if met := await check(frame):
+                break
+            if time.perf_counter() + interval > deadline:
+                break
+            await asyncio.sleep(interval)
+
+        elapsed = time.perf_counter() - start
+        tool_logger.debug(
+            f"wait_for {kind}: {'met' if met else 'timed out'} after {elapsed:.2f}s "
+            f"and {polls} polls"
+        )
+        screenshot = await self.screenshot(force=True)
+        if met:
+            return screenshot.replace(output=f"{kind} after {elapsed:.1f}s")
+        return screenshot.replace(error=f"Timed out after {elapsed:.1f}s waiting for {kind}")
+
+    def _wait_check(
+        self, kind: WaitConditionKind | None, condition: WaitCondition
+    ) -> tuple[tuple[int, int, int, int] | None, Callable[[Image.Image], Awaitable[bool]]]:
+        """
+        Validate a wait condition; return the region to poll (None for the whole
+        screen) and a check to run on each polled frame.
+        """
+        region = condition.get("region")
+        if kind == "pixel_color":
+            coordinate, color = condition.get("coordinate"), condition.get("color")
+            if coordinate is None or color is None:
+                raise ToolError("coordinate and color are required for pixel_color")
+            if region is not None:
+                raise ToolError("region is not accepted for pixel_color")
+            x, y = coordinate
+            region = (x, y, x + 1, y + 1)  # poll just that pixel
+        if region is not None:
+            left, top, right, bottom = region
+            width, height = self.scale_coordinates(ScalingSource.COMPUTER, self.width, self.height)
+            if not (0 <= left < right <= width and 0 <= top < bottom <= height):
+                raise ToolError(f"region {region} is not inside the screen")
+
+        if kind == "pixel_color":
+            tolerance = condition.get("tolerance", 8)
+
+            async def check_pixel(frame: Image.Image) -> bool:
+                pixel = frame.convert("RGB").getpixel((0, 0))
+                return all(abs(a - b) <= tolerance for a, b in zip(pixel, color))
+
+            return region, check_pixel
+
+        if kind in ("region_changed", "region_stable"):
+            # a region is compared pixel for pixel, in color; the whole screen by fingerprint
+            reduce = self._fingerprint if region is None else lambda frame: frame.convert("RGB")
+            first: Image.Image | None = None
+            previous: Image.Image | None = None
+            stable_since = time.perf_counter()
+            stable_for = condition.get("stable_for", 1.0)
+
+            async def check_region(frame: Image.Image) -> bool:
+                nonlocal first, previous, stable_since
+                current = reduce(frame)
+                if first is None:
+                    first = previous = current
+                    stable_since = time.perf_counter()
+                    return False
+                if kind == "region_changed":
+                    return not self._same_fingerprint(current, first)
+                if not self._same_fingerprint(current, previous):
+                    stable_since = time.perf_counter()
+                previous = current
+                return time.perf_counter() - stable_since >= stable_for
+
+            return region, check_region
+
+        if kind in ("template_appeared", "template_gone"):
+            if (template := condition.get("template")) is None:
+                raise ToolError(f"template is required for {kind}")
+            image = self._template_image(template)
+
+            async def check_template(frame: Image.Image) -> bool:
+                found = bool(await self._find(image, max_matches=1, frame=frame))
+                return found == (kind == "template_appeared")
+
+            return region, check_template
+
+        raise ToolError(f"Invalid wait condition: {kind}")
+
+    async def _grab_region(self, region: tuple[int, int, int, int] | None) -> Image.Image:
+        """Capture a box given in API coordinates, or the whole screen, at API resolution."""
+        if region is None:
+            return await self._grab_frame()
+        if self._needs_settle:
+            self._needs_settle = False
+            await self._settle()
+        left, top = self.scale_coordinates(ScalingSource.API, region[0], region[1])
+        right, bottom = self.scale_coordinates(ScalingSource.API, region[2], region[3])
+        frame = await self._executor.run(self._capture.grab, (left, top, right, bottom))
+        size = (region[2] - region[0], region[3] - region[1])
+        if frame.size != size:
+            frame = frame.resize(size, Image.Resampling.BILINEAR)
+        return frame
+
+    def _fingerprint(self, screenshot: Image.Image) -> Image.Image:
+        """A small greyscale copy of a frame, each pixel the average of a block."""
+        return screenshot.reduce(self._fingerprint_scale).convert("L")
+
+    def _is_unchanged(self, fingerprint: Image.Image) -> bool:
+        return self._same_fingerprint(fingerprint, self._last_fingerprint)
+
+    def _same_fingerprint(self, first: Image.Image, second: Image.Image | None) -> bool:
+        if second is None or first.size != second.size:
+            return False
+        extrema = ImageChops.difference(first, second).getextrema()
+        if first.mode != "L":  # one (min, max) pair per band
+            return max(high for _, high in extrema) <= self._change_threshold
+        return extrema[1] <= self._change_threshold
+
+    async def _settle(self) -> float:
+        """
+        Wait until `_settle_frames` consecutive low-resolution frames match, or at most
+        `_screenshot_delay` seconds; return how long that took.
+        """
+        start = time.perf_counter()
+        deadline = start + self._screenshot_delay
+        previous = None
+        matching = 1
+        while True:
+            fingerprint = self._fingerprint(await self._executor.run(self._capture.grab))
+            if self._same_fingerprint(fingerprint, previous):
+                matching += 1
+            else:
+                matching = 1
+            previous = fingerprint
+            if matching >= self._settle_frames or time.perf_counter() >= deadline:
+                break
+            await asyncio.sleep(self._settle_interval)
+
+        elapsed = time.perf_counter() - start
+        self.last_settle_time = elapsed
+        if matching < self._settle_frames:
+            tool_logger.debug(f"Screen still changing after {elapsed:.3f}s; not waiting longer")
+        else:
+            tool_logger.debug(f"Screen settled in {elapsed:.3f}s")
+        return elapsed
+
+    def _changed_box(self, screenshot: Image.Image) -> tuple[int, int, int, int] | None:
+        """
+        The padded bounding box of what changed since the last frame sent, in API
+        coordinates, or None if the full frame should be sent instead.
+        """
+        last = self._last_frame
+        if last is None or last.size != screenshot.size:
+            return None
+        threshold = self._change_threshold
+        mask = ImageChops.difference(screenshot, last).convert("L")
+        box = mask.point(lambda value: 255 if value > threshold else 0).getbbox()
+        if box is None:
+            return None
+        pad = self._region_padding
+        left, top = max(0, box[0] - pad), max(0, box[1] - pad)
+        right = min(screenshot.width, box[2] + pad)
+        bottom = min(screenshot.height, box[3] + pad)
+        area = (right - left) * (bottom - top)
+        if area > self._max_region_fraction * screenshot.width * screenshot.height:
+            return None
+        return left, top, right, bottom
+
+    def _scaling_target(self) -> Resolution | None:
+        """The resolution the API sees the screen at, or None if it sees it unscaled."""
         ratio = self.width / self.height
-        target_dimension = None
         for dimension in MAX_SCALING_TARGETS.values():
             # allow some error in the aspect ratio - not ratios are exactly 16:9
             if abs(dimension["width"] / dimension["height"] - ratio) < 0.02:
                 if dimension["width"] < self.width:
-                    target_dimension = dimension
-                break
+                    return dimension
+                return None
+        return None
+
+    def scale_coordinates(self, source: ScalingSource, x: int, y: int):
+        """Scale coordinates to a target maximum resolution."""
+        # Always perform scaling
+        target_dimension = self._scaling_target()
         if target_dimension is None:
             return x, y
         # should be less than 1
@@ -0,0 +1,276 @@
+"""A pool of virtual X displays, so that many ComputerTool agents can share one host."""
+
+import asyncio
+import contextlib
+import os
+import shutil
+import socket
+import subprocess
+import time
+from dataclasses import dataclass, field
+
+from .base import ToolError
+from .debug import tool_logger
+
+X11_SOCKET_DIR = "/tmp/.X11-unix"
+DEFAULT_WINDOW_MANAGER: tuple[str, ...] = ("mutter", "--replace", "--sm-disable")
+PROBE_TIMEOUT = 0.5  # seconds to wait for an X server to accept a connection
+
+
+@dataclass
+class Display:
+    """A virtual X display; ComputerTool takes one as an explicit handle instead of env vars."""
+
+    number: int
+    width: int
+    height: int
+    processes: list[asyncio.subprocess.Process] = field(default_factory=list, repr=False)
+
+    @property
+    def name(self) -> str:
+        return f":{self.number}"
+
+    @property
+    def env(self) -> dict[str, str]:
+        return {**os.environ, "DISPLAY": self.name}
+
+    def healthy(self) -> bool:
+        """
+        Whether the X server (and window manager) still run and the server accepts
+        connections. The server's socket is connected to, since a killed server can
+        leave the socket file behind.
+        """
+        if any(process.returncode is not None for process in self.processes):
+            return False
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+            probe.settimeout(PROBE_TIMEOUT)
+            try:
+                probe.connect(os.path.join(X11_SOCKET_DIR, f"X{self.number}"))
+            except OSError:
+                return False
+        return True
+
+
+class DisplayPool:
+    """
+    Keeps `size` Xvfb displays (each with a window manager) running and leases them out,
+    one agent per display. On release, a display is shut down and a fresh one started
+    in its place in the background, so every lease starts from a clean desktop.
+    """
+
+    _start_timeout = 10.0  # seconds for an X server to accept connections
+
+    def __init__(
+        self,
+        size: int,
+        width: int = 1024,
+        height: int = 768,
+        first_display: int = 10,
+        window_manager: tuple[str, ...] | None = DEFAULT_WINDOW_MANAGER,
+        recycle: bool = True,
+    ):
+        self.size = size
+        self.width = width
+        self.height = height
+        self.window_manager = window_manager
+        self.recycle = recycle
+        self._numbers = list(range(first_display, first_display + size))
+        self._ready: asyncio.Queue[Display] = asyncio.Queue()
+        self._leased: set[int] = set()
+        self._refills: set[asyncio.Task] = set()
+        # metrics
+        self.leases = 0
+        self._total_wait = 0.0  # seconds spent waiting for a display
+        self.max_wait = 0.0
+        self._busy_time = 0.0  # display-seconds spent leased
+        self._lease_started: dict[int, float] = {}
+        self._created = time.monotonic()
+
+    async def start(self):
+        """Launch every display of the pool."""
+        if shutil.which("Xvfb") is None:
+            raise ToolError("the display pool needs Xvfb")
+        displays = await asyncio.gather(*(self._launch(number) for number in self._numbers))
+        for display in displays:
+            self._ready.put_nowait(display)
+
+    async def _launch(self, number: int) -> Display:
+        display = Display(number, self.width, self.height)
+        server = await asyncio.create_subprocess_exec(
+            "Xvfb",
+            display.name,
+            "-screen",
+            "0",
+            f"{self.width}x{self.height}x24",
+            "-nolisten",
+            "tcp",
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.DEVNULL,
+        )
+        display.processes.append(server)
+        deadline = time.monotonic() + self._start_timeout
+        while not display.healthy():
+            if server.returncode is not None or time.monotonic() > deadline:
+                await self._stop(display)
+                raise ToolError(f"X server {display.name} did not start")
+            await asyncio.sleep(0.05)
+
+        if self.window_manager and shutil.which(self.window_manager[0]):
+            display.processes.append(
+                await asyncio.create_subprocess_exec(
+                    *self.window_manager,
+                    env=display.env,
+                    stdout=asyncio.subprocess.DEVNULL,
+                    stderr=asyncio.subprocess.DEVNULL,
+                )
+            )
+        tool_logger.info(f"Started display {display.name}")
+        return display
+
+    async def _stop(self, display: Display):
+        # window manager first, then the server
+        for process in reversed(display.processes):
+            if process.returncode is None:
+                process.terminate()
+                with contextlib.suppress(asyncio.TimeoutError):
+                    await asyncio.wait_for(process.wait(), timeout=5.0)
+                if process.returncode is None:
+                    process.kill()
+                    await process.wait()
+        display.processes.clear()
+
+    async def _replace(self, display: Display):
+        """Shut a display down and put a fresh one with the same number in the pool."""
+        await self._stop(display)
+        try:
+            fresh = await self._launch(display.number)
+        except ToolError as e:
+            tool_logger.error(f"Could not restart display {display.name}: {e.message}")
+            return
+        self._ready.put_nowait(fresh)
+
+    def _replace_in_background(self, display: Display):
+        task = asyncio.create_task(self._replace(display))
+        self._refills.add(task)
+        task.add_done_callback(self._refills.discard)
+
+    async def acquire(self) -> Display:
+        """Wait for a healthy display and lease it."""
+        start = time.monotonic()
+        while True:
+            display = await self._ready.get()
+            if display.healthy():
+                break
+            tool_logger.warning(f"Display {display.name} is unhealthy; replacing it")
+            self._replace_in_background(display)
+
+        waited = time.monotonic() - start
+        self.leases += 1
+        self._total_wait += waited
+        self.max_wait = max(self.max_wait, waited)
+        self._leased.add(display.number)
+        self._lease_started[display.number] = time.monotonic()
+        return display
+
+    def release(self, display: Display):
+        """Return a leased display, resetting it for the next agent."""
+        self._leased.discard(display.number)
+        self._busy_time += time.monotonic() - self._lease_started.pop(display.number)
+        if self.recycle or not display.healthy():
+            self._replace_in_background(display)
+        else:
+            self._ready.put_nowait(display)
+
+    @contextlib.asynccontextmanager
+    async def lease(self):
+        display = await self.acquire()
+        try:
+            yield display
+        finally:
+            self.release(display)
+
+    @property
+    def stats(self) -> dict[str, float]:
+        now = time.monotonic()
+        busy = self._busy_time + sum(now - start for start in self._lease_started.values())
+        return {
+            "size": self.size,
+            "leased": len(self._leased),
+            "ready": self._ready.qsize(),
+            "leases": self.leases,
+            "mean_wait_s": self._total_wait / self.leases if self.leases else 0.0,
+            "max_wait_s": self.max_wait,
+            # share of display time spent leased since the pool was created
+            "utilisation": busy / (self.size * (now - self._created) or 1),
+        }
+
+    async def close(self):
+        """Stop every display that is not leased, and any that are being restarted."""
+        for task in list(self._refills):
+            with contextlib.suppress(asyncio.CancelledError):
+                await task
+        while not self._ready.empty():
+            await self._stop(self._ready.get_nowait())
+
+
+class XdotoolInput:
+    """
+    Sends input to a specific X display through xdotool. pyautogui only talks to the
+    display it was imported under, so this stands in for it on leased displays; it
+    offers the subset of pyautogui's functions that ComputerTool uses.
+    """
+
+    _timeout = 30.0  # seconds
+
+    def __init__(self, display: str, typing_delay_ms: int = 12):
+        self._env = {**os.environ, "DISPLAY": display}
+        self._typing_delay_ms = typing_delay_ms
+
+    def _xdotool(self, *args: str) -> str:
+        try:
+            result = subprocess.run(
+                ["xdotool", *args],
+                env=self._env,
+                capture_output=True,
+                timeout=self._timeout,
+                check=True,
+            )
+        except (OSError, subprocess.SubprocessError) as e:
+            raise ToolError(f"xdotool {args[0]} failed: {e}") from None
+        return result.stdout.decode()
+
+    def moveTo(self, x: int, y: int):
+        self._xdotool("mousemove", "--sync", str(x), str(y))
+
+    def mouseDown(self):
+        self._xdotool("mousedown", "1")
+
+    def mouseUp(self):
+        self._xdotool("mouseup", "1")
+
+    def click(self):
+        self._xdotool("click", "1")
+
+    def rightClick(self):
+        self._xdotool("click", "3")
+
+    def middleClick(self):
+        self._xdotool("click", "2")
+
+    def doubleClick(self):
+        self._xdotool("click", "--repeat", "2", "1")
+
+    def press(self, keys: str):
+        self._xdotool("key", "--", keys)
+
+    def hotkey(self, *keys: str):
+        self._xdotool("key", "--", "+".join(keys))
+
+    def typewrite(self, text: str, interval: float | None = None):
+        delay = self._typing_delay_ms if interval is None else round(interval * 1000)
+        self._xdotool("type", "--delay", str(delay), "--", text)
+
+    def position(self) -> tuple[int, int]:
+        output = self._xdotool("getmouselocation", "--shell")
+        values = dict(line.split("=", 1) for line in output.splitlines() if "=" in line)
+        return int(values["X"]), int(values["Y"])
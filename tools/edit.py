@@ -1,11 +1,18 @@
-from collections import defaultdict
+import asyncio
+import os
+import shutil
+import tempfile
 from pathlib import Path
-from typing import Literal, get_args
+from typing import Literal, TypedDict, get_args
 
 from anthropic.types.beta import BetaToolTextEditor20241022Param
 
 from .base import BaseAnthropicTool, CLIResult, ToolError, ToolResult
-from .run import maybe_truncate, run
+from .cache import invalidate_paths
+from .history import EditHistory
+from .lines import forget_index, line_index, read_lines
+from .listing import MAX_ENTRIES, forget_listings, list_directory
+from .run import Truncator
 
 Command = Literal[
     "view",
@@ -13,10 +20,66 @@ Command = Literal[
     "str_replace",
     "insert",
     "undo_edit",
+    "batch",
 ]
 SNIPPET_LINES: int = 4
 
 
+class Edit(TypedDict, total=False):
+    """One edit of a batch: a str_replace or an insert, with that command's parameters."""
+
+    command: Literal["str_replace", "insert"]  # required
+    old_str: str
+    new_str: str
+    insert_line: int
+
+
+def _find_occurrences(text: str, old_str: str) -> list[tuple[int, int]]:
+    """
+    The offset and (1-based) line of each non-overlapping occurrence of old_str, in a
+    single scan of the text.
+    """
+    occurrences = []
+    line, counted = 1, 0
+    start = 0
+    while (offset := text.find(old_str, start)) != -1:
+        line += text.count("\n", counted, offset)
+        counted = offset
+        occurrences.append((offset, line))
+        start = offset + (len(old_str) or 1)
+    return occurrences
+
+
+def _line_offset(text: str, line: int) -> int:
+    """The offset at which (0-based) `line` starts; the text has more than `line` lines."""
+    offset = 0
+    for _ in range(line):
+        offset = text.index("\n", offset) + 1
+    return offset
+
+
+def _context(text: str, begin: int, end: int) -> tuple[int, int]:
+    """
+    The span of the lines of text[begin:end] plus SNIPPET_LINES lines either side,
+    without its final newline.
+    """
+    start = begin
+    for _ in range(SNIPPET_LINES + 1):
+        start = text.rfind("\n", 0, start)
+        if start == -1:
+            break
+    start += 1
+    stop = end
+    for i in range(SNIPPET_LINES + 1):
+        stop = text.find("\n", stop)
+        if stop == -1:
+            stop = len(text)
+            break
+        if i < SNIPPET_LINES:
+            stop += 1
+    return start, stop
+
+
 class EditTool(BaseAnthropicTool):
     """
     An filesystem editor tool that allows the agent to view, create, and edit files.
@@ -26,10 +89,13 @@ class EditTool(BaseAnthropicTool):
     api_type: Literal["text_editor_20241022"] = "text_editor_20241022"
     name: Literal["str_replace_editor"] = "str_replace_editor"
 
-    _file_history: dict[Path, list[str]]
+    _file_history: EditHistory
+    # view_range on files of at least this many bytes reads only the lines asked for
+    _index_threshold = 1024 * 1024
+    _max_listing_entries = MAX_ENTRIES  # entries shown when viewing a directory
 
-    def __init__(self):
-        self._file_history = defaultdict(list)
+    def __init__(self, history: EditHistory | None = None):
+        self._file_history = history if history is not None else EditHistory()
         super().__init__()
 
     def to_params(self) -> BetaToolTextEditor20241022Param:
@@ -48,6 +114,7 @@ class EditTool(BaseAnthropicTool):
         old_str: str | None = None,
         new_str: str | None = None,
         insert_line: int | None = None,
+        edits: list[Edit] | None = None,
         **kwargs,
     ):
         _path = Path(path)
@@ -58,7 +125,7 @@ class EditTool(BaseAnthropicTool):
             if file_text is None:
                 raise ToolError("Parameter `file_text` is required for command: create")
             self.write_file(_path, file_text)
-            self._file_history[_path].append(file_text)
+            self._file_history.push(_path, file_text)
             return ToolResult(output=f"File created successfully at: {_path}")
         elif command == "str_replace":
             if old_str is None:
@@ -76,6 +143,10 @@ class EditTool(BaseAnthropicTool):
             return self.insert(_path, insert_line, new_str)
         elif command == "undo_edit":
             return self.undo_edit(_path)
+        elif command == "batch":
+            if not edits:
+                raise ToolError("Parameter `edits` is required for command: batch")
+            return self.batch(_path, edits)
         raise ToolError(
             f'Unrecognized command {command}. The allowed commands for the {self.name} tool are: {", ".join(get_args(Command))}'
         )
@@ -114,22 +185,30 @@ class EditTool(BaseAnthropicTool):
                     "The `view_range` parameter is not allowed when `path` points to a directory."
                 )
 
-            _, stdout, stderr = await run(
-                rf"find {path} -maxdepth 2 -not -path '*/\.*'"
+            listing = await asyncio.to_thread(
+                list_directory, path, self._max_listing_entries
             )
+            stdout, stderr = listing.output, listing.errors
             if not stderr:
                 stdout = f"Here's the files and directories up to 2 levels deep in {path}, excluding hidden items:\n{stdout}\n"
             return CLIResult(output=stdout, error=stderr)
 
-        file_content = self.read_file(path)
         init_line = 1
-        if view_range:
+        if not view_range:
+            file_content = self.read_file(path)
+        else:
             if len(view_range) != 2 or not all(isinstance(i, int) for i in view_range):
                 raise ToolError(
                     "Invalid `view_range`. It should be a list of two integers."
                 )
-            file_lines = file_content.split("\n")
-            n_lines_file = len(file_lines)
+            # building the index reads the whole file once; keep that off the event loop
+            index = await asyncio.to_thread(line_index, path, self._index_threshold)
+            if index is not None:
+                file_lines = None
+                n_lines_file = index.line_count
+            else:
+                file_lines = self.read_file(path).split("\n")
+                n_lines_file = len(file_lines)
             init_line, final_line = view_range
             if init_line < 1 or init_line > n_lines_file:
                 raise ToolError(
@@ -144,7 +223,9 @@ class EditTool(BaseAnthropicTool):
                     f"Invalid `view_range`: {view_range}. Its second element `{final_line}` should be larger or equal than its first `{init_line}`"
                 )
 
-            if final_line == -1:
+            if file_lines is None:
+                file_content = read_lines(index, init_line, final_line)
+            elif final_line == -1:
                 file_content = "\n".join(file_lines[init_line - 1 :])
             else:
                 file_content = "\n".join(file_lines[init_line - 1 : final_line])
@@ -160,42 +241,39 @@ class EditTool(BaseAnthropicTool):
         old_str = old_str.expandtabs()
         new_str = new_str.expandtabs() if new_str is not None else ""
 
-        # Check if old_str is unique in the file
-        occurrences = file_content.count(old_str)
-        if occurrences == 0:
+        # Find every occurrence, and its line, in one pass
+        occurrences = _find_occurrences(file_content, old_str)
+        if not occurrences:
             raise ToolError(
                 f"No replacement was performed, old_str `{old_str}` did not appear verbatim in {path}."
             )
-        elif occurrences > 1:
-            file_content_lines = file_content.split("\n")
-            lines = [
-                idx + 1
-                for idx, line in enumerate(file_content_lines)
-                if old_str in line
-            ]
+        elif len(occurrences) > 1:
+            lines = sorted({line for _, line in occurrences})
             raise ToolError(
                 f"No replacement was performed. Multiple occurrences of old_str `{old_str}` in lines {lines}. Please ensure it is unique"
             )
 
         # Replace old_str with new_str
-        new_file_content = file_content.replace(old_str, new_str)
+        offset, replacement_line = occurrences[0]
+        new_file_content = (
+            file_content[:offset] + new_str + file_content[offset + len(old_str) :]
+        )
 
         # Write the new content to the file
         self.write_file(path, new_file_content)
 
         # Save the content to history
-        self._file_history[path].append(file_content)
+        self._file_history.push(path, file_content)
 
         # Create a snippet of the edited section
-        replacement_line = file_content.split(old_str)[0].count("\n")
-        start_line = max(0, replacement_line - SNIPPET_LINES)
-        end_line = replacement_line + SNIPPET_LINES + new_str.count("\n")
-        snippet = "\n".join(new_file_content.split("\n")[start_line : end_line + 1])
+        start, stop = _context(new_file_content, offset, offset + len(new_str))
+        start_line = replacement_line - new_file_content.count("\n", start, offset)
+        snippet = new_file_content[start:stop]
 
         # Prepare the success message
         success_msg = f"The file {path} has been edited. "
         success_msg += self._make_output(
-            snippet, f"a snippet of {path}", start_line + 1
+            snippet, f"a snippet of {path}", start_line
         )
         success_msg += "Review the changes and make sure they are as expected. Edit the file again if necessary."
 
@@ -229,7 +307,7 @@ class EditTool(BaseAnthropicTool):
         snippet = "\n".join(snippet_lines)
 
         self.write_file(path, new_file_text)
-        self._file_history[path].append(file_text)
+        self._file_history.push(path, file_text)
 
         success_msg = f"The file {path} has been edited. "
         success_msg += self._make_output(
@@ -240,12 +318,103 @@ class EditTool(BaseAnthropicTool):
         success_msg += "Review the changes and make sure they are as expected (correct indentation, no duplicate lines, etc). Edit the file again if necessary."
         return CLIResult(output=success_msg)
 
+    def batch(self, path: Path, edits: list[Edit]):
+        """
+        Implement the batch command, which applies several str_replace and insert edits
+        to a file in order. Each edit sees the result of the ones before it; if any
+        fails, none is applied. The file is written once, atomically, and a single
+        undo_edit reverts the whole batch.
+        """
+        file_content = self.read_file(path).expandtabs()
+        text = file_content
+        # spans of the text that the edits so far have written
+        spans: list[tuple[int, int]] = []
+        for number, edit in enumerate(edits, start=1):
+            command = edit.get("command")
+            try:
+                begin, removed, new_str, span = self._plan_edit(text, edit)
+            except ToolError as e:
+                raise ToolError(
+                    f"No edits were made. Edit {number} ({command}) failed: {e.message}"
+                ) from None
+            text = text[:begin] + new_str + text[begin + removed :]
+
+            # move the earlier spans along; ones the edit touched merge into its span
+            delta = len(new_str) - removed
+            kept = []
+            for start, stop in spans:
+                if start >= begin + removed:
+                    kept.append((start + delta, stop + delta))
+                elif stop <= begin:
+                    kept.append((start, stop))
+                else:
+                    span = (min(start, span[0]), max(stop + delta, span[1]))
+            spans = kept + [span]
+
+        self.write_file_atomic(path, text)
+        self._file_history.push(path, file_content)
+
+        # one block of context per group of nearby edits
+        blocks: list[tuple[int, int]] = []
+        for start, stop in sorted(_context(text, *span) for span in spans):
+            if blocks and start <= blocks[-1][1] + 1:
+                blocks[-1] = (blocks[-1][0], max(stop, blocks[-1][1]))
+            else:
+                blocks.append((start, stop))
+        snippets = [(text[start:stop], text.count("\n", 0, start) + 1) for start, stop in blocks]
+
+        success_msg = f"The file {path} has been edited with {len(edits)} edits. "
+        success_msg += self._make_output(snippets, f"snippets of {path}")
+        success_msg += "Review the changes and make sure they are as expected. Edit the file again if necessary."
+        return CLIResult(output=success_msg)
+
+    def _plan_edit(self, text: str, edit: Edit) -> tuple[int, int, str, tuple[int, int]]:
+        """
+        Check one edit of a batch against the text; return where it applies, how many
+        characters it removes, the text it inserts there, and the span of the result
+        that it wrote.
+        """
+        command = edit.get("command")
+        if command == "str_replace":
+            if (old_str := edit.get("old_str")) is None:
+                raise ToolError("Parameter `old_str` is required")
+            old_str = old_str.expandtabs()
+            new_str = (edit.get("new_str") or "").expandtabs()
+            occurrences = _find_occurrences(text, old_str)
+            if not occurrences:
+                raise ToolError(f"old_str `{old_str}` did not appear verbatim.")
+            if len(occurrences) > 1:
+                lines = sorted({line for _, line in occurrences})
+                raise ToolError(
+                    f"Multiple occurrences of old_str `{old_str}` in lines {lines}. Please ensure it is unique"
+                )
+            begin = occurrences[0][0]
+            return begin, len(old_str), new_str, (begin, begin + len(new_str))
+
+        if command == "insert":
+            insert_line, new_str = edit.get("insert_line"), edit.get("new_str")
+            if insert_line is None or new_str is None:
+                raise ToolError("Parameters `insert_line` and `new_str` are required")
+            new_str = new_str.expandtabs()
+            n_lines_file = text.count("\n") + 1
+            if insert_line < 0 or insert_line > n_lines_file:
+                raise ToolError(
+                    f"Invalid `insert_line` parameter: {insert_line}. It should be within the range of lines of the file: {[0, n_lines_file]}"
+                )
+            if insert_line == n_lines_file:
+                # after the last line
+                return len(text), 0, "\n" + new_str, (len(text) + 1, len(text) + 1 + len(new_str))
+            begin = _line_offset(text, insert_line)
+            return begin, 0, new_str + "\n", (begin, begin + len(new_str))
+
+        raise ToolError("Unrecognized command; a batch can contain str_replace and insert")
+
     def undo_edit(self, path: Path):
         """Implement the undo_edit command."""
-        if not self._file_history[path]:
+        old_text = self._file_history.pop(path)
+        if old_text is None:
             raise ToolError(f"No edit history found for {path}.")
 
-        old_text = self._file_history[path].pop()
         self.write_file(path, old_text)
 
         return CLIResult(
@@ -265,26 +434,57 @@ class EditTool(BaseAnthropicTool):
             path.write_text(file)
         except Exception as e:
             raise ToolError(f"Ran into {e} while trying to write to {path}") from None
+        finally:
+            invalidate_paths(path)
+            forget_index(path)
+            forget_listings(path)
+
+    def write_file_atomic(self, path: Path, file: str):
+        """
+        Write a file through a temporary file renamed over it, so that it is never seen
+        half written; raise a ToolError if an error occurs.
+        """
+        try:
+            fd, temp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+            try:
+                with os.fdopen(fd, "w") as f:
+                    f.write(file)
+                if path.exists():
+                    shutil.copymode(path, temp)
+                os.replace(temp, path)
+            except BaseException:
+                Path(temp).unlink(missing_ok=True)
+                raise
+        except Exception as e:
+            raise ToolError(f"Ran into {e} while trying to write to {path}") from None
+        finally:
+            invalidate_paths(path)
+            forget_index(path)
+            forget_listings(path)
 
     def _make_output(
         self,
-        file_content: str,
+        file_content: str | list[tuple[str, int]],
         file_descriptor: str,
         init_line: int = 1,
         expand_tabs: bool = True,
     ):
-        """Generate output for the CLI based on the content of a file."""
-        file_content = maybe_truncate(file_content)
-        if expand_tabs:
-            file_content = file_content.expandtabs()
-        file_content = "\n".join(
-            [
-                f"{i + init_line:6}\t{line}"
-                for i, line in enumerate(file_content.split("\n"))
-            ]
-        )
+        """
+        Generate output for the CLI based on the content of a file, or on several
+        snippets of it, each given with the number of its first line.
+        """
+        if isinstance(file_content, str):
+            file_content = [(file_content, init_line)]
+        # number the lines before truncating, so the kept tail shows its real line numbers
+        truncator = Truncator(fold_repeats=False)
+        for number, (content, first_line) in enumerate(file_content):
+            if number:
+                truncator.feed("   ...\n")
+            for i, line in enumerate(content.split("\n")):
+                if expand_tabs:
+                    line = line.expandtabs()
+                truncator.feed(f"{i + first_line:6}\t{line}\n")
         return (
             f"Here's the result of running `cat -n` on {file_descriptor}:\n"
-            + file_content
-            + "\n"
+            + truncator.getvalue()
         )
@@ -0,0 +1,258 @@
+"""Bounded undo history for EditTool, stored as reverse deltas."""
+
+import os
+import shutil
+import sys
+import tempfile
+from dataclasses import dataclass
+from pathlib import Path
+
+from .debug import tool_logger
+
+# characters compared at once when looking for the common prefix and suffix of two texts
+_COMPARE_STEP = 4096
+
+
+def _common_prefix(a: str, b: str) -> int:
+    limit = min(len(a), len(b))
+    i = 0
+    while i + _COMPARE_STEP <= limit and a[i : i + _COMPARE_STEP] == b[i : i + _COMPARE_STEP]:
+        i += _COMPARE_STEP
+    while i < limit and a[i] == b[i]:
+        i += 1
+    return i
+
+
+def _common_suffix(a: str, b: str, limit: int) -> int:
+    la, lb = len(a), len(b)
+    i = 0
+    while (
+        i + _COMPARE_STEP <= limit
+        and a[la - i - _COMPARE_STEP : la - i] == b[lb - i - _COMPARE_STEP : lb - i]
+    ):
+        i += _COMPARE_STEP
+    while i < limit and a[la - i - 1] == b[lb - i - 1]:
+        i += 1
+    return i
+
+
+@dataclass
+class _Entry:
+    """
+    One version of a file. The newest version of a file is held whole; each older one
+    only as the part that differs from the next newer version: it is
+    `newer[:prefix] + middle + newer[len(newer) - suffix:]`.
+    """
+
+    seq: int  # order of the push, across all files
+    middle: str | None  # the whole text for the newest entry; None once spilled
+    prefix: int = 0
+    suffix: int = 0
+    whole: bool = True
+    spilled: Path | None = None
+    spilled_size: int = 0  # bytes on disk
+
+    @property
+    def size(self) -> int:
+        """Bytes held in memory for the text."""
+        return sys.getsizeof(self.middle) if self.middle is not None else 0
+
+
+class EditHistory:
+    """
+    The versions of each file before every edit, for undo. Versions are stored as
+    reverse deltas against the next newer one, so an edit costs about the size of the
+    change rather than of the file. Memory is capped per file and in total; the oldest
+    versions beyond a cap are written to `spill_dir` if one is given, or forgotten.
+    The version the next undo of a file restores is only forgotten to meet the total
+    cap, for the files edited least recently.
+
+    `history[path]` lists the stored versions of a file, oldest first.
+    """
+
+    def __init__(
+        self,
+        max_bytes_per_file: int = 64 * 1024 * 1024,
+        max_bytes: int = 256 * 1024 * 1024,
+        spill_dir: str | os.PathLike | None = None,
+        max_spill_bytes: int = 1024 * 1024 * 1024,
+    ):
+        self.max_bytes_per_file = max_bytes_per_file
+        self.max_bytes = max_bytes
+        self.max_spill_bytes = max_spill_bytes
+        self._spill_root = Path(spill_dir) if spill_dir is not None else None
+        self._spill_dir: Path | None = None
+        self._entries: dict[Path, list[_Entry]] = {}
+        self._seq = 0
+        self._bytes = 0
+        self._spilled_bytes = 0
+        self.spills = 0
+        self.evictions = 0
+
+    def push(self, path: Path, text: str):
+        """Record the version of a file from before an edit."""
+        entries = self._entries.setdefault(path, [])
+        if entries:
+            self._make_delta(entries[-1], text)
+        self._seq += 1
+        entry = _Entry(self._seq, text)
+        entries.append(entry)
+        self._bytes += entry.size
+        self._enforce(path)
+
+    def pop(self, path: Path) -> str | None:
+        """Remove and return the newest recorded version of a file, if there is one."""
+        entries = self._entries.get(path)
+        if not entries:
+            return None
+        newest = entries.pop()
+        text = self._load(newest)
+        self._discard(newest)
+        if entries:
+            # the next version becomes the newest, so it is held whole again
+            older = entries[-1]
+            middle = self._load(older)
+            self._discard(older)
+            entries[-1] = _Entry(
+                older.seq,
+                text[: older.prefix] + middle + text[len(text) - older.suffix :],
+            )
+            self._bytes += entries[-1].size
+            self._enforce(path)
+        else:
+            del self._entries[path]
+        return text
+
+    def __getitem__(self, path: Path) -> list[str]:
+        entries = self._entries.get(path, [])
+        texts: list[str] = []
+        newer = None
+        for entry in reversed(entries):
+            middle = self._load(entry)
+            if entry.whole:
+                newer = middle
+            else:
+                assert newer is not None
+                newer = newer[: entry.prefix] + middle + newer[len(newer) - entry.suffix :]
+            texts.append(newer)
+        return texts[::-1]
+
+    def __contains__(self, path: Path) -> bool:
+        return bool(self._entries.get(path))
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def clear(self, path: Path | None = None):
+        """Forget the history of one file, or of all of them."""
+        paths = [path] if path is not None else list(self._entries)
+        for each in paths:
+            for entry in self._entries.pop(each, []):
+                self._discard(entry)
+        if path is None and self._spill_dir is not None:
+            shutil.rmtree(self._spill_dir, ignore_errors=True)
+            self._spill_dir = None
+
+    @property
+    def stats(self) -> dict[str, int]:
+        return {
+            "files": len(self._entries),
+            "versions": sum(len(entries) for entries in self._entries.values()),
+            "bytes": self._bytes,
+            "spilled_bytes": self._spilled_bytes,
+            "spills": self.spills,
+            "evictions": self.evictions,
+        }
+
+    def _make_delta(self, entry: _Entry, newer: str):
+        """Turn the (whole) newest entry into a delta against the version after it."""
+        text = self._load(entry)
+        prefix = _common_prefix(text, newer)
+        limit = min(len(text), len(newer)) - prefix
+        suffix = _common_suffix(text, newer, limit)
+        self._discard(entry)
+        entry.middle = text[prefix : len(text) - suffix]
+        entry.prefix, entry.suffix, entry.whole = prefix, suffix, False
+        self._bytes += entry.size
+
+    def _load(self, entry: _Entry) -> str:
+        if entry.middle is not None:
+            return entry.middle
+        assert entry.spilled is not None
+        with open(entry.spilled, encoding="utf-8", errors="surrogatepass", newline="") as f:
+            return f.read()
+
+    def _discard(self, entry: _Entry):
+        """Release what an entry holds, in memory and on disk."""
+        self._bytes -= entry.size
+        entry.middle = None
+        if entry.spilled is not None:
+            self._spilled_bytes -= entry.spilled_size
+            entry.spilled.unlink(missing_ok=True)
+            entry.spilled, entry.spilled_size = None, 0
+
+    def _file_bytes(self, path: Path) -> int:
+        return sum(entry.size for entry in self._entries.get(path, []))
+
+    def _sheddable(self, entries: list[_Entry]) -> _Entry | None:
+        """The oldest version of a file that may leave memory, if there is one."""
+        if self._spill_root is not None:
+            return next((entry for entry in entries if entry.middle is not None), None)
+        # the newest version is what the next undo restores; always keep it
+        return entries[0] if len(entries) > 1 else None
+
+    def _enforce(self, path: Path):
+        """Spill or forget the oldest versions until every cap holds."""
+        while self._file_bytes(path) > self.max_bytes_per_file and self._shed(path):
+            pass
+        while self._bytes > self.max_bytes:
+            candidates = [
+                (entry.seq, each)
+                for each, entries in self._entries.items()
+                if (entry := self._sheddable(entries)) is not None
+            ]
+            if candidates:
+                self._shed(min(candidates)[1])
+                continue
+            # then the whole history of the file edited least recently
+            others = [
+                (entries[-1].seq, each) for each, entries in self._entries.items() if each != path
+            ]
+            if not others:
+                break
+            stale = min(others)[1]
+            for entry in self._entries.pop(stale):
+                self._forget(stale, entry)
+
+    def _shed(self, path: Path) -> bool:
+        """Move the oldest version of a file held in memory to disk, or forget it."""
+        entries = self._entries[path]
+        if (entry := self._sheddable(entries)) is None:
+            return False
+        if self._spill_root is not None:
+            self._spill(entry)
+            # past the disk cap, forget the oldest versions after all
+            while self._spilled_bytes > self.max_spill_bytes and len(entries) > 1:
+                self._forget(path, entries.pop(0))
+        else:
+            self._forget(path, entries.pop(0))
+        return True
+
+    def _forget(self, path: Path, entry: _Entry):
+        self._discard(entry)
+        self.evictions += 1
+        tool_logger.debug(f"Forgot an undo version of {path}; older edits cannot be undone")
+
+    def _spill(self, entry: _Entry):
+        if self._spill_dir is None:
+            assert self._spill_root is not None
+            self._spill_root.mkdir(parents=True, exist_ok=True)
+            self._spill_dir = Path(tempfile.mkdtemp(prefix="history-", dir=self._spill_root))
+        path = self._spill_dir / f"{entry.seq}.txt"
+        with open(path, "w", encoding="utf-8", errors="surrogatepass", newline="") as f:
+            f.write(entry.middle)
+        self._bytes -= entry.size
+        entry.middle = None
+        entry.spilled, entry.spilled_size = path, path.stat().st_size
+        self._spilled_bytes += entry.spilled_size
+        self.spills += 1
@@ -0,0 +1,128 @@
+"""Reading line ranges of large files without reading the files whole."""
+
+import locale
+import mmap
+import os
+import threading
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+
+from .base import ToolError
+
+# the index records how many lines start before every chunk of this many bytes
+CHUNK_SIZE = 64 * 1024
+READ_SIZE = 16 * CHUNK_SIZE  # bytes read at once while indexing
+MAX_INDEXES = 32  # indexes kept, most recently used first
+
+
+@dataclass(frozen=True)
+class LineIndex:
+    """
+    Where the lines of a file start, as of one size and modification time. Lines are
+    counted like `str.split("\\n")` counts them; only the line count before each chunk
+    is stored, so the index stays small for any file.
+    """
+
+    path: Path
+    size: int
+    mtime_ns: int
+    line_count: int
+    chunk_lines: array  # newlines before the start of each chunk
+    # lone carriage returns, which Python's universal newlines treat as line breaks too
+    lone_cr: bool
+
+    def offset(self, line: int, data: mmap.mmap) -> int:
+        """The byte offset at which (1-based) `line` starts."""
+        newlines = line - 1
+        if newlines == 0:
+            return 0
+        # the last chunk starting before the newline that ends the previous line
+        chunk = bisect_left(self.chunk_lines, newlines) - 1
+        position = chunk * CHUNK_SIZE
+        for _ in range(newlines - self.chunk_lines[chunk]):
+            position = data.find(b"\n", position) + 1
+        return position
+
+
+_indexes: OrderedDict[Path, LineIndex] = OrderedDict()
+# indexes are built in worker threads and forgotten on the event loop
+_indexes_lock = threading.Lock()
+
+
+def _build(path: Path, stat: os.stat_result) -> LineIndex:
+    chunk_lines = array("q")
+    newlines = 0
+    lone_cr = 0
+    previous_cr = False
+    with open(path, "rb") as f:
+        while block := f.read(READ_SIZE):
+            for start in range(0, len(block), CHUNK_SIZE):
+                chunk_lines.append(newlines)
+                newlines += block.count(b"\n", start, start + CHUNK_SIZE)
+            lone_cr += block.count(b"\r") - block.count(b"\r\n")
+            if previous_cr and block.startswith(b"\n"):
+                lone_cr -= 1  # a CRLF split across reads
+            previous_cr = block.endswith(b"\r")
+    return LineIndex(
+        path=path,
+        size=stat.st_size,
+        mtime_ns=stat.st_mtime_ns,
+        line_count=newlines + 1,
+        chunk_lines=chunk_lines,
+        lone_cr=lone_cr > 0,
+    )
+
+
+def line_index(path: Path, min_size: int = 0) -> LineIndex | None:
+    """
+    The line index of a file of at least `min_size` bytes, built in one streaming pass
+    and cached until the file's size or modification time changes. None if the file
+    is smaller, cannot be examined, or has line breaks the index cannot represent.
+    """
+    try:
+        stat = path.stat()
+        if stat.st_size < max(min_size, 1):
+            return None
+        with _indexes_lock:
+            index = _indexes.get(path)
+        if index is None or (index.size, index.mtime_ns) != (stat.st_size, stat.st_mtime_ns):
+            index = _build(path, stat)
+    except OSError:
+        return None
+    with _indexes_lock:
+        _indexes[path] = index
+        _indexes.move_to_end(path)
+        while len(_indexes) > MAX_INDEXES:
+            _indexes.popitem(last=False)
+    return None if index.lone_cr else index
+
+
+def forget_index(path: Path):
+    """Drop the cached index of a file, e.g. because it was just written."""
+    with _indexes_lock:
+        _indexes.pop(path, None)
+
+
+def read_lines(index: LineIndex, first: int, last: int) -> str:
+    """
+    Lines `first` to `last` (1-based, inclusive; -1 for the end of the file) of an
+    indexed file, decoded and with universal newlines like `Path.read_text`. Only the
+    bytes of those lines are read, through a memory map.
+    """
+    path = index.path
+    try:
+        with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            begin = index.offset(first, data)
+            if last == -1 or last >= index.line_count:
+                end = len(data)
+            else:
+                end = index.offset(last + 1, data) - 1  # without the final newline
+                if end > begin and data[end - 1] == ord("\r"):
+                    end -= 1
+            raw = data[begin:end]
+        return raw.decode(locale.getpreferredencoding(False)).replace("\r\n", "\n")
+    except (OSError, ValueError) as e:
+        raise ToolError(f"Ran into {e} while trying to read {path}") from None
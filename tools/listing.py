@@ -0,0 +1,104 @@
+"""Listing directory trees in-process, like `find DIR -maxdepth 2 -not -path '*/.*'`."""
+
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+
+MAX_DEPTH = 2
+MAX_ENTRIES = 1000  # entries listed before the listing is cut short
+MAX_LISTINGS = 64  # listings cached, most recently used first
+
+
+@dataclass(frozen=True)
+class Listing:
+    output: str  # one path per line, the directory itself first
+    errors: str  # find-style messages for directories that could not be read
+    truncated: bool
+    # the modification time of every directory read; the listing is stale once one changes
+    mtimes: dict[str, int]
+    max_entries: int
+
+
+_listings: OrderedDict[str, Listing] = OrderedDict()
+# listings are made in worker threads and forgotten on the event loop
+_listings_lock = threading.Lock()
+
+
+def _walk(root: str, max_entries: int) -> Listing:
+    lines = [root]
+    errors: list[str] = []
+    mtimes: dict[str, int] = {}
+    truncated = False
+
+    def visit(directory: str, depth: int):
+        nonlocal truncated
+        try:
+            mtimes[directory] = os.stat(directory).st_mtime_ns
+            with os.scandir(directory) as scan:
+                entries = sorted(scan, key=lambda entry: entry.name)
+        except OSError as e:
+            errors.append(f"find: '{directory}': {e.strerror}")
+            return
+        for entry in entries:
+            # hidden items, and everything inside hidden directories, are left out
+            if entry.name.startswith("."):
+                continue
+            if len(lines) > max_entries:
+                truncated = True
+                return
+            lines.append(entry.path)
+            if depth < MAX_DEPTH and entry.is_dir(follow_symlinks=False):
+                visit(entry.path, depth + 1)
+                if truncated:
+                    return
+
+    visit(root, 1)
+    if truncated:
+        lines.append(
+            f"... listing stopped after {max_entries} entries; view a subdirectory to see more"
+        )
+    return Listing(
+        output="\n".join(lines) + "\n",
+        errors="\n".join(errors),
+        truncated=truncated,
+        mtimes=mtimes,
+        max_entries=max_entries,
+    )
+
+
+def _fresh(listing: Listing) -> bool:
+    try:
+        return all(
+            os.stat(directory).st_mtime_ns == mtime for directory, mtime in listing.mtimes.items()
+        )
+    except OSError:
+        return False
+
+
+def list_directory(path: Path, max_entries: int = MAX_ENTRIES) -> Listing:
+    """
+    The files and directories up to MAX_DEPTH levels deep in `path`, without hidden
+    items, at most `max_entries` of them. Listings are cached until a directory they
+    read changes.
+    """
+    root = str(path)
+    with _listings_lock:
+        listing = _listings.get(root)
+    if listing is None or listing.max_entries != max_entries or not _fresh(listing):
+        listing = _walk(root, max_entries)
+    with _listings_lock:
+        _listings[root] = listing
+        _listings.move_to_end(root)
+        while len(_listings) > MAX_LISTINGS:
+            _listings.popitem(last=False)
+    return listing
+
+
+def forget_listings(path: Path):
+    """Drop the cached listings that include the directory of a file just written."""
+    directory = str(path.parent)
+    with _listings_lock:
+        for root in [root for root, listing in _listings.items() if directory in listing.mtimes]:
+            del _listings[root]
@@ -0,0 +1,287 @@
+"""Finding a reference image on screen locally, without asking the model where it is."""
+
+import os
+import re
+from dataclasses import dataclass
+from pathlib import Path
+
+from PIL import Image
+
+from .base import ToolError
+from .debug import tool_logger
+
+try:
+    import numpy as np
+except ImportError:  # optional; only locating templates needs it
+    np = None
+try:
+    import cv2
+except ImportError:  # optional; matching falls back on numpy
+    cv2 = None
+
+# template sizes tried, relative to the reference image, for UIs drawn at another scale
+DEFAULT_SCALES: tuple[float, ...] = (1.0, 0.9, 1.1, 0.8, 1.25)
+# templates are not shrunk below this many pixels a side for the coarse pass
+MIN_TEMPLATE_SIZE = 8
+# the coarse pass keeps candidates this much below the threshold, as shrinking blurs
+COARSE_SLACK = 0.15
+
+_TEMPLATE_NAME = re.compile(r"[\w.-]+")
+
+
+@dataclass(frozen=True)
+class Match:
+    """Where a template was found, in the coordinates of the frame searched."""
+
+    left: int
+    top: int
+    width: int
+    height: int
+    confidence: float  # normalised correlation, 1.0 for an exact match
+
+    @property
+    def center(self) -> tuple[int, int]:
+        return self.left + self.width // 2, self.top + self.height // 2
+
+    def contains(self, x: int, y: int) -> bool:
+        return self.left <= x < self.left + self.width and self.top <= y < self.top + self.height
+
+
+def _require_numpy():
+    if np is None:
+        raise ToolError("locating templates needs numpy")
+
+
+def _fft_length(n: int) -> int:
+    """The smallest length of at least n with no prime factor above 5, which FFTs handle fastest."""
+    best = 2 * n
+    power5 = 1
+    while power5 < best:
+        power35 = power5
+        while power35 < best:
+            length = power35
+            while length < n:
+                length *= 2
+            best = min(best, length)
+            power35 *= 3
+        power5 *= 5
+    return best
+
+
+class _PreparedFrame:
+    """
+    A greyscale frame prepared for matching templates of up to `max_size` against it:
+    its spectrum and integral images are computed once, however many templates (or
+    scales of one) are matched.
+    """
+
+    def __init__(self, frame: Image.Image, max_size: tuple[int, int]):
+        if cv2 is not None:
+            self._pixels = np.asarray(frame)
+            return
+        f = np.asarray(frame, dtype=np.float64)
+        height, width = f.shape
+        self._shape = (
+            _fft_length(height + max_size[1] - 1),
+            _fft_length(width + max_size[0] - 1),
+        )
+        self._size = height, width
+        self._spectrum = np.fft.rfft2(f, self._shape)
+        self._integral = np.pad(f.cumsum(0).cumsum(1), ((1, 0), (1, 0)))
+        self._squares_integral = np.pad((f * f).cumsum(0).cumsum(1), ((1, 0), (1, 0)))
+
+    def scores(self, template: Image.Image):
+        if cv2 is not None:
+            return cv2.matchTemplate(self._pixels, np.asarray(template), cv2.TM_CCOEFF_NORMED)
+
+        t = np.asarray(template, dtype=np.float64)
+        (H, W), (h, w) = self._size, t.shape
+        t = t - t.mean()
+        t_norm = np.sqrt((t * t).sum())
+
+        # correlate through the FFT; t has zero mean, so this is the covariance numerator
+        spectrum = self._spectrum * np.fft.rfft2(t[::-1, ::-1], self._shape)
+        correlation = np.fft.irfft2(spectrum, self._shape)[h - 1 : H, w - 1 : W]
+
+        def window_sums(integral):
+            return integral[h:, w:] - integral[:-h, w:] - integral[h:, :-w] + integral[:-h, :-w]
+
+        sums = window_sums(self._integral)
+        variance = np.maximum(window_sums(self._squares_integral) - sums * sums / (h * w), 0)
+        denominator = np.sqrt(variance) * t_norm
+        scores = np.zeros_like(correlation)
+        # flat windows match nothing
+        np.divide(correlation, denominator, out=scores, where=denominator > 1e-6)
+        return scores
+
+
+def match_scores(frame: Image.Image, template: Image.Image):
+    """
+    The normalised correlation coefficient of a greyscale template at every position
+    in a greyscale frame (OpenCV's TM_CCOEFF_NORMED), as an array of shape
+    (frame height - template height + 1, frame width - template width + 1).
+    """
+    _require_numpy()
+    return _PreparedFrame(frame, template.size).scores(template)
+
+
+def _peaks(scores, threshold: float, limit: int, width: int, height: int):
+    """The best positions scoring at least `threshold`, at most one per template area."""
+    scores = scores.copy()
+    found = []
+    while len(found) < limit:
+        y, x = divmod(int(scores.argmax()), scores.shape[1])
+        score = float(scores[y, x])
+        if score < threshold:
+            break
+        found.append((x, y, score))
+        scores[
+            max(0, y - height // 2) : y + height // 2 + 1,
+            max(0, x - width // 2) : x + width // 2 + 1,
+        ] = -1
+    return found
+
+
+def find_template(
+    frame: Image.Image,
+    template: Image.Image,
+    threshold: float = 0.8,
+    max_matches: int = 5,
+    scales: tuple[float, ...] = DEFAULT_SCALES,
+    downscale: int = 4,
+) -> list[Match]:
+    """
+    Find up to `max_matches` places where `template` appears in `frame`, best first.
+
+    The scales of the template are tried in order until one matches. Each is first
+    matched against one copy of the frame, shrunk up to `downscale` times, which is
+    fast but coarse; each candidate is then located exactly by matching at full
+    resolution in a small window around it.
+    """
+    _require_numpy()
+    frame = frame.convert("L")
+    template = template.convert("L")
+    low, high = template.getextrema()
+    if low == high:
+        raise ToolError("the template is a single color; there is nothing to match")
+
+    sizes = {
+        scale: (round(template.width * scale), round(template.height * scale))
+        for scale in scales
+    }
+    sizes = {
+        scale: (width, height)
+        for scale, (width, height) in sizes.items()
+        if width <= frame.width and height <= frame.height and min(width, height) >= 2
+    }
+    if not sizes:
+        return []
+    # shrink as far as the smallest template allows
+    factor = max(
+        1, min(downscale, min(min(size) for size in sizes.values()) // MIN_TEMPLATE_SIZE)
+    )
+    largest = max(size[0] for size in sizes.values()), max(size[1] for size in sizes.values())
+    prepared = _PreparedFrame(
+        frame if factor == 1 else frame.reduce(factor),
+        (largest[0] // factor, largest[1] // factor),
+    )
+
+    found: list[Match] = []
+    for scale, (width, height) in sizes.items():
+        scaled = template if scale == 1.0 else template.resize((width, height), Image.Resampling.BOX)
+        coarse_template = (
+            scaled
+            if factor == 1
+            else scaled.resize((width // factor, height // factor), Image.Resampling.BOX)
+        )
+        coarse = _peaks(
+            prepared.scores(coarse_template),
+            threshold - COARSE_SLACK if factor > 1 else threshold,
+            max_matches * 2,
+            coarse_template.width,
+            coarse_template.height,
+        )
+        for x, y, score in coarse:
+            if factor > 1:
+                # refine at full resolution around the coarse position
+                left, top = max(0, (x - 1) * factor), max(0, (y - 1) * factor)
+                window = frame.crop(
+                    (
+                        left,
+                        top,
+                        min(frame.width, (x + 1) * factor + width),
+                        min(frame.height, (y + 1) * factor + height),
+                    )
+                )
+                scores = match_scores(window, scaled)
+                dy, dx = divmod(int(scores.argmax()), scores.shape[1])
+                x, y, score = left + dx, top + dy, float(scores[dy, dx])
+            if score >= threshold:
+                found.append(Match(x, y, width, height, round(score, 4)))
+        if found:
+            # scales are tried most likely first; the rest would only find the same elements
+            break
+
+    # keep the best of overlapping matches
+    matches: list[Match] = []
+    for match in sorted(found, key=lambda match: match.confidence, reverse=True):
+        if not any(kept.contains(*match.center) for kept in matches):
+            matches.append(match)
+        if len(matches) == max_matches:
+            break
+    return matches
+
+
+class TemplateLibrary:
+    """
+    Named reference images for locating UI elements, so a workflow can find the same
+    button again without sending it anywhere. Given a `root`, templates are also kept
+    there as PNG files and outlive the process.
+    """
+
+    def __init__(self, root: str | os.PathLike | None = None):
+        self.root = Path(root) if root is not None else None
+        self._templates: dict[str, Image.Image] = {}
+
+    @staticmethod
+    def _check_name(name: str):
+        if not _TEMPLATE_NAME.fullmatch(name):
+            raise ToolError(
+                f"Invalid template name {name!r}: use letters, digits, '_', '-' and '.'"
+            )
+
+    def add(self, name: str, image: Image.Image):
+        self._check_name(name)
+        image = image.copy()
+        self._templates[name] = image
+        if self.root is not None:
+            self.root.mkdir(parents=True, exist_ok=True)
+            path = self.root / f"{name}.png"
+            temp = path.with_name(f".{path.name}.tmp")
+            image.save(temp, format="PNG")
+            os.replace(temp, path)
+        tool_logger.debug(f"Stored template {name} ({image.width}x{image.height})")
+
+    def get(self, name: str) -> Image.Image | None:
+        if (image := self._templates.get(name)) is not None:
+            return image
+        if self.root is None or not _TEMPLATE_NAME.fullmatch(name):
+            return None
+        path = self.root / f"{name}.png"
+        try:
+            with Image.open(path) as stored:
+                image = stored.copy()
+        except OSError:
+            return None
+        self._templates[name] = image
+        return image
+
+    def __contains__(self, name: str) -> bool:
+        return self.get(name) is not None
+
+    @property
+    def names(self) -> list[str]:
+        names = set(self._templates)
+        if self.root is not None and self.root.is_dir():
+            names.update(path.stem for path in self.root.glob("*.png"))
+        return sorted(names)
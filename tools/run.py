@@ -1,42 +1,361 @@
 """Utility to run shell commands asynchronously with a timeout."""
 
 import asyncio
+import codecs
+import os
+import shutil
+import sys
+import time
+import weakref
+from collections import deque
+from dataclasses import dataclass
 
-TRUNCATED_MESSAGE: str = "<response clipped><NOTE>To save on context only part of this file has been shown to you. You should retry this tool after you have searched inside the file with `grep -n` in order to find the line numbers of what you are looking for.</NOTE>"
+from .cache import CommandCache, command_kind
+from .debug import tool_logger
+
+TRUNCATED_MESSAGE: str = "<response clipped><NOTE>To save on context only the start and the end of this output have been shown to you; {chars} characters ({lines} lines) were left out here.{detail} You should retry this tool after you have searched inside the file with `grep -n` in order to find the line numbers of what you are looking for.</NOTE>"
+REPEATED_MESSAGE: str = "<previous line repeated {count} more times>\n"
 MAX_RESPONSE_LEN: int = 16000
+CHARS_PER_TOKEN: int = 4  # rough average for English text, code and logs
+MAX_RESPONSE_TOKENS: int = MAX_RESPONSE_LEN // CHARS_PER_TOKEN
+READ_SIZE: int = 64 * 1024  # bytes
+
+# a command containing any of these needs cmd.exe to interpret it
+SHELL_METACHARACTERS: frozenset[str] = frozenset("|&;<>()^%!\"'`$*?[]{}~\n")
+# commands built into cmd.exe, which have no executable of their own
+CMD_BUILTINS: frozenset[str] = frozenset(
+    {
+        "assoc", "call", "cd", "chdir", "cls", "copy", "date", "del", "dir",
+        "echo", "endlocal", "erase", "for", "ftype", "goto", "if", "md", "mkdir",
+        "mklink", "move", "path", "pause", "popd", "prompt", "pushd", "rd", "ren",
+        "rename", "rmdir", "set", "setlocal", "shift", "start", "time", "title",
+        "type", "ver", "verify", "vol",
+    }
+)
+
+
+def estimate_tokens(text: str) -> int:
+    """Roughly estimate how many input tokens `text` will cost."""
+    return -(-len(text) // CHARS_PER_TOKEN)
+
+
+class Truncator:
+    """
+    Head+tail truncation of streamed text to a budget in estimated tokens.
+
+    Text is passed in with `feed()` in pieces of any size. Only the head, a bounded
+    tail and counters for the dropped middle are kept, so arbitrarily large output
+    can pass through in constant memory. Runs of identical lines after the head are
+    folded into one line and a repeat marker, unless `fold_repeats` is off (e.g. for
+    numbered file listings, where every line is distinct anyway).
+    """
+
+    def __init__(
+        self,
+        max_tokens: int | None = MAX_RESPONSE_TOKENS,
+        head_fraction: float = 0.5,
+        fold_repeats: bool = True,
+    ):
+        budget = sys.maxsize if max_tokens is None else max_tokens * CHARS_PER_TOKEN
+        self._budget = budget
+        self._head_budget = int(budget * head_fraction)
+        self._fold_repeats = fold_repeats
+        self._head: list[str] = []
+        self._head_size = 0
+        self._head_full = False
+        # [segment, times seen in a row]
+        self._tail: deque[list] = deque()
+        self._tail_size = 0
+        self._partial = ""
+        self.total_chars = 0
+        self.omitted_chars = 0
+        self.omitted_lines = 0
+
+    def feed(self, text: str):
+        self.total_chars += len(text)
+        data = self._partial + text
+        start = 0
+        while (end := data.find("\n", start)) != -1:
+            self._add(data[start : end + 1])
+            start = end + 1
+        self._partial = data[start:]
+        # a line without a newline must not grow without bound either
+        while len(self._partial) > self._budget:
+            self._add(self._partial[: self._budget])
+            self._partial = self._partial[self._budget :]
+
+    def _entry_size(self, segment: str, count: int) -> int:
+        return len(segment) + (len(REPEATED_MESSAGE) + 4 if count > 1 else 0)
+
+    def _add(self, segment: str):
+        if not self._head_full:
+            if self._head_size + len(segment) <= self._head_budget:
+                self._head.append(segment)
+                self._head_size += len(segment)
+                return
+            self._head_full = True
+            if not self._head:
+                # a single huge first line: keep its start in the head
+                self._head.append(segment[: self._head_budget])
+                self._head_size = self._head_budget
+                segment = segment[self._head_budget :]
+
+        last = self._tail[-1] if self._tail else None
+        if self._fold_repeats and last is not None and last[0] == segment:
+            self._tail_size -= self._entry_size(*last)
+            last[1] += 1
+            self._tail_size += self._entry_size(*last)
+        else:
+            self._tail.append([segment, 1])
+            self._tail_size += self._entry_size(segment, 1)
+
+        if self.total_chars <= self._budget:
+            # everything so far fits; drop nothing yet
+            return
+        # the tail may also use whatever the head left of its share
+        tail_budget = self._budget - self._head_size
+        while self._tail_size > tail_budget and len(self._tail) > 1:
+            dropped, count = self._tail.popleft()
+            self._tail_size -= self._entry_size(dropped, count)
+            self.omitted_chars += len(dropped) * count
+            self.omitted_lines += count
+        entry = self._tail[0]
+        if self._tail_size > tail_budget and entry[1] == 1:
+            # a single huge last line: keep its end
+            cut = self._tail_size - tail_budget
+            self.omitted_chars += cut
+            entry[0] = entry[0][cut:]
+            self._tail_size -= cut
+
+    def getvalue(self, detail: str = "") -> str:
+        """
+        Return the kept text. If anything was left out, a notice (including `detail`,
+        e.g. where the full output can be found) marks the spot.
+        """
+        if self._partial:
+            self._add(self._partial)
+            self._partial = ""
+        head = "".join(self._head)
+        if self.total_chars <= self._budget:
+            # everything fits; no need to fold anything
+            return head + "".join(segment * count for segment, count in self._tail)
+
+        tail = "".join(
+            segment
+            if count == 1
+            else segment
+            + ("" if segment.endswith("\n") else "\n")
+            + REPEATED_MESSAGE.format(count=count - 1)
+            for segment, count in self._tail
+        )
+        if not self.omitted_chars:
+            return head + tail
+        if head and not head.endswith("\n"):
+            head += "\n"
+        notice = TRUNCATED_MESSAGE.format(
+            chars=self.omitted_chars,
+            lines=self.omitted_lines,
+            detail=detail and f" {detail}",
+        )
+        return head + notice + "\n" + tail
+
+
+def truncate(
+    content: str,
+    max_tokens: int | None = MAX_RESPONSE_TOKENS,
+    fold_repeats: bool = True,
+) -> str:
+    """Truncate content to a head and tail within `max_tokens` estimated tokens."""
+    if max_tokens is None or estimate_tokens(content) <= max_tokens:
+        return content
+    truncator = Truncator(max_tokens, fold_repeats=fold_repeats)
+    truncator.feed(content)
+    return truncator.getvalue()
 
 
 def maybe_truncate(content: str, truncate_after: int | None = MAX_RESPONSE_LEN):
-    """Truncate content and append a notice if content exceeds the specified length."""
-    return (
-        content
-        if not truncate_after or len(content) <= truncate_after
-        else content[:truncate_after] + TRUNCATED_MESSAGE
-    )
+    """Truncate content and insert a notice if content exceeds the specified length."""
+    if not truncate_after or len(content) <= truncate_after:
+        return content
+    return truncate(content, max_tokens=truncate_after // CHARS_PER_TOKEN)
+
+
+async def _read_truncated(
+    stream: asyncio.StreamReader, max_tokens: int | None
+) -> str:
+    """Read a stream to EOF through a Truncator, never holding all of it."""
+    truncator = Truncator(max_tokens)
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    while chunk := await stream.read(READ_SIZE):
+        truncator.feed(decoder.decode(chunk))
+    truncator.feed(decoder.decode(b"", final=True))
+    return truncator.getvalue()
+
+
+@dataclass(kw_only=True, frozen=True)
+class CommandResult:
+    """The outcome of a command run by a CommandExecutor."""
+
+    cmd: str | list[str]
+    returncode: int
+    stdout: str
+    stderr: str
+    shell: bool  # whether the command went through cmd.exe
+    spawn_time: float  # seconds spent starting the process
+    wall_time: float  # seconds from starting the process until it exited
+
+
+def direct_argv(cmd: str | list[str]) -> list[str] | None:
+    """
+    Return the argv to execute `cmd` directly, or None if it needs cmd.exe
+    (pipes, redirection, quoting, variables, builtins, or an unknown program).
+    """
+    if isinstance(cmd, list):
+        return cmd
+    if any(char in SHELL_METACHARACTERS for char in cmd):
+        return None
+    argv = cmd.split()
+    if not argv or argv[0].lower() in CMD_BUILTINS:
+        return None
+    executable = shutil.which(argv[0])
+    if executable is None:
+        return None
+    return [executable, *argv[1:]]
+
+
+class CommandExecutor:
+    """
+    Runs commands concurrently, with at most `max_concurrency` processes alive at once.
+    Commands that need no shell features are executed directly instead of via cmd.exe.
+    """
+
+    def __init__(self, max_concurrency: int | None = None):
+        self.max_concurrency = max_concurrency or os.cpu_count() or 4
+        # a semaphore only works within one event loop; each loop gets its own
+        self._semaphores: weakref.WeakKeyDictionary[
+            asyncio.AbstractEventLoop, asyncio.Semaphore
+        ] = weakref.WeakKeyDictionary()
+
+    @property
+    def _semaphore(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        if (semaphore := self._semaphores.get(loop)) is None:
+            semaphore = self._semaphores[loop] = asyncio.Semaphore(self.max_concurrency)
+        return semaphore
+
+    async def run(
+        self,
+        cmd: str | list[str],
+        timeout: float | None = 120.0,  # seconds
+        max_tokens: int | None = MAX_RESPONSE_TOKENS,
+    ) -> CommandResult:
+        """Run one command, waiting for a free slot first."""
+        async with self._semaphore:
+            return await self._run(cmd, timeout, max_tokens)
+
+    async def run_many(
+        self,
+        cmds: list[str | list[str]],
+        timeout: float | None = 120.0,  # seconds, per command
+        max_tokens: int | None = MAX_RESPONSE_TOKENS,
+    ) -> list[CommandResult]:
+        """Run a batch of commands concurrently; results are in the order of `cmds`."""
+        return await asyncio.gather(*(self.run(cmd, timeout, max_tokens) for cmd in cmds))
+
+    async def _run(
+        self,
+        cmd: str | list[str],
+        timeout: float | None,
+        max_tokens: int | None,
+    ) -> CommandResult:
+        argv = direct_argv(cmd)
+        start = time.perf_counter()
+        if argv is None:
+            process = await asyncio.create_subprocess_shell(
+                f"cmd.exe /c {cmd}",
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+            )
+        else:
+            process = await asyncio.create_subprocess_exec(
+                *argv, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+            )
+        spawn_time = time.perf_counter() - start
+
+        # we know these are not None because we created the process with PIPEs
+        assert process.stdout
+        assert process.stderr
+        try:
+            stdout, stderr, _ = await asyncio.wait_for(
+                asyncio.gather(
+                    _read_truncated(process.stdout, max_tokens),
+                    _read_truncated(process.stderr, max_tokens),
+                    process.wait(),
+                ),
+                timeout=timeout,
+            )
+        except asyncio.TimeoutError as exc:
+            try:
+                process.kill()
+            except ProcessLookupError:
+                pass
+            raise TimeoutError(
+                f"Command '{cmd}' timed out after {timeout} seconds"
+            ) from exc
+
+        wall_time = time.perf_counter() - start
+        tool_logger.debug(
+            f"Command '{cmd}' ({'shell' if argv is None else 'direct'}) took "
+            f"{wall_time:.4f}s, of which {spawn_time:.4f}s spawning"
+        )
+        return CommandResult(
+            cmd=cmd,
+            returncode=process.returncode or 0,
+            stdout=stdout,
+            stderr=stderr,
+            shell=argv is None,
+            spawn_time=spawn_time,
+            wall_time=wall_time,
+        )
+
+
+_executor = CommandExecutor()
 
 
 async def run(
-    cmd: str,
+    cmd: str | list[str],
     timeout: float | None = 120.0,  # seconds
     truncate_after: int | None = MAX_RESPONSE_LEN,
+    cache: CommandCache | None = None,
 ):
-    """Run a shell command asynchronously with a timeout."""
-    process = await asyncio.create_subprocess_shell(
-        f"cmd.exe /c {cmd}", stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
-    )
-
+    """
+    Run a shell command asynchronously with a timeout. With a `cache`, read-only
+    commands are answered from it while the paths they involve are unchanged.
+    """
+    cache_key = cmd if cache is not None and isinstance(cmd, str) else None
+    cwd = os.getcwd()
+    if cache_key is not None and (cached := cache.get(cache_key, cwd)) is not None:
+        return cached
     try:
-        stdout, stderr = await asyncio.wait_for(process.communicate(), timeout=timeout)
-        return (
-            process.returncode or 0,
-            maybe_truncate(stdout.decode(), truncate_after=truncate_after),
-            maybe_truncate(stderr.decode(), truncate_after=truncate_after),
+        result = await _executor.run(
+            cmd,
+            timeout=timeout,
+            max_tokens=truncate_after // CHARS_PER_TOKEN if truncate_after else None,
         )
-    except asyncio.TimeoutError as exc:
-        try:
-            process.kill()
-        except ProcessLookupError:
-            pass
-        raise TimeoutError(
-            f"Command '{cmd}' timed out after {timeout} seconds"
-        ) from exc
+    except TimeoutError:
+        if cache_key is not None and command_kind(cache_key) == "write":
+            cache.clear()
+        raise
+    output = result.returncode, result.stdout, result.stderr
+    if cache_key is not None:
+        cache.put(cache_key, cwd, output)
+    return output
+
+
+async def run_many(
+    cmds: list[str | list[str]],
+    timeout: float | None = 120.0,  # seconds, per command
+    max_tokens: int | None = MAX_RESPONSE_TOKENS,
+) -> list[CommandResult]:
+    """Run a batch of shell commands concurrently with the shared executor."""
+    return await _executor.run_many(cmds, timeout=timeout, max_tokens=max_tokens)
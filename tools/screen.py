@@ -0,0 +1,195 @@
+"""Screen capture backends, and a micro-benchmark comparing them."""
+
+import argparse
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import time
+from abc import ABCMeta, abstractmethod
+from typing import ClassVar
+
+from PIL import Image, ImageGrab
+
+from .base import ToolError
+from .debug import tool_logger
+
+try:
+    import mss
+except ImportError:  # optional; the ImageGrab backend works everywhere
+    mss = None
+
+BBox = tuple[int, int, int, int]  # left, top, right, bottom
+
+# screen sizes the benchmark covers by default
+BENCHMARK_SIZES: tuple[tuple[int, int], ...] = ((1024, 768), (1920, 1080), (2560, 1440))
+
+
+class CaptureBackend(metaclass=ABCMeta):
+    """
+    Grabs the screen, or a box of it, as an RGB image.
+
+    The image returned by `grab()` may be a buffer the backend reuses: it stays valid
+    until the second-next call, so a caller can keep the previous frame to compare
+    against, but must copy a frame it wants to keep for longer.
+    """
+
+    name: ClassVar[str]
+
+    @abstractmethod
+    def grab(self, bbox: BBox | None = None) -> Image.Image:
+        ...
+
+    def close(self):
+        pass
+
+
+class ImageGrabBackend(CaptureBackend):
+    """PIL's ImageGrab: GDI on Windows, XGetImage on X11. Allocates a new image per grab."""
+
+    name: ClassVar[str] = "imagegrab"
+
+    def __init__(self, display: str | None = None):
+        self._display = display
+
+    def grab(self, bbox: BBox | None = None) -> Image.Image:
+        try:
+            image = ImageGrab.grab(bbox=bbox, xdisplay=self._display)
+        except OSError as e:
+            raise ToolError(f"Failed to take screenshot: {e}") from None
+        return image if image.mode == "RGB" else image.convert("RGB")
+
+
+class MssBackend(CaptureBackend):
+    """
+    mss, which captures through XShm shared memory on X11 (and GDI/CoreGraphics
+    elsewhere). Pixels are decoded into two alternating, reused image buffers, so
+    steady-state captures allocate no new images.
+    """
+
+    name: ClassVar[str] = "mss"
+
+    def __init__(self, display: str | None = None):
+        if mss is None:
+            raise ToolError("the mss capture backend needs the mss package")
+        kwargs = {"display": display} if display and sys.platform == "linux" else {}
+        try:
+            self._sct = mss.mss(**kwargs)
+        except mss.ScreenShotError as e:
+            raise ToolError(f"Failed to open the screen: {e}") from None
+        self._buffers: list[Image.Image | None] = [None, None]
+        self._next = 0
+
+    def grab(self, bbox: BBox | None = None) -> Image.Image:
+        # like ImageGrab, default to the primary monitor
+        monitor = bbox if bbox is not None else self._sct.monitors[1]
+        try:
+            shot = self._sct.grab(monitor)
+        except mss.ScreenShotError as e:
+            raise ToolError(f"Failed to take screenshot: {e}") from None
+
+        frame = self._buffers[self._next]
+        if frame is None or frame.size != shot.size:
+            frame = self._buffers[self._next] = Image.new("RGB", shot.size)
+        self._next = 1 - self._next
+        frame.frombytes(shot.raw, "raw", "BGRX")
+        return frame
+
+    def close(self):
+        self._sct.close()
+
+
+BACKENDS: dict[str, type[CaptureBackend]] = {
+    MssBackend.name: MssBackend,
+    ImageGrabBackend.name: ImageGrabBackend,
+}
+
+
+def default_backend(display: str | None = None) -> CaptureBackend:
+    """
+    The backend named by the CAPTURE_BACKEND environment variable, or else the fastest
+    one available.
+    """
+    if name := os.getenv("CAPTURE_BACKEND"):
+        if name not in BACKENDS:
+            raise ToolError(f"Unknown capture backend {name}; choose from {', '.join(BACKENDS)}")
+        return BACKENDS[name](display)
+    if mss is not None:
+        try:
+            return MssBackend(display)
+        except ToolError as e:
+            tool_logger.warning(f"mss capture backend unavailable, using ImageGrab: {e}")
+    return ImageGrabBackend(display)
+
+
+def benchmark(
+    backend: CaptureBackend, size: tuple[int, int], iterations: int = 50
+) -> dict[str, float]:
+    """Time `iterations` grabs of a box of `size` from the top left of the screen."""
+    bbox = (0, 0, *size)
+    backend.grab(bbox)  # warm up
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        backend.grab(bbox)
+        timings.append(time.perf_counter() - start)
+    return {
+        "median_ms": statistics.median(timings) * 1000,
+        "mean_ms": statistics.fmean(timings) * 1000,
+        "max_ms": max(timings) * 1000,
+    }
+
+
+def _start_xvfb(display: str, size: tuple[int, int]) -> subprocess.Popen:
+    server = subprocess.Popen(
+        ["Xvfb", display, "-screen", "0", f"{size[0]}x{size[1]}x24", "-nolisten", "tcp"],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    time.sleep(1.0)  # Xvfb has no readiness signal
+    return server
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description="Compare screen capture latency per backend.")
+    parser.add_argument("--backend", action="append", choices=list(BACKENDS))
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument(
+        "--xvfb",
+        metavar="DISPLAY",
+        help="run a private Xvfb server on DISPLAY (e.g. :99) sized for each benchmark",
+    )
+    args = parser.parse_args(argv)
+
+    names = args.backend or [name for name in BACKENDS if name != "mss" or mss is not None]
+    if args.xvfb and shutil.which("Xvfb") is None:
+        parser.error("Xvfb is not installed")
+
+    print(f"{'backend':<10} {'size':>10} {'median ms':>10} {'mean ms':>10} {'max ms':>10}")
+    for size in BENCHMARK_SIZES:
+        server = _start_xvfb(args.xvfb, size) if args.xvfb else None
+        try:
+            for name in names:
+                try:
+                    backend = BACKENDS[name](args.xvfb)
+                    try:
+                        result = benchmark(backend, size, args.iterations)
+                    finally:
+                        backend.close()
+                except ToolError as e:
+                    # e.g. no display, or the screen is smaller than the box
+                    print(f"{name:<10} {size[0]:>5}x{size[1]:<4} failed: {e.message}")
+                    continue
+                print(
+                    f"{name:<10} {size[0]:>5}x{size[1]:<4} {result['median_ms']:>10.2f} "
+                    f"{result['mean_ms']:>10.2f} {result['max_ms']:>10.2f}"
+                )
+        finally:
+            if server is not None:
+                server.terminate()
+                server.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""Bounded, content-addressed storage for screenshots."""
+
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+
+from .debug import tool_logger
+
+
+@dataclass
+class _StoredImage:
+    path: Path
+    size: int  # bytes
+    used: float  # time of the last put or lookup, as a timestamp
+
+
+class ScreenshotStore:
+    """
+    Stores images under the hash of their content, so an identical frame is stored
+    once however often it is taken. The store is kept under `max_bytes` and
+    `max_age` seconds by evicting the least recently used images.
+    """
+
+    def __init__(
+        self,
+        root: str | os.PathLike,
+        max_bytes: int = 256 * 1024 * 1024,
+        max_age: float | None = 24 * 60 * 60,
+    ):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self._images: OrderedDict[str, _StoredImage] | None = None
+        self._size = 0
+        # puts run on worker threads
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    @staticmethod
+    def hash(data: bytes) -> str:
+        return hashlib.sha256(data).hexdigest()
+
+    def _index(self) -> OrderedDict[str, _StoredImage]:
+        """Load what earlier runs stored, oldest first, on first use."""
+        if self._images is None:
+            self.root.mkdir(parents=True, exist_ok=True)
+            found = []
+            for entry in os.scandir(self.root):
+                name, _, _ = entry.name.partition(".")
+                if entry.is_file() and len(name) == 64:
+                    stat = entry.stat()
+                    found.append((name, _StoredImage(Path(entry.path), stat.st_size, stat.st_mtime)))
+            found.sort(key=lambda item: item[1].used)
+            self._images = OrderedDict(found)
+            self._size = sum(image.size for image in self._images.values())
+        return self._images
+
+    def put(self, data: bytes, suffix: str = "png") -> str:
+        """Store an image (if it is not stored already) and return its hash."""
+        image_hash = self.hash(data)
+        with self._lock:
+            images = self._index()
+            now = time.time()
+            if (stored := images.get(image_hash)) is not None and stored.path.exists():
+                stored.used = now
+                images.move_to_end(image_hash)
+                os.utime(stored.path, (now, now))
+                return image_hash
+
+            path = self.root / f"{image_hash}.{suffix}"
+            temp = path.with_name(f".{path.name}.tmp")
+            temp.write_bytes(data)
+            os.replace(temp, path)
+            if stored is not None:
+                self._size -= stored.size
+            images[image_hash] = _StoredImage(path, len(data), now)
+            images.move_to_end(image_hash)
+            self._size += len(data)
+            self._evict(now)
+        return image_hash
+
+    def path(self, image_hash: str) -> Path | None:
+        """The file holding the image with this hash, if it is stored."""
+        with self._lock:
+            stored = self._index().get(image_hash)
+            if stored is None or not stored.path.exists():
+                return None
+            stored.used = time.time()
+            self._images.move_to_end(image_hash)
+            return stored.path
+
+    def get(self, image_hash: str) -> bytes | None:
+        """The image with this hash, if it is stored."""
+        path = self.path(image_hash)
+        try:
+            return path.read_bytes() if path is not None else None
+        except OSError:
+            return None
+
+    def _evict(self, now: float):
+        images = self._images
+        assert images is not None
+        while images:
+            image_hash, oldest = next(iter(images.items()))
+            too_old = self.max_age is not None and now - oldest.used > self.max_age
+            # never evict the image that was just stored
+            if not (too_old or self._size > self.max_bytes) or len(images) == 1:
+                break
+            del images[image_hash]
+            self._size -= oldest.size
+            self.evictions += 1
+            try:
+                oldest.path.unlink()
+            except OSError as e:
+                tool_logger.debug(f"Could not remove evicted screenshot {oldest.path}: {e}")
+
+    @property
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            images = self._index()
+            return {"images": len(images), "bytes": self._size, "evictions": self.evictions}